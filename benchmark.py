@@ -0,0 +1,286 @@
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import proxytest
+
+# Offline benchmark of the monitor's own overhead: probe cost, stats computation per tick,
+# render time, memory of the sample buffers and time until the best proxy is chosen.
+# The network is replaced by proxytest.FakeNetwork (and fake ping/traceroute executables
+# for the subprocess backend), so results are deterministic and comparable across commits.
+
+# Fake ping executable: prints a Linux-style reply line with a per-host RTT, or one line per
+# interval with -i (streaming backend), skipping about 1% of the sequence numbers as losses
+FAKE_PING = '''#!{python}
+import sys, time, zlib, random
+host = sys.argv[-1]
+base = 5 + zlib.crc32(host.encode()) % 60
+print(f"PING {{host}} ({{host}}) 56(84) bytes of data.", flush=True)
+interval = float(sys.argv[sys.argv.index('-i') + 1]) if '-i' in sys.argv else None
+seq = 1
+while True:
+    rtt = max(0.1, random.gauss(base, 1.0))
+    if interval is None or random.random() > 0.01:
+        print(f"64 bytes from {{host}}: icmp_seq={{seq}} ttl=58 time={{rtt:.3f}} ms", flush=True)
+    if interval is None:
+        break
+    seq += 1
+    time.sleep(interval)
+'''
+
+# Fake traceroute executable: prints a fixed 7-hop path
+FAKE_TRACEROUTE = '''#!{python}
+import sys
+host = sys.argv[-1]
+print(f"traceroute to {{host}}, 30 hops max")
+for i in range(1, 8):
+    print(f" {{i}}  10.0.0.{{i}}  {{i * 2}}.000 ms  {{i * 2}}.100 ms  {{i * 2}}.200 ms")
+'''
+
+# Function to build simulated paths: three shared hops plus one to three target-specific ones
+def benchmark_paths(targets, seed=0, loss=0.01):
+    rng = random.Random(seed)
+    shared = [("192.168.0.1", 1.0, 0.0), ("100.64.0.1", 4.0, 0.0), ("187.16.216.1", 7.0, 0.0)]
+    paths = {}
+    for i in range(targets):
+        hostname = f"bench{i}.proxytest.invalid"
+        base = rng.uniform(8.0, 80.0)
+        specific = [(f"10.{i // 250}.{i % 250}.{n}", 7.0 + (base - 7.0) * n / 4, 0.0)
+                    for n in range(1, rng.randint(2, 4))]
+        lossy = rng.random() < 0.25  # A quarter of the targets drop packets
+        destination = (f"172.{16 + i // 65536}.{i // 256 % 256}.{i % 256}", base,
+                       rng.uniform(0, loss) if lossy else 0.0, rng.uniform(0.3, 4.0))
+        paths[hostname] = shared + specific + [destination]
+    return paths
+
+# Function to get percentiles of a list of latencies in ms
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": values[-1]}
+
+# Function to get the memory held by an object graph (arrays, deques, dicts and instances)
+def deep_sizeof(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == 'deque':
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+# Function to get the peak resident set size of this process in KiB, None where unsupported
+def peak_rss_kib():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+# Function to run one scenario in this process and return its measurements
+def run_scenario(targets, duration, seed, distribution, loss, render_max):
+    paths = benchmark_paths(targets, seed, loss)
+    proxytest.ping_backend = "native"
+    proxytest.prober = proxytest.FakeNetwork(paths, seed=seed, distribution=distribution)
+    proxytest.metrics.clear()
+    proxytest.proxies = [proxytest.make_proxy(hostname) for hostname in paths]
+    proxytest.best_proxy_hostname = None
+
+    render = None
+    if targets <= render_max:
+        try:
+            from rich.console import Console
+            console = Console(file=io.StringIO(), width=200, height=60, force_terminal=True)
+            layout = proxytest.create_layout()
+            render = (console, layout)
+        except ImportError:
+            pass
+
+    probe_cpu = 0.0
+    probes = 0
+    tick_latencies = []
+    render_latencies = []
+    selected = None
+    settled_at = None
+    start = 1_000_000.0  # Virtual clock, so a scenario runs as fast as the CPU allows
+    probes_per_second = int(round(1 / proxytest.probe_interval))
+    for second in range(duration):
+        for step in range(probes_per_second):
+            timestamp = start + second + step / probes_per_second
+            cpu_start = time.process_time()
+            for hostname in paths:
+                ping_time, reply_ttl = proxytest.probe_once(hostname)
+                proxytest.record_probe(hostname, timestamp, ping_time, reply_ttl)
+            probe_cpu += time.process_time() - cpu_start
+            probes += len(paths)
+
+        # One UI tick per virtual second, like the default refresh rate
+        current_time = start + second + 1
+        tick_start = time.perf_counter()
+        results = proxytest.compute_results(current_time)
+        proxytest.update_best_proxy(results, second + 1)
+        tick_latencies.append((time.perf_counter() - tick_start) * 1000)
+
+        # Time to best proxy: when the selection last changed before the end of the run
+        if proxytest.best_proxy_hostname != selected:
+            selected = proxytest.best_proxy_hostname
+            settled_at = second + 1
+
+        if render is not None:
+            console, layout = render
+            render_start = time.perf_counter()
+            proxytest.update_layout(layout, results, proxytest.best_proxy_hostname, "Benchmark", False, second + 1)
+            console.print(layout)
+            console.file.seek(0)
+            console.file.truncate()
+            render_latencies.append((time.perf_counter() - render_start) * 1000)
+
+    # Proxies whose expected score (same formula as compute_results, loss in percent) is within 5%
+    # of the lowest one count as the true best, so near ties don't make the measure depend on noise.
+    # Loss is taken as the window saw it: at 1% or less, 60 probes often see none, and the expected
+    # penalty would then flag a selection that was right for the samples it had
+    observed_loss = {r["Proxy"]: r["PacketLoss"] or 0.0 for r in results}
+    expected = {h: p[-1][1] + p[-1][3] + len(p) * 5 + observed_loss.get(h, p[-1][2] * 100) * 500
+                for h, p in paths.items()}
+    best_score = min(expected.values())
+    true_best = {h for h, score in expected.items() if score <= best_score * 1.05}
+
+    return {
+        "targets": targets,
+        "virtual_seconds": duration,
+        "probes": probes,
+        "cpu_per_probe_us": probe_cpu / probes * 1e6 if probes else None,
+        "tick_latency_ms": percentiles(tick_latencies),
+        "render_latency_ms": percentiles(render_latencies),
+        "metrics_bytes_per_target": deep_sizeof(dict(proxytest.metrics)) / targets,
+        "peak_rss_kib": peak_rss_kib(),
+        "time_to_best_proxy_s": settled_at if selected is not None else None,
+        "best_proxy_correct": selected in true_best,
+    }
+
+# Function to measure the streaming backend: one long-lived fake ping per target for a few seconds
+def run_stream_probes(seconds, targets=7):
+    samples = []
+    times_start = os.times()
+    streams = proxytest.PingStreams()
+    for i in range(targets):
+        host = f"bench{i}.proxytest.invalid"
+        streams.start(host, host, proxytest.probe_interval, lambda timestamp, rtt, reply_ttl: samples.append(rtt))
+    time.sleep(seconds)
+    streams.close()
+    times_end = os.times()
+    cpu = sum(times_end[i] - times_start[i] for i in range(4))
+    return {
+        "processes": targets,
+        "seconds": seconds,
+        "probes": len(samples),
+        "replies": sum(1 for rtt in samples if rtt is not None),
+        "cpu_per_probe_us": cpu / len(samples) * 1e6 if samples else None,
+    }
+
+# Function to measure the subprocess backends with fake ping/traceroute executables (Unix only)
+def run_subprocess_probes(count, stream_seconds=0):
+    if sys.platform == 'win32' or count <= 0:
+        return None
+    with tempfile.TemporaryDirectory() as bin_dir:
+        for name, script in (("ping", FAKE_PING), ("traceroute", FAKE_TRACEROUTE)):
+            path = os.path.join(bin_dir, name)
+            with open(path, 'w') as f:
+                f.write(script.format(python=sys.executable))
+            os.chmod(path, 0o755)
+        old_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = bin_dir + os.pathsep + old_path
+        proxytest.ping_backend = "subprocess"
+        try:
+            times_start = os.times()
+            wall_start = time.perf_counter()
+            replies = sum(1 for i in range(count) if proxytest.ping_once(f"bench{i % 7}.proxytest.invalid") is not None)
+            wall = time.perf_counter() - wall_start
+            times_end = os.times()
+            hops = proxytest.get_number_of_hops("bench0.proxytest.invalid")
+            stream = run_stream_probes(stream_seconds) if stream_seconds > 0 else None
+        finally:
+            os.environ['PATH'] = old_path
+            proxytest.ping_backend = "native"
+    cpu = sum(times_end[i] - times_start[i] for i in range(4))  # Own and children's user/system time
+    return {
+        "probes": count,
+        "replies": replies,
+        "cpu_per_probe_us": cpu / count * 1e6,
+        "wall_per_probe_ms": wall / count * 1000,
+        "traceroute_hops": hops,
+        "stream": stream,
+    }
+
+# Function to get the current git commit, if any
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline do proxytest com rede simulada")
+    parser.add_argument('--targets', default="7,50,200,1000", help="quantidades de alvos, separadas por vírgula")
+    parser.add_argument('--duration', type=int, default=60, help="segundos virtuais simulados por cenário")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--distribution', choices=['normal', 'lognormal'], default='normal')
+    parser.add_argument('--loss', type=float, default=0.01, help="perda máxima por alvo (0-1)")
+    parser.add_argument('--render-max', type=int, default=200, help="mede a renderização só até este número de alvos")
+    parser.add_argument('--subprocess-probes', type=int, default=50, help="pings pelo backend subprocess (0 desativa)")
+    parser.add_argument('--stream-seconds', type=float, default=5, help="segundos do backend stream (0 desativa)")
+    parser.add_argument('--output', help="arquivo JSON de saída (padrão: stdout)")
+    parser.add_argument('--scenario', type=int, help=argparse.SUPPRESS)  # Internal: run one scenario and print it
+    args = parser.parse_args(argv)
+
+    scenario_args = [args.duration, args.seed, args.distribution, args.loss, args.render_max]
+    if args.scenario is not None:
+        print(json.dumps(run_scenario(args.scenario, *scenario_args)))
+        return
+
+    # Each scenario runs in its own process so peak RSS is measured per scenario
+    scenarios = []
+    for targets in (int(t) for t in args.targets.split(',') if t.strip()):
+        cmd = [sys.executable, os.path.abspath(__file__), '--scenario', str(targets),
+               '--duration', str(args.duration), '--seed', str(args.seed), '--distribution', args.distribution,
+               '--loss', str(args.loss), '--render-max', str(args.render_max)]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            scenarios.append({"targets": targets, "error": result.stderr.strip().splitlines()[-1:]})
+        else:
+            scenarios.append(json.loads(result.stdout.strip().splitlines()[-1]))
+        print(f"{targets} alvos: ok", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "parameters": vars(args),
+        "scenarios": scenarios,
+        "subprocess_backend": run_subprocess_probes(args.subprocess_probes, args.stream_seconds),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
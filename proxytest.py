@@ -2,24 +2,39 @@ import subprocess
 import threading
 import re
 import time
-import statistics
 import sys
 import socket
-import msvcrt  # For key capture on Windows
-from rich.console import Console
-from rich.layout import Layout
-from rich.panel import Panel
-from rich.table import Table
-from rich.live import Live
-from rich.text import Text
-from rich import box
-from rich.columns import Columns
-from rich.align import Align
+import os
+import errno
+import struct
+import select
+import argparse
+import random
+import functools
+import math
+import queue
+import json
+import heapq
+import shutil
+import selectors
+import zlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
 from collections import defaultdict, deque
-from rich.spinner import Spinner
-from rich import print as rprint
+from array import array
 
-console = Console()
+# Recorded before anything else so --startup-profile can report the import cost
+module_import_started = time.time()
+
+# rich and msvcrt are imported where they are used, so importing this module has no side effects
+console = None
+
+# Function to get the shared rich console, creating it on first use
+def get_console():
+    global console
+    if console is None:
+        from rich.console import Console
+        console = Console()
+    return console
 
 # Hardcoded descriptions for specific proxies
 proxy_descriptions = {
@@ -53,69 +68,1732 @@ proxy_descriptions = {
     }
 }
 
-# Function to dynamically discover proxies up to proxy20, filtering out those with less than 2ms ping
-def get_proxies():
-    proxies = []
-    for i in range(0, 21):
-        hostname = f"proxy{i}.ragnatales.com.br"
+# Ping backend: "native" sends echo requests from a single in-process socket,
+# "subprocess" keeps the old behaviour of running the system ping command for every sample,
+# "stream" keeps one system ping running per target
+ping_backend = "native"
+system_ping_backends = ("subprocess", "stream")
+
+# Port used by the native prober when ICMP sockets are not available (TCP connect fallback)
+tcp_fallback_port = 443
+
+# Game port probed with TCP handshakes alongside ICMP (--game-port), None to probe ICMP only
+game_port = None
+
+# Weight of each probe type in the score (--probe-weights); types without data are ignored
+probe_weights = {"icmp": 1.0, "tcp": 1.0}
+
+ICMP_ECHO_REPLY = 0
+ICMP_DEST_UNREACHABLE = 3
+ICMP_ECHO_REQUEST = 8
+ICMP_TIME_EXCEEDED = 11
+
+# Linux constants for receiving ICMP errors and reply TTLs on datagram sockets
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+IP_RECVTTL = getattr(socket, 'IP_RECVTTL', 12)
+SO_EE_ORIGIN_ICMP = 2
+
+# Function to compute the internet checksum used by ICMP
+def icmp_checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+# Class to send echo requests from one socket and match replies by id/sequence.
+# Probes can carry a TTL, in which case the time-exceeded reply of the router at
+# that distance completes the probe (used by PathMonitor).
+class NativeProber:
+    def __init__(self, tcp_port=tcp_fallback_port):
+        self.tcp_port = tcp_port
+        self.identifier = os.getpid() & 0xFFFF
+        self.sequence = 0
+        self.pending = {}  # (ip, sequence) -> [send_time, deadline, callback]
+        self.lock = TimedLock("prober")
+        self.send_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.recv_errors = False
+        self.recv_ttl = False
+        self.connector = None
+        self.sock, self.mode = self.open_socket()
+        if self.sock is not None:
+            self.default_ttl = self.sock.getsockopt(socket.IPPROTO_IP, socket.IP_TTL) or 64
+            self.current_ttl = self.default_ttl
+            if self.mode == 'icmp-dgram' and sys.platform.startswith('linux'):
+                # Datagram sockets only see ICMP errors (time exceeded) through the error queue
+                try:
+                    self.sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+                    self.recv_errors = True
+                except OSError:
+                    pass
+                # The reply TTL (used to infer the hop count) arrives as ancillary data
+                try:
+                    self.sock.setsockopt(socket.IPPROTO_IP, IP_RECVTTL, 1)
+                    self.recv_ttl = True
+                except OSError:
+                    pass
+            self.receiver_thread = threading.Thread(target=self.receive_loop, daemon=True)
+            self.receiver_thread.start()
+
+    @property
+    def supports_ttl(self):
+        return self.mode != 'tcp'
+
+    def open_socket(self):
+        # Unprivileged ICMP datagram sockets first (Linux/macOS), then raw sockets (Windows as admin/root)
+        for sock_type, mode in ((socket.SOCK_DGRAM, 'icmp-dgram'), (socket.SOCK_RAW, 'icmp-raw')):
+            try:
+                sock = socket.socket(socket.AF_INET, sock_type, socket.IPPROTO_ICMP)
+                sock.setblocking(False)
+                return sock, mode
+            except (OSError, AttributeError):
+                continue
+        return None, 'tcp'
+
+    def resolve(self, hostname):
+        return socket.gethostbyname_ex(hostname)[2]
+
+    def resolve_records(self, hostname):
+        return query_dns_records(hostname)
+
+    def next_sequence(self):
+        with self.lock:
+            self.sequence = (self.sequence + 1) & 0xFFFF
+            return self.sequence
+
+    def build_packet(self, sequence):
+        payload = struct.pack('!d', time.perf_counter()) + b'proxytest'.ljust(24, b'\x00')
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, self.identifier, sequence)
+        checksum = icmp_checksum(header + payload)
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, self.identifier, sequence)
+        return header + payload
+
+    def send_probe(self, ip, ttl=None, callback=None, timeout=1.0):
+        # Sends one echo request without blocking; callback(responder_ip, rtt_ms, reached, reply_ttl)
+        # is called from the receiver thread, with (None, None, False, None) when the probe times out
+        if self.mode == 'tcp':
+            self.connect(ip, self.tcp_port, lambda rtt: callback(ip if rtt is not None else None, rtt,
+                                                                 rtt is not None, None), timeout)
+            return
+        sequence = self.next_sequence()
+        key = (ip, sequence)
+        packet = self.build_packet(sequence)
+        entry = [0.0, time.perf_counter() + timeout, callback]
+        with self.lock:
+            self.pending[key] = entry
         try:
-            # Attempt to resolve the hostname
-            addr = socket.gethostbyname(hostname)
-            # Ping once to check response time
-            if sys.platform == 'win32':
-                cmd = ['ping', '-n', '1', '-w', '1000', hostname]
-            else:
-                cmd = ['ping', '-c', '1', '-W', '1', hostname]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            # Extract ping time
-            if sys.platform == 'win32':
-                ping_time_match = re.search(r'(?:Tempo|Time)[=<]?\s*([\d\.]+)ms', result.stdout, re.IGNORECASE)
-            else:
-                ping_time_match = re.search(r'time=([\d\.]+) ms', result.stdout)
-            if ping_time_match:
-                ping_time = float(ping_time_match.group(1))
-                if ping_time >= 2.0:
-                    # Add to the proxies list
-                    display_name = f"Proxy {i}"
-                    description = f"Proxy {i} description"
-                    if hostname in proxy_descriptions:
-                        display_name = proxy_descriptions[hostname]["display_name"]
-                        description = proxy_descriptions[hostname]["description"]
-                    proxy = {
-                        "hostname": hostname,
-                        "display_name": display_name,
-                        "description": description
-                    }
-                    proxies.append(proxy)
+            with self.send_lock:
+                ttl = ttl or self.default_ttl
+                if ttl != self.current_ttl:
+                    self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+                    self.current_ttl = ttl
+                entry[0] = time.perf_counter()
+                self.sock.sendto(packet, (ip, 0))
+        except OSError:
+            with self.lock:
+                self.pending.pop(key, None)
+            callback(None, None, False, None)
+
+    def complete(self, key, responder, receive_time, reached, reply_ttl=None):
+        with self.lock:
+            entry = self.pending.pop(key, None)
+        if entry is not None:
+            entry[2](responder, (receive_time - entry[0]) * 1000, reached, reply_ttl)
+
+    def expire_pending(self):
+        now = time.perf_counter()
+        with self.lock:
+            expired = [key for key, entry in self.pending.items() if entry[1] <= now]
+            callbacks = [self.pending.pop(key)[2] for key in expired]
+        for callback in callbacks:
+            callback(None, None, False, None)
+
+    def receive_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                readable, _, _ = select.select([self.sock], [], [], 0.1)
+            except (OSError, ValueError):
+                if self.stop_event.is_set():
+                    break
+                continue
+            if readable:
+                if self.recv_errors:
+                    self.drain_error_queue()
+                try:
+                    if self.recv_ttl:
+                        data, ancdata, _, addr = self.sock.recvmsg(2048, 64)
+                    else:
+                        data, addr = self.sock.recvfrom(2048)
+                        ancdata = ()
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except OSError:
+                    if self.stop_event.is_set():
+                        break
                 else:
+                    reply_ttl = None
+                    for level, kind, cdata in ancdata:
+                        if level == socket.IPPROTO_IP and kind == socket.IP_TTL and len(cdata) >= 4:
+                            reply_ttl = struct.unpack('=i', cdata[:4])[0]
+                    self.handle_packet(data, addr[0], time.perf_counter(), reply_ttl)
+            self.expire_pending()
+
+    def handle_packet(self, data, source, receive_time, reply_ttl=None):
+        # Raw sockets (and datagram sockets on macOS) include the IPv4 header
+        if len(data) >= 20 and data[0] >> 4 == 4:
+            reply_ttl = data[8]
+            data = data[(data[0] & 0x0F) * 4:]
+        if len(data) < 8:
+            return
+        icmp_type, _, _, identifier, sequence = struct.unpack('!BBHHH', data[:8])
+        if icmp_type == ICMP_ECHO_REPLY:
+            # Datagram sockets get their identifier rewritten and filtered by the kernel
+            if self.mode == 'icmp-raw' and identifier != self.identifier:
+                return
+            self.complete((source, sequence), source, receive_time, True, reply_ttl)
+        elif icmp_type in (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACHABLE):
+            # The error carries the IP header and first 8 bytes of our original echo request
+            inner = data[8:]
+            if len(inner) < 28 or inner[0] >> 4 != 4:
+                return
+            original = inner[(inner[0] & 0x0F) * 4:][:8]
+            if len(original) < 8:
+                return
+            original_type, _, _, identifier, sequence = struct.unpack('!BBHHH', original)
+            if original_type != ICMP_ECHO_REQUEST:
+                return
+            if self.mode == 'icmp-raw' and identifier != self.identifier:
+                return
+            destination = socket.inet_ntoa(inner[16:20])
+            self.complete((destination, sequence), source, receive_time,
+                          icmp_type == ICMP_DEST_UNREACHABLE and source == destination, reply_ttl)
+
+    def drain_error_queue(self):
+        while True:
+            try:
+                data, ancdata, _, addr = self.sock.recvmsg(2048, 512, socket.MSG_ERRQUEUE)
+            except OSError:
+                return
+            receive_time = time.perf_counter()
+            if len(data) < 8:
+                continue
+            sequence = struct.unpack('!H', data[6:8])[0]
+            for level, kind, cdata in ancdata:
+                if level != socket.IPPROTO_IP or kind != IP_RECVERR or len(cdata) < 24:
+                    continue
+                # struct sock_extended_err followed by the offender's sockaddr_in
+                _, origin, icmp_type, _, _, _, _ = struct.unpack('=IBBBBII', cdata[:16])
+                if origin != SO_EE_ORIGIN_ICMP:
+                    continue
+                responder = socket.inet_ntoa(cdata[20:24])
+                self.complete((addr[0], sequence), responder, receive_time,
+                              icmp_type == ICMP_DEST_UNREACHABLE and responder == addr[0])
+
+    def probe(self, ip, timeout=1.0):
+        # Blocking echo request, returns (rtt_ms, reply_ttl) or (None, None) if lost
+        done = threading.Event()
+        result = []
+
+        def on_reply(responder, rtt, reached, reply_ttl):
+            result.append((rtt, reply_ttl) if reached else (None, None))
+            done.set()
+
+        self.send_probe(ip, None, on_reply, timeout)
+        done.wait(timeout + 0.5)
+        return result[0] if result else (None, None)
+
+    def connect(self, ip, port, callback, timeout=1.0):
+        # Non-blocking TCP handshake, callback(rtt_ms) with None on timeout or failure
+        with self.lock:
+            if self.connector is None:
+                self.connector = TcpConnector()
+        self.connector.connect(ip, port, callback, timeout)
+
+    def close(self, timeout=None):
+        self.stop_event.set()
+        if self.sock is not None:
+            self.sock.close()
+        if self.connector is not None:
+            self.connector.close()
+        if timeout and self.sock is not None:
+            self.receiver_thread.join(timeout)
+
+# Class to time many TCP handshakes (SYN -> SYN/ACK) at once from a single selector thread;
+# a refused connection still proves the host answered, so it counts as a reply
+class TcpConnector:
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.pending = {}   # socket -> [send_time, deadline, callback]
+        self.queued = deque()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        # New sockets are registered by the selector thread, woken up through this pair
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def connect(self, ip, port, callback, timeout=1.0):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        send_time = time.perf_counter()
+        code = sock.connect_ex((ip, port))
+        if code in (errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK)):
+            with self.lock:
+                self.queued.append((sock, [send_time, send_time + timeout, callback]))
+            self.wakeup_writer.send(b'\0')
+            return
+        sock.close()
+        callback((time.perf_counter() - send_time) * 1000 if code == 0 or self.refused(code) else None)
+
+    def refused(self, code):
+        return code in (errno.ECONNREFUSED, getattr(errno, 'WSAECONNREFUSED', errno.ECONNREFUSED))
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                events = self.selector.select(0.1)
+            except (OSError, ValueError):
+                if self.stop_event.is_set():
+                    break
+                continue
+            receive_time = time.perf_counter()
+            finished = []
+            for key, _ in events:
+                sock = key.fileobj
+                if sock is self.wakeup_reader:
+                    try:
+                        sock.recv(4096)
+                    except OSError:
+                        pass
                     continue
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                finished.append((sock, code == 0 or self.refused(code)))
+            with self.lock:
+                while self.queued:
+                    sock, entry = self.queued.popleft()
+                    self.pending[sock] = entry
+                    self.selector.register(sock, selectors.EVENT_WRITE)
+                finished += [(sock, False) for sock, entry in self.pending.items() if entry[1] <= receive_time]
+            for sock, answered in finished:
+                self.finish(sock, receive_time, answered)
+
+    def finish(self, sock, receive_time, answered):
+        with self.lock:
+            entry = self.pending.pop(sock, None)
+        if entry is None:
+            return
+        self.selector.unregister(sock)
+        sock.close()
+        entry[2]((receive_time - entry[0]) * 1000 if answered else None)
+
+    def close(self):
+        self.stop_event.set()
+        self.wakeup_writer.send(b'\0')
+
+# Function to build simulated paths for the candidate proxies (or the given hostnames): the first
+# hops (LAN, ISP, IX) are shared and the last ones are specific to each proxy
+def default_fake_paths(hostnames=None):
+    hostnames = proxy_candidates[:7] if hostnames is None else hostnames
+    shared = [("192.168.0.1", 1.0, 0.0), ("100.64.0.1", 4.0, 0.0),
+              ("200.160.0.1", 6.0, 0.02), ("187.16.216.1", 8.0, 0.0)]
+    paths = {}
+    for i, hostname in enumerate(hostnames):
+        subnet, spread = f"{i % 256}.{i // 256}", i % 64  # Long lists repeat the same range of RTTs
+        specific = [(f"10.{subnet}.1", 10.0 + spread * 2, 0.0),
+                    (f"10.{subnet}.2", 12.0 + spread * 3, 0.0),
+                    (f"172.{16 + i // 256}.{i % 256}.10", 14.0 + spread * 4, 0.01 * (i % 3))]
+        paths[hostname] = shared + specific
+    # The second proxy also resolves to another address (several A records), over another route
+    if len(hostnames) > 1:
+        paths[f"{hostnames[1]}#2"] = shared + [("10.1.1.1", 13.0, 0.0), ("172.16.1.20", 24.0, 0.0)]
+    return paths
+
+# Class simulating the network for offline testing; each destination hostname maps to a
+# path of (hop_ip, base_rtt_ms, loss_ratio[, jitter_ms]) and the last hop is the destination itself.
+# RTTs follow a normal distribution around the base, or a lognormal one (occasional spikes).
+class FakeNetwork:
+    mode = 'fake'
+    supports_ttl = True
+
+    def __init__(self, paths=None, seed=0, distribution='normal'):
+        self.paths = paths if paths is not None else default_fake_paths()
+        self.distribution = distribution
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # Every hop can also be probed directly, through the prefix of the path that ends at it
+        self.routes = {}
+        for path in self.paths.values():
+            for idx, hop in enumerate(path):
+                self.routes.setdefault(hop[0], path[:idx + 1])
+        # Paths named 'hostname#n' are extra addresses (A records) of hostname
+        self.extra_addresses = defaultdict(list)
+        for name, path in self.paths.items():
+            if '#' in name:
+                self.extra_addresses[name.partition('#')[0]].append(path[-1][0])
+
+    def resolve(self, hostname):
+        if hostname in self.paths:
+            return [self.paths[hostname][-1][0]] + self.extra_addresses.get(hostname, [])
+        if hostname in self.routes:
+            return [hostname]
+        raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+
+    def resolve_records(self, hostname):
+        return self.resolve(hostname), None
+
+    def send_probe(self, ip, ttl=None, callback=None, timeout=1.0):
+        path = self.routes.get(ip)
+        if not path:
+            callback(None, None, False, None)
+            return
+        ttl = ttl or 64
+        reached = ttl >= len(path)
+        distance = len(path) if reached else ttl
+        rtt = self.sample(path[distance - 1], timeout)
+        if rtt is None:
+            callback(None, None, False, None)
+        else:
+            # Replies start at TTL 64 and lose one per router on the way back
+            callback(path[distance - 1][0], rtt, reached, 64 - (distance - 1))
+
+    def sample(self, hop, timeout):
+        # RTT of one probe to a hop, None if lost or past the timeout
+        base_rtt, loss = hop[1:3]
+        jitter = hop[3] if len(hop) > 3 else base_rtt * 0.05 + 0.3
+        with self.lock:
+            lost = self.random.random() < loss
+            if self.distribution == 'lognormal':
+                rtt = base_rtt - jitter + self.random.lognormvariate(math.log(jitter), 0.75)
             else:
+                rtt = self.random.gauss(base_rtt, jitter)
+            rtt = max(0.1, rtt)
+        return None if lost or rtt > timeout * 1000 else rtt
+
+    def connect(self, ip, port, callback, timeout=1.0):
+        # Every simulated destination accepts connections on any port
+        path = self.routes.get(ip)
+        callback(self.sample(path[-1], timeout) if path else None)
+
+    def probe(self, ip, timeout=1.0):
+        result = []
+        self.send_probe(ip, None, lambda responder, rtt, reached, reply_ttl: result.append(
+            (rtt, reply_ttl) if reached else (None, None)), timeout)
+        return result[0] if result else (None, None)
+
+    def close(self, timeout=None):
+        pass
+
+prober = None
+prober_lock = threading.Lock()
+
+# Function to get the shared prober (native sockets, or the fake network), creating it on first use
+def get_prober():
+    global prober
+    with prober_lock:
+        if prober is None:
+            prober = NativeProber()
+            supervisor.own("prober", prober, getattr(prober, 'receiver_thread', None))
+        return prober
+
+# Streaming ping backend (--ping-backend stream): one long-lived system ping per target instead of
+# one process per sample; replies are read incrementally and missing sequence numbers count as loss
+stream_restart_max = 60.0   # Seconds between restarts of a ping that keeps exiting, at most
+stream_reply_pattern = re.compile(rb'(?:icmp_)?seq=(\d+) ttl=(\d+) time[=<]([\d.]+) ?ms', re.IGNORECASE)
+stream_windows_reply_pattern = re.compile(rb'(?:tempo|time)[=<]\s*([\d.]+)\s*ms.*?TTL=(\d+)', re.IGNORECASE)
+stream_windows_loss_pattern = re.compile(rb'timed out|tempo limite|unreachable|inacess', re.IGNORECASE)
+
+# Class to hold the state of one streaming ping process
+class PingStream:
+    def __init__(self, host, interval, callback):
+        self.host = host
+        self.interval = interval
+        self.callback = callback     # callback(timestamp, rtt_ms or None, reply_ttl)
+        self.process = None
+        self.buffer = b''
+        self.started = None          # Wall time estimate of when the first sequence number was sent
+        self.first_sequence = 0 if sys.platform == 'darwin' else 1
+        self.next_sequence = self.first_sequence  # Oldest sequence number not delivered yet
+        self.replies = {}            # Sequence number -> (rtt, reply_ttl), waiting for earlier ones
+        self.spawned = 0.0
+        self.restart_at = 0.0
+        self.backoff = 1.0
+        self.stopped = False
+
+    def command(self, timeout):
+        if sys.platform == 'win32':
+            return ['ping', '-t', '-w', str(int(timeout * 1000)), self.host]  # Fixed 1 s interval
+        cmd = ['ping', '-n', '-i', f"{self.interval:.3g}", self.host]
+        if sys.platform.startswith('linux'):
+            cmd[2:2] = ['-W', str(max(1, int(math.ceil(timeout))))]
+            if shutil.which('stdbuf'):
+                cmd = ['stdbuf', '-oL'] + cmd  # Line-buffered output through the pipe
+        return cmd
+
+    def send_time(self, sequence):
+        return self.started + (sequence - self.first_sequence) * self.interval
+
+# Class to run the streaming pings and parse their output from a single thread
+class PingStreams:
+    def __init__(self, timeout=1.0):
+        self.timeout = timeout
+        self.streams = {}    # key -> PingStream
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        # Pipes can't be polled on Windows, each ping gets a reader thread feeding this queue there
+        self.selector = selectors.DefaultSelector() if sys.platform != 'win32' else None
+        self.lines = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def start(self, key, host, interval, callback):
+        # Idempotent; a running ping is restarted only when its interval changes noticeably
+        with self.lock:
+            stream = self.streams.get(key)
+            if stream is not None and stream.host == host and abs(stream.interval - interval) <= 0.25 * stream.interval:
+                return
+            if stream is not None:
+                stream.stopped = True
+            self.streams[key] = PingStream(host, interval, callback)
+
+    def stop(self, key):
+        with self.lock:
+            stream = self.streams.pop(key, None)
+            if stream is not None:
+                stream.stopped = True
+
+    def run(self):
+        running = []
+        while not (self.stop_event.is_set() or stop_event.is_set()):
+            now = time.monotonic()
+            with self.lock:
+                streams = list(self.streams.values())
+            for stream in running:
+                if stream.stopped:
+                    self.kill(stream)
+            running = [stream for stream in running if not stream.stopped and stream.process is not None]
+            for stream in streams:
+                if stream.process is None and now >= stream.restart_at:
+                    self.spawn(stream)
+                    if stream.process is not None:
+                        running.append(stream)
+            if self.selector is not None and self.selector.get_map():
+                for selector_key, _ in self.selector.select(input_poll_interval):
+                    self.read(selector_key.data)
+            else:
+                try:
+                    stream, line = self.lines.get(timeout=input_poll_interval)
+                    self.handle_line(stream, line)
+                    while True:
+                        stream, line = self.lines.get_nowait()
+                        self.handle_line(stream, line)
+                except queue.Empty:
+                    pass
+            for stream in running:
+                self.sweep(stream)
+        # Every ping is signalled before waiting for any of them
+        for stream in running:
+            stream.process.kill()
+        for stream in running:
+            self.kill(stream)
+
+    def spawn(self, stream):
+        try:
+            stream.process = subprocess.Popen(stream.command(self.timeout), stdout=subprocess.PIPE,
+                                              stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+        except OSError:
+            self.exited(stream)
+            return
+        stream.spawned = time.monotonic()
+        stream.started = time.time()
+        stream.next_sequence = stream.first_sequence
+        stream.replies.clear()
+        stream.buffer = b''
+        if self.selector is not None:
+            os.set_blocking(stream.process.stdout.fileno(), False)
+            self.selector.register(stream.process.stdout, selectors.EVENT_READ, stream)
+        else:
+            threading.Thread(target=self.read_lines, args=(stream, stream.process), daemon=True).start()
+
+    def read_lines(self, stream, process):
+        for line in process.stdout:
+            self.lines.put((stream, line))
+        self.lines.put((stream, None))
+
+    def read(self, stream):
+        try:
+            data = os.read(stream.process.stdout.fileno(), 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.handle_line(stream, None)
+            return
+        lines = (stream.buffer + data).split(b'\n')
+        stream.buffer = lines.pop()
+        for line in lines:
+            self.handle_line(stream, line)
+
+    def handle_line(self, stream, line):
+        if stream.process is None or stream.stopped:
+            return
+        if line is None:
+            self.exited(stream)
+            return
+        if sys.platform == 'win32':
+            # No sequence numbers: every reply or timeout line is the next sample, in order
+            match = stream_windows_reply_pattern.search(line)
+            if match:
+                rtt = float(match.group(1))
+                stream.callback(time.time() - rtt / 1000, rtt, int(match.group(2)))
+            elif stream_windows_loss_pattern.search(line):
+                stream.callback(time.time() - self.timeout, None, None)
+            return
+        match = stream_reply_pattern.search(line)
+        if not match:
+            return
+        sequence, reply_ttl, rtt = int(match.group(1)), int(match.group(2)), float(match.group(3))
+        if sequence < stream.next_sequence:
+            return  # Too late, already counted as lost
+        # Re-anchor the send times on the replies, so the schedule follows ping's own clock
+        stream.started = time.time() - rtt / 1000 - (sequence - stream.first_sequence) * stream.interval
+        stream.replies[sequence] = (rtt, reply_ttl)
+        self.sweep(stream)
+
+    def sweep(self, stream):
+        # Delivers samples in sequence order: replies as soon as every earlier one is settled,
+        # losses once their timeout has passed without a reply
+        if stream.started is None or sys.platform == 'win32':
+            return
+        now = time.time()
+        while True:
+            sequence = stream.next_sequence
+            reply = stream.replies.pop(sequence, None)
+            if reply is not None:
+                stream.callback(stream.send_time(sequence), reply[0], reply[1])
+            elif stream.send_time(sequence) + self.timeout + stream.interval < now:
+                stream.callback(stream.send_time(sequence), None, None)
+            else:
+                break
+            stream.next_sequence += 1
+
+    def exited(self, stream):
+        # Restart with exponential backoff; a ping that ran for a while starts over from 1 s
+        process = stream.process
+        if stream.replies:
+            # Replies waiting for earlier sequence numbers: those will never come
+            for sequence in range(stream.next_sequence, max(stream.replies) + 1):
+                reply = stream.replies.pop(sequence, (None, None))
+                stream.callback(stream.send_time(sequence), reply[0], reply[1])
+        if process is not None:
+            if self.selector is not None:
+                self.selector.unregister(process.stdout)
+            process.stdout.close()
+            process.wait()
+            if time.monotonic() - stream.spawned > stream_restart_max:
+                stream.backoff = 1.0
+        stream.process = None
+        stream.restart_at = time.monotonic() + stream.backoff
+        stream.backoff = min(stream.backoff * 2, stream_restart_max)
+
+    def kill(self, stream):
+        if stream.process is not None:
+            stream.process.kill()
+            if self.selector is not None:
+                self.selector.unregister(stream.process.stdout)
+            stream.process.stdout.close()
+            stream.process.wait()
+            stream.process = None
+
+    def close(self, timeout=5.0):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+ping_streams = None
+
+# Function to get the shared streaming pings, creating them on first use
+def get_ping_streams():
+    global ping_streams
+    with prober_lock:
+        if ping_streams is None:
+            ping_streams = supervisor.own("streams", PingStreams())
+        return ping_streams
+
+# Function to resolve a hostname to its IPv4 addresses
+def resolve_host(hostname):
+    if ping_backend in system_ping_backends:
+        return socket.gethostbyname_ex(hostname)[2]
+    return get_prober().resolve(hostname)
+
+# Function to resolve a hostname to its IPv4 addresses and the record TTL in seconds (None if unknown)
+def resolve_host_records(hostname):
+    if ping_backend in system_ping_backends:
+        return query_dns_records(hostname)
+    return get_prober().resolve_records(hostname)
+
+# Function to look up the A records of a hostname; the TTL is only known with dnspython installed
+def query_dns_records(hostname):
+    try:
+        import dns.resolver  # Optional, the system resolver doesn't expose the TTL
+    except ImportError:
+        return socket.gethostbyname_ex(hostname)[2], None
+    try:
+        answer = dns.resolver.resolve(hostname, 'A')
+        return [record.address for record in answer], answer.rrset.ttl
+    except Exception:
+        # No usable nameserver, or a name only the system knows (hosts file)
+        return socket.gethostbyname_ex(hostname)[2], None
+
+# DNS cache: every proxy is resolved once in the background and again when its TTL runs out, so
+# probes always go to a cached address and a slow or failing lookup never counts as packet loss
+dns_default_ttl = 300   # Seconds an answer is kept when the resolver doesn't give its TTL
+dns_min_ttl = 30        # Very short TTLs (load balancers) are not followed below this
+dns_max_ttl = 3600
+dns_retry = 5           # Seconds before a failed lookup is retried, doubling up to dns_default_ttl
+
+# Class to keep the resolved addresses of every proxy; the first address is the one the game client
+# would connect to and is kept first while the name still returns it, the others follow in sorted
+# order so round-robin answers don't reorder them
+class AddressCache:
+    def __init__(self, resolve=None, clock=time.monotonic):
+        self.resolve = resolve  # hostname -> (addresses, ttl); resolve_host_records when None
+        self.clock = clock
+        self.entries = {}  # hostname -> {'addresses', 'expires', 'retry', 'resolving', 'listeners'}
+        self.lock = TimedLock("dns")
+        self.wakeup = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, hostname, addresses=None, listener=None):
+        # Addresses from discovery or the proxy cache are used right away and checked in the background
+        with self.lock:
+            entry = self.entries.get(hostname)
+            if entry is None:
+                entry = self.entries[hostname] = {'addresses': (), 'expires': 0.0, 'retry': dns_retry,
+                                                  'resolving': False, 'listeners': []}
+            if addresses and not entry['addresses']:
+                entry['addresses'] = tuple(addresses[:1]) + tuple(sorted(set(addresses[1:]) - set(addresses[:1])))
+            if listener is not None:
+                entry['listeners'].append(listener)
+            current = entry['addresses']
+        if listener is not None and current:
+            listener(hostname, current)
+        self.wakeup.set()
+
+    def get(self, hostname):
+        # Never blocks: the tuple is replaced, not mutated; empty until the first answer
+        entry = self.entries.get(hostname)
+        return entry['addresses'] if entry is not None else ()
+
+    def run(self):
+        while not stop_event.is_set():
+            self.wakeup.clear()
+            now = self.clock()
+            with self.lock:
+                due = [hostname for hostname, entry in self.entries.items()
+                       if not entry['resolving'] and entry['expires'] <= now]
+                for hostname in due:
+                    self.entries[hostname]['resolving'] = True
+                pending = [entry['expires'] for entry in self.entries.values() if not entry['resolving']]
+            for hostname in due:
+                self.executor.submit(self.refresh, hostname)
+            self.wakeup.wait(min(max(0.0, min(pending, default=now + 1) - now), 1.0))
+
+    def refresh(self, hostname):
+        try:
+            addresses, ttl = (self.resolve or resolve_host_records)(hostname)
+        except (socket.gaierror, socket.herror, OSError, IndexError):
+            addresses, ttl = [], None
+        listeners = ()
+        with self.lock:
+            entry = self.entries[hostname]
+            entry['resolving'] = False
+            if not addresses:
+                # The last known addresses stay in use until the name resolves again
+                entry['expires'] = self.clock() + entry['retry']
+                entry['retry'] = min(entry['retry'] * 2, dns_default_ttl)
+                return
+            ttl = dns_default_ttl if ttl is None else min(max(ttl, dns_min_ttl), dns_max_ttl)
+            previous = entry['addresses']
+            primary = previous[0] if previous and previous[0] in addresses else addresses[0]
+            ordered = (primary,) + tuple(sorted(set(addresses) - {primary}))
+            entry.update(addresses=ordered, expires=self.clock() + ttl, retry=dns_retry)
+            if ordered != previous:
+                listeners = list(entry['listeners'])
+        for listener in listeners:
+            listener(hostname, ordered)
+
+    def close(self, timeout=0.0):
+        self.wakeup.set()
+        self.executor.shutdown(wait=False)
+        if timeout:
+            self.thread.join(timeout)
+
+address_cache = None
+
+# Function to get the shared address cache, creating it on first use
+def get_address_cache():
+    global address_cache
+    with prober_lock:
+        if address_cache is None:
+            address_cache = supervisor.own("dns", AddressCache())
+        return address_cache
+
+# Function to get the address probes and traces of a proxy go to, or None while it is unresolved
+def proxy_address(hostname):
+    addresses = get_address_cache().get(hostname)
+    return addresses[0] if addresses else None
+
+# Function to ping a host once with the system ping command, returns (rtt_ms, reply_ttl)
+def subprocess_probe(host, timeout=1.0):
+    if sys.platform == 'win32':
+        cmd = ['ping', '-n', '1', '-w', str(int(timeout * 1000)), host]
+    else:
+        cmd = ['ping', '-c', '1', '-W', str(max(1, int(timeout))), host]
+    output = run_command(cmd)
+
+    # Extract ping time
+    if sys.platform == 'win32':
+        # Match 'Time=' in English or 'Tempo=' in Portuguese
+        ping_time_match = re.search(r'(?:Tempo|Time)[=<]?\s*([\d\.]+)ms', output, re.IGNORECASE)
+    else:
+        ping_time_match = re.search(r'time=([\d\.]+) ms', output)
+    if not ping_time_match:
+        return None, None
+    ttl_match = re.search(r'ttl=(\d+)', output, re.IGNORECASE)
+    return float(ping_time_match.group(1)), int(ttl_match.group(1)) if ttl_match else None
+
+# Function to ping a host once with the configured backend, returns (rtt_ms, reply_ttl) or (None, None) if lost
+def probe_once(host, timeout=1.0):
+    if ping_backend in system_ping_backends:
+        return subprocess_probe(host, timeout)
+    try:
+        ip = resolve_host(host)[0]
+    except (socket.gaierror, socket.herror, IndexError):
+        return None, None
+    return get_prober().probe(ip, timeout)
+
+# Function to ping a host once, returns the RTT in ms or None if lost
+def ping_once(host, timeout=1.0):
+    return probe_once(host, timeout)[0]
+
+# Candidate proxies probed during discovery, and their display order
+proxy_candidates = [f"proxy{i}.ragnatales.com.br" for i in range(0, 21)]
+proxy_order = {hostname: i for i, hostname in enumerate(proxy_candidates)}
+configured_targets = None  # Hostnames of --targets, monitored instead of the discovered proxies
+discovery_deadline = 5.0  # seconds for the whole discovery sweep
+
+# On-disk cache of discovered proxies, so later launches start probing immediately
+data_dir = os.path.join(os.path.expanduser('~'), '.proxytest')
+proxy_cache_file = os.path.join(data_dir, 'proxies_cache.json')
+proxy_cache_ttl = 24 * 3600  # seconds
+
+# Function to build the proxy entry shown in the UI
+def make_proxy(hostname):
+    i = proxy_order.get(hostname, len(proxy_order))
+    display_name = f"Proxy {i}"
+    description = f"Proxy {i} description"
+    if hostname in proxy_descriptions:
+        display_name = proxy_descriptions[hostname]["display_name"]
+        description = proxy_descriptions[hostname]["description"]
+    return {
+        "hostname": hostname,
+        "display_name": display_name,
+        "description": description
+    }
+
+# Function to resolve and ping one candidate, filtering out those with less than 2ms ping
+def probe_candidate(hostname):
+    try:
+        addresses = resolve_host(hostname)
+    except (socket.gaierror, socket.herror):
+        return None
+    ping_time = ping_once(addresses[0])
+    if ping_time is None or ping_time < 2.0:
+        return None
+    return {"hostname": hostname, "addresses": addresses, "rtt": ping_time, "timestamp": time.time()}
+
+# Function to discover proxies concurrently, calling on_found as each one answers
+def discover_proxies(on_found=None, deadline=discovery_deadline):
+    entries = []
+    executor = ThreadPoolExecutor(max_workers=len(proxy_candidates))
+    pending = {executor.submit(probe_candidate, hostname) for hostname in proxy_candidates}
+    end = time.monotonic() + deadline
+    # Candidates still resolving after the deadline (or at shutdown) are ignored
+    while pending and not stop_event.is_set() and time.monotonic() < end:
+        done, pending = wait_futures(pending, timeout=min(end - time.monotonic(), input_poll_interval),
+                                     return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                entry = future.result()
+            except Exception:
                 continue
-        except (socket.gaierror, subprocess.CalledProcessError):
-            continue
-    return proxies
+            if entry is None:
+                continue
+            entries.append(entry)
+            if on_found:
+                on_found(entry['hostname'], entry['addresses'])
+    executor.shutdown(wait=False)
+    entries.sort(key=lambda e: proxy_order[e['hostname']])
+    return entries
 
-proxies = get_proxies()
+# Function to read the --targets file: JSON (a list of hostnames, or of objects with hostname and
+# optional display_name and description) or text, one "hostname [display name]" per line, # for comments
+def load_targets(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if path.lower().endswith('.json'):
+        items = json.loads(text)
+        if not isinstance(items, list):
+            raise ValueError("o JSON deve ser uma lista de alvos")
+        entries = [{"hostname": item} if isinstance(item, str) else item for item in items]
+    else:
+        entries = []
+        for line in text.splitlines():
+            fields = line.split('#', 1)[0].split(None, 1)
+            if fields:
+                entries.append({"hostname": fields[0], "display_name": fields[1].strip() if len(fields) > 1 else None})
+    targets = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get('hostname'), str) or not entry['hostname'].strip():
+            raise ValueError(f"alvo sem hostname: {entry!r}")
+        targets.setdefault(entry['hostname'].strip(), entry)
+    if not targets:
+        raise ValueError("nenhum alvo")
+    return list(targets.values())
+
+# Function to monitor the targets of --targets, in the order of the file, instead of discovering proxies
+def use_targets(entries):
+    global proxy_candidates, proxy_order, configured_targets
+    proxy_candidates = [entry['hostname'].strip() for entry in entries]
+    proxy_order = {hostname: i for i, hostname in enumerate(proxy_candidates)}
+    for hostname, entry in zip(proxy_candidates, entries):
+        known = proxy_descriptions.get(hostname, {})
+        proxy_descriptions[hostname] = {
+            "display_name": entry.get('display_name') or known.get('display_name') or hostname,
+            "description": entry.get('description') or known.get('description') or "",
+        }
+    configured_targets = proxy_candidates
 
-# Metrics now store timestamped ping times and results for time window analysis
+# Function to load cached proxies that are still within the TTL
+def load_proxy_cache():
+    try:
+        with open(proxy_cache_file, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return []
+    now = time.time()
+    return [e for e in entries if isinstance(e, dict) and 'hostname' in e
+            and now - e.get('timestamp', 0) <= proxy_cache_ttl]
+
+# Function to persist discovered proxies
+def save_proxy_cache(entries):
+    try:
+        os.makedirs(data_dir, exist_ok=True)
+        tmp_file = proxy_cache_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_file, proxy_cache_file)
+    except OSError:
+        pass
+
+# Proxies being monitored; replaced (never mutated) so readers can iterate without locking
+proxies = []
+proxies_lock = threading.Lock()
+
+# Function to add a proxy to the monitored list and start its probe threads; addresses already
+# resolved by discovery (or cached) are probed right away
+def register_proxy(hostname, addresses=None):
+    register_proxies([(hostname, addresses)])
+
+# Function to add several (hostname, addresses) proxies at once, sorting the list only once
+def register_proxies(entries):
+    global proxies
+    added = []
+    with proxies_lock:
+        known = {p['hostname'] for p in proxies}
+        for hostname, addresses in entries:
+            if hostname in known:
+                continue
+            known.add(hostname)
+            get_address_cache().add(hostname, addresses)
+            added.append((make_proxy(hostname), addresses))
+        if added:
+            proxies = sorted(proxies + [proxy for proxy, _ in added],
+                             key=lambda p: proxy_order.get(p['hostname'], len(proxy_order)))
+    if added:
+        start_proxy_threads(added)
+
+# Function to rediscover proxies in the background and refresh the cache
+def refresh_proxies():
+    entries = discover_proxies(on_found=register_proxy)
+    if entries:
+        save_proxy_cache(entries)
+
+# Startup profiling (--startup-profile): milestones in seconds since the process was created
+startup_profile = None
+startup_profile_file = os.path.join(data_dir, 'startup_profile.jsonl')
+
+# Function to get the wall-clock time the process was created (includes PyInstaller unpacking)
+def process_start_time():
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            from ctypes import wintypes
+            creation, exit_time, kernel, user = (wintypes.FILETIME() for _ in range(4))
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.kernel32.GetProcessTimes(handle, ctypes.byref(creation), ctypes.byref(exit_time),
+                                                      ctypes.byref(kernel), ctypes.byref(user)):
+                ticks = (creation.dwHighDateTime << 32) | creation.dwLowDateTime
+                return ticks / 1e7 - 11644473600  # FILETIME epoch is 1601-01-01
+        elif sys.platform.startswith('linux'):
+            with open('/proc/self/stat', 'r') as f:
+                start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+            with open('/proc/uptime', 'r') as f:
+                uptime = float(f.read().split()[0])
+            return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except Exception:
+        pass
+    return module_import_started
+
+# Function to enable startup profiling
+def enable_startup_profile():
+    global startup_profile
+    process_started = process_start_time()
+    startup_profile = {
+        "process_started": process_started,
+        "module_import": module_import_started - process_started,
+    }
+
+# Function to record a startup milestone the first time it is reached
+def mark_startup(milestone):
+    if startup_profile is not None and milestone not in startup_profile:
+        startup_profile[milestone] = time.time() - startup_profile["process_started"]
+
+# Function to print the startup profile and append it to the profile history
+def report_startup_profile():
+    if startup_profile is None:
+        return
+    record = {
+        "timestamp": time.time(),
+        "frozen": bool(getattr(sys, 'frozen', False)),
+        "platform": sys.platform,
+        "ping_backend": ping_backend,
+    }
+    record.update((k, round(v, 4)) for k, v in startup_profile.items() if k != "process_started")
+    if supervisor.shutdown_time is not None:
+        record["shutdown"] = round(supervisor.shutdown_time, 4)  # A duration, not a time since start
+    for milestone in ("module_import", "ui_loaded", "first_probe", "first_frame", "shutdown"):
+        value = record.get(milestone)
+        text = f"{value * 1000:.1f} ms" if value is not None else "N/A"
+        get_console().print(f"[cyan]{milestone}:[/cyan] {text}")
+    try:
+        os.makedirs(data_dir, exist_ok=True)
+        with open(startup_profile_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError:
+        pass
+
+# Analysis windows in seconds
+time_window = 30                # Ping statistics and packet loss
+jitter_variation_window = 300   # Jitter variation (5 minutes)
+history_window = 300            # Raw sample history kept per proxy
+probe_interval = 0.5            # Seconds between pings to the same proxy
+
+numpy_module = False
+
+# Function to import numpy on first use, returns None when it is not installed
+def get_numpy():
+    global numpy_module
+    if numpy_module is False:
+        try:
+            import numpy
+            numpy_module = numpy
+        except ImportError:
+            numpy_module = None
+    return numpy_module
+
+# Function to size a sample buffer for a window, with headroom for faster probing
+def ring_capacity(duration, interval=probe_interval):
+    return int(duration / interval) * 2 + 8
+
+# Class to store samples in fixed-capacity contiguous arrays: timestamps as float64,
+# RTTs as float32 and losses as a bitmask, about 12 bytes per sample
+class SampleRing:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = array('f', bytes(4 * capacity))
+        self.lost_bits = bytearray((capacity + 7) // 8)
+        self.start = 0  # Sequence number of the oldest sample
+        self.end = 0    # Sequence number the next sample will get
+
+    def __len__(self):
+        return self.end - self.start
+
+    def full(self):
+        return self.end - self.start >= self.capacity
+
+    def append(self, timestamp, value):
+        # The oldest sample is overwritten when the buffer is full
+        if self.full():
+            self.start += 1
+        seq = self.end
+        pos = seq % self.capacity
+        self.timestamps[pos] = timestamp
+        if value is None:
+            self.values[pos] = 0.0
+            self.lost_bits[pos >> 3] |= 1 << (pos & 7)
+        else:
+            self.values[pos] = value
+            self.lost_bits[pos >> 3] &= ~(1 << (pos & 7)) & 0xFF
+        self.end += 1
+        return seq
+
+    def timestamp_at(self, seq):
+        return self.timestamps[seq % self.capacity]
+
+    def value_at(self, seq):
+        # Returns None for a lost sample
+        pos = seq % self.capacity
+        if self.lost_bits[pos >> 3] >> (pos & 7) & 1:
+            return None
+        return self.values[pos]
+
+    def pop_oldest(self):
+        seq = self.start
+        self.start += 1
+        return self.timestamp_at(seq), self.value_at(seq)
+
+    def find(self, since):
+        # Binary search for the first sample with timestamp >= since
+        low, high = self.start, self.end
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp_at(middle) < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def segments(self, first, last):
+        # Physical (start, stop) ranges holding sequence numbers first..last-1
+        if first >= last:
+            return []
+        a = first % self.capacity
+        b = a + (last - first)
+        if b <= self.capacity:
+            return [(a, b)]
+        return [(a, self.capacity), (0, b - self.capacity)]
+
+    def window(self, since=None):
+        # Returns (timestamps, values, lost) for the samples at or after since
+        first = self.start if since is None else self.find(since)
+        timestamps = array('d')
+        values = array('f')
+        lost = bytearray()
+        for a, b in self.segments(first, self.end):
+            timestamps += self.timestamps[a:b]
+            values += self.values[a:b]
+            lost += bytes(self.lost_bits[i >> 3] >> (i & 7) & 1 for i in range(a, b))
+        return timestamps, values, lost
+
+# Function to compute the statistics of samples copied out of a ring (values and lost flags as
+# SampleRing.window returns them), vectorized with numpy when it is installed
+def sample_stats(values, lost):
+    total = len(values)
+    numpy = get_numpy()
+    if numpy is not None and total:
+        ok = numpy.frombuffer(lost, dtype=numpy.uint8) == 0
+        rtts = numpy.frombuffer(values, dtype=numpy.float32)[ok].astype(numpy.float64)
+        count = int(rtts.size)
+        mean = float(rtts.mean()) if count else None
+        min_ping = float(rtts.min()) if count else None
+        max_ping = float(rtts.max()) if count else None
+        stdev = float(rtts.std(ddof=1)) if count > 1 else 0
+    else:
+        rtts = [v for v, l in zip(values, lost) if not l]
+        count = len(rtts)
+        mean = sum(rtts) / count if count else None
+        min_ping = min(rtts) if count else None
+        max_ping = max(rtts) if count else None
+        stdev = (sum((v - mean) ** 2 for v in rtts) / (count - 1)) ** 0.5 if count > 1 else 0
+    return {
+        "Total": total,
+        "PacketLoss": ((total - count) / total) * 100 if total else None,
+        "AvgPing": mean,
+        "MinPing": min_ping,
+        "MaxPing": max_ping,
+        "Jitter": stdev if count else None,
+    }
+
+# Class to keep rolling statistics over a time window, updated on every insert and eviction
+# so mean, stdev, min, max and loss are read in constant time
+class RollingWindow:
+    def __init__(self, duration, capacity=None):
+        self.duration = duration
+        self.samples = SampleRing(capacity or ring_capacity(duration))
+        self.lost = 0
+        self.count = 0            # Successful samples
+        self.mean_value = 0.0     # Welford running mean/M2 of successful samples
+        self.m2 = 0.0
+        self.min_deque = deque()  # Monotonic deques of sample sequence numbers for min/max
+        self.max_deque = deque()
+
+    @property
+    def total(self):
+        return len(self.samples)
+
+    def add(self, timestamp, value):
+        if self.samples.full():
+            self.evict_oldest()
+        seq = self.samples.append(timestamp, value)
+        if value is None:
+            self.lost += 1
+            return
+        # Use the stored float32 value so eviction subtracts exactly what was added
+        value = self.samples.value_at(seq)
+        self.count += 1
+        delta = value - self.mean_value
+        self.mean_value += delta / self.count
+        self.m2 += delta * (value - self.mean_value)
+        while self.min_deque and self.samples.value_at(self.min_deque[-1]) >= value:
+            self.min_deque.pop()
+        self.min_deque.append(seq)
+        while self.max_deque and self.samples.value_at(self.max_deque[-1]) <= value:
+            self.max_deque.pop()
+        self.max_deque.append(seq)
+
+    def evict_oldest(self):
+        seq = self.samples.start
+        timestamp, value = self.samples.pop_oldest()
+        if value is None:
+            self.lost -= 1
+            return
+        self.count -= 1
+        if self.count == 0:
+            self.mean_value = 0.0
+            self.m2 = 0.0
+        else:
+            delta = value - self.mean_value
+            self.mean_value -= delta / self.count
+            self.m2 -= delta * (value - self.mean_value)
+        if self.min_deque and self.min_deque[0] <= seq:
+            self.min_deque.popleft()
+        if self.max_deque and self.max_deque[0] <= seq:
+            self.max_deque.popleft()
+
+    def expire(self, current_time):
+        samples = self.samples
+        while len(samples) and current_time - samples.timestamp_at(samples.start) > self.duration:
+            self.evict_oldest()
+
+    @property
+    def last_timestamp(self):
+        return self.samples.timestamp_at(self.samples.end - 1) if self.total else None
+
+    @property
+    def packet_loss(self):
+        return (self.lost / self.total) * 100 if self.total else None
+
+    @property
+    def mean(self):
+        return self.mean_value if self.count else None
+
+    @property
+    def min(self):
+        return self.samples.value_at(self.min_deque[0]) if self.min_deque else None
+
+    @property
+    def max(self):
+        return self.samples.value_at(self.max_deque[0]) if self.max_deque else None
+
+    @property
+    def stdev(self):
+        # Sample standard deviation, 0 with fewer than two values (as statistics.stdev callers did)
+        if self.count < 2:
+            return 0
+        return (max(self.m2, 0.0) / (self.count - 1)) ** 0.5
+
+# Class to measure how long threads wait for a lock: uncontended acquisitions cost one
+# non-blocking attempt, contended ones are timed
+class TimedLock:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        timed_locks.append(self)
+
+    def acquire(self):
+        if self.lock.acquire(False):
+            self.acquisitions += 1  # Counters are only updated while holding the lock
+            return True
+        wait_started = time.perf_counter()
+        self.lock.acquire()
+        waited = time.perf_counter() - wait_started
+        self.acquisitions += 1
+        self.contended += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+timed_locks = []
+
+# Function to sum the wait statistics of the timed locks by name
+def lock_wait_statistics():
+    statistics = {}
+    for timed_lock in list(timed_locks):
+        entry = statistics.setdefault(timed_lock.name, {"Locks": 0, "Acquisitions": 0, "Contended": 0,
+                                                        "WaitTotal": 0.0, "WaitMax": 0.0})
+        entry["Locks"] += 1
+        entry["Acquisitions"] += timed_lock.acquisitions
+        entry["Contended"] += timed_lock.contended
+        entry["WaitTotal"] += timed_lock.wait_total
+        entry["WaitMax"] = max(entry["WaitMax"], timed_lock.wait_max)
+    return statistics
+
+# Metrics now store timestamped ping samples in fixed-size buffers for time window analysis
+# Function to create the sample buffers of one probe type
+def new_probe_series(window=time_window, interval=probe_interval):
+    return {
+        "History": SampleRing(ring_capacity(history_window, interval)),  # Raw samples (RTT or loss)
+        "Window": RollingWindow(window, ring_capacity(window, interval)),  # Rolling statistics
+        "JitterWindow": RollingWindow(jitter_variation_window, ring_capacity(jitter_variation_window, 1)),
+        **new_sketches(window),                                  # p50/p95/p99 over 30 s, 5 min and the session
+    }
+
+# ICMP samples are kept at the top level, other probe types under their own key once used.
+# Each proxy has its own lock, so probes of different proxies and the stats of other proxies
+# never wait for each other
 metrics = defaultdict(lambda: {
-    "PingTimes": deque(),       # Deque of (timestamp, ping_time)
-    "PingResults": deque(),     # Deque of (timestamp, success)
-    "JitterValues": deque(),    # Deque of jitter values over extended period
-    "Hops": None
+    "Lock": TimedLock("metrics"),
+    **new_probe_series(),
+    "Tcp": None,                # TCP handshake samples to the game port
+    "Addresses": {},            # Extra address of a name with several A records -> {probe type: series}
+    "Loaded": None,             # ICMP samples taken while --load-sink saturates the uplink
+    "Hops": None,
+    "InferredHops": None,       # Hop count inferred from the reply TTL
+    "HopsOffset": 0,            # Correction from the last full trace
+    "TraceRequested": False,    # Set when the inferred hop count changed or is unavailable
+    "LastTrace": 0.0
 })
 
-# Lock for thread-safe updates
-lock = threading.Lock()
-traceroute_lock = threading.Lock()
+# Function to get the metrics of a proxy, creating them once even when threads race on a new proxy
+def get_metric(hostname):
+    metric = metrics.get(hostname)
+    if metric is None:
+        with metrics_lock:
+            metric = metrics[hostname]
+    return metric
+
+metrics_lock = threading.Lock()  # Only taken to create the metrics of a new proxy
+
+# Persistent sample store (--record): raw samples plus 1 s / 1 min / 1 h rollups in SQLite (WAL)
+store_file = os.path.join(data_dir, 'samples.db')
+rollup_resolutions = (1, 60, 3600)
+# Retention in seconds for raw samples (key None) and for each rollup resolution
+store_retention = {None: 2 * 86400, 1: 7 * 86400, 60: 90 * 86400, 3600: 730 * 86400}
+rollup_grace = 2.0         # Seconds a rollup bucket stays open for late samples
+histogram_base = 1.05      # Rollup histograms use log buckets with about 5% relative error
+
+# Function to get the histogram bucket of an RTT
+def histogram_bucket(rtt):
+    return int(math.floor(math.log(max(rtt, 0.01), histogram_base)))
+
+# Function to get an RTT percentile (q between 0 and 1) from a histogram of bucket -> count
+def histogram_percentile(histogram, q):
+    total = sum(histogram.values())
+    if total == 0:
+        return None
+    rank = q * total
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return histogram_base ** (bucket + 0.5)
+    return histogram_base ** (max(histogram) + 0.5)
+
+# Class to aggregate samples into a mergeable rollup (counts, moments, extremes and histogram)
+class RollupBucket:
+    def __init__(self, count=0, lost=0, total=0.0, total_squares=0.0, min_rtt=None, max_rtt=None, histogram=None):
+        self.count = count
+        self.lost = lost
+        self.total = total
+        self.total_squares = total_squares
+        self.min = min_rtt
+        self.max = max_rtt
+        self.histogram = histogram if histogram is not None else {}
+
+    def add(self, rtt):
+        if rtt is None:
+            self.lost += 1
+            return
+        self.count += 1
+        self.total += rtt
+        self.total_squares += rtt * rtt
+        self.min = rtt if self.min is None else min(self.min, rtt)
+        self.max = rtt if self.max is None else max(self.max, rtt)
+        bucket = histogram_bucket(rtt)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.lost += other.lost
+        self.total += other.total
+        self.total_squares += other.total_squares
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+
+    def row(self):
+        return (self.count, self.lost, self.total, self.total_squares, self.min, self.max,
+                json.dumps(self.histogram, separators=(',', ':')))
+
+    @classmethod
+    def from_row(cls, row):
+        count, lost, total, total_squares, min_rtt, max_rtt, histogram = row
+        return cls(count, lost, total, total_squares, min_rtt, max_rtt,
+                   {int(k): v for k, v in json.loads(histogram).items()})
+
+    def statistics(self):
+        samples = self.count + self.lost
+        mean = self.total / self.count if self.count else None
+        if self.count > 1:
+            jitter = max(self.total_squares - self.total * mean, 0.0) / (self.count - 1)
+            jitter = jitter ** 0.5
+        else:
+            jitter = 0 if self.count else None
+        return {
+            "Samples": samples,
+            "PacketLoss": (self.lost / samples) * 100 if samples else None,
+            "AvgPing": mean,
+            "MinPing": self.min,
+            "MaxPing": self.max,
+            "Jitter": jitter,
+            "P50": histogram_percentile(self.histogram, 0.50),
+            "P95": histogram_percentile(self.histogram, 0.95),
+            "P99": histogram_percentile(self.histogram, 0.99),
+        }
+
+sketch_slices = 10  # Time slices per sliding sketch; the window advances one slice at a time
+
+# Class to keep latency percentiles over a sliding window (or the whole session) in the rollup
+# histogram buckets (about 5% relative error); the window is made of fixed time slices, so memory
+# and update cost stay constant whatever the session length or probe rate
+class LatencySketch:
+    def __init__(self, duration=None, slices=sketch_slices):
+        self.duration = duration
+        self.slice_length = duration / slices if duration else None
+        self.slices = deque()  # (slice start, histogram), oldest first
+        self.histogram = {}    # Sum of the slices in the window
+        self.count = 0
+
+    def add(self, timestamp, rtt):
+        if rtt is None:
+            return  # Losses are counted by the rolling windows
+        bucket = histogram_bucket(rtt)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+        self.count += 1
+        if self.duration is None:
+            return
+        start = timestamp - timestamp % self.slice_length
+        if not self.slices or self.slices[-1][0] < start:
+            self.slices.append((start, {}))
+            self.expire(timestamp)
+        current = self.slices[-1][1]  # Late samples go to the newest slice
+        current[bucket] = current.get(bucket, 0) + 1
+
+    def expire(self, current_time):
+        if self.duration is None:
+            return
+        while self.slices and self.slices[0][0] + self.slice_length <= current_time - self.duration:
+            _, histogram = self.slices.popleft()
+            for bucket, count in histogram.items():
+                remaining = self.histogram[bucket] - count
+                if remaining:
+                    self.histogram[bucket] = remaining
+                else:
+                    del self.histogram[bucket]
+                self.count -= count
+
+    def percentile(self, q):
+        return histogram_percentile(self.histogram, q)
+
+# Function to create the percentile sketches of a target or hop: 30 s, 5 min and the whole session
+def new_sketches(window=time_window):
+    return {
+        "Sketch": LatencySketch(window),
+        "LongSketch": LatencySketch(jitter_variation_window),
+        "SessionSketch": LatencySketch(),
+    }
+
+# Function to add a sample to the percentile sketches of a target or hop
+def add_to_sketches(series, timestamp, rtt):
+    if rtt is not None:
+        series["Sketch"].add(timestamp, rtt)
+        series["LongSketch"].add(timestamp, rtt)
+        series["SessionSketch"].add(timestamp, rtt)
+
+# Function to read the percentiles of a target or hop (caller holds its lock)
+def sketch_percentiles(series, current_time):
+    if "Sketch" not in series:
+        return dict.fromkeys(("P50", "P95", "P99", "P99Long", "P99Session"))
+    series["Sketch"].expire(current_time)
+    series["LongSketch"].expire(current_time)
+    return {
+        "P50": series["Sketch"].percentile(0.50),
+        "P95": series["Sketch"].percentile(0.95),
+        "P99": series["Sketch"].percentile(0.99),
+        "P99Long": series["LongSketch"].percentile(0.99),
+        "P99Session": series["SessionSketch"].percentile(0.99),
+    }
+
+# Function to open the sample store database, creating the schema when needed
+def open_store(path=store_file):
+    import sqlite3
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS samples (target TEXT, hop TEXT, ts REAL, rtt REAL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts)")
+    conn.execute("CREATE TABLE IF NOT EXISTS rollups (resolution INTEGER, target TEXT, hop TEXT, bucket_start REAL, "
+                 "count INTEGER, lost INTEGER, total REAL, total_squares REAL, min REAL, max REAL, histogram TEXT, "
+                 "PRIMARY KEY (resolution, target, hop, bucket_start))")
+    return conn
+
+# Class to append samples to the store from a background thread; probe threads only enqueue
+class SampleStore:
+    def __init__(self, path=store_file, flush_interval=1.0, max_queue=100000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.open_buckets = {}  # (resolution, target, hop, bucket_start) -> RollupBucket
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def add(self, target, hop, timestamp, rtt):
+        # hop is '' for samples of the proxy itself; samples are dropped if the writer falls behind
+        try:
+            self.queue.put_nowait((target, hop or '', timestamp, rtt))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        conn = open_store(self.path)
+        last_prune = 0.0
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while True:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            batch = [sample for sample in batch if sample is not None]  # None only wakes the writer up
+            now = time.time()
+            self.write(conn, batch, now, force=self.stop_event.is_set())
+            if now - last_prune >= 3600:
+                self.prune(conn, now)
+                last_prune = now
+        conn.close()
+
+    def write(self, conn, batch, now, force=False):
+        # Raw samples go in right away; rollup buckets only once they are closed (or on shutdown)
+        with conn:
+            if batch:
+                conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?)", batch)
+                for target, hop, timestamp, rtt in batch:
+                    for resolution in rollup_resolutions:
+                        key = (resolution, target, hop, timestamp - timestamp % resolution)
+                        bucket = self.open_buckets.get(key)
+                        if bucket is None:
+                            bucket = self.open_buckets[key] = RollupBucket()
+                        bucket.add(rtt)
+            self.flush_buckets(conn, now, force=force)
+
+    def flush_buckets(self, conn, now, force=False):
+        for key in list(self.open_buckets):
+            resolution, target, hop, bucket_start = key
+            if not force and bucket_start + resolution + rollup_grace > now:
+                continue
+            bucket = self.open_buckets.pop(key)
+            row = conn.execute("SELECT count, lost, total, total_squares, min, max, histogram FROM rollups "
+                               "WHERE resolution = ? AND target = ? AND hop = ? AND bucket_start = ?", key).fetchone()
+            if row is not None:
+                # A bucket already flushed (a late sample, or a previous shutdown), merge instead of overwriting
+                existing = RollupBucket.from_row(row)
+                existing.merge(bucket)
+                bucket = existing
+            conn.execute("INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", key + bucket.row())
+
+    def prune(self, conn, now):
+        with conn:
+            conn.execute("DELETE FROM samples WHERE ts < ?", (now - store_retention[None],))
+            for resolution in rollup_resolutions:
+                conn.execute("DELETE FROM rollups WHERE resolution = ? AND bucket_start < ?",
+                             (resolution, now - store_retention[resolution]))
+
+    def close(self, timeout=5.0):
+        self.stop_event.set()
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass  # Not waiting for samples anyway
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+sample_store = None
+
+# Function to record a probe sample in the persistent store, if enabled
+def record_sample(target, hop, timestamp, rtt):
+    if sample_store is not None:
+        sample_store.add(target, hop, timestamp, rtt)
+    if agent_uplink is not None:
+        agent_uplink.add(target, hop, timestamp, rtt)
+
+# Function to get statistics (including p50/p95/p99) for a target between two times from the rollups
+def query_store(target, start, end, hop='', path=store_file, conn=None):
+    # Coarser rollups for longer ranges, so a query reads at most a few thousand rows
+    span = end - start
+    resolution = 3600 if span >= 6 * 3600 else 60 if span >= 600 else 1
+    own_conn = conn is None
+    if own_conn:
+        conn = open_store(path)
+    try:
+        rows = conn.execute("SELECT count, lost, total, total_squares, min, max, histogram FROM rollups "
+                            "WHERE resolution = ? AND target = ? AND hop = ? AND bucket_start >= ? AND bucket_start < ?",
+                            (resolution, target, hop, start - start % resolution, end)).fetchall()
+    finally:
+        if own_conn:
+            conn.close()
+    merged = RollupBucket()
+    for row in rows:
+        merged.merge(RollupBucket.from_row(row))
+    result = merged.statistics()
+    result["Resolution"] = resolution
+    return result
 
 # Event to signal threads to stop
 stop_event = threading.Event()
 
-# Global variables
-latest_results = []
-traceroute_output = ""
+# Shutdown: the long-running workers of a run belong to one supervisor, which stops them together
+shutdown_deadline = 0.1     # Seconds for every worker to stop after 'q' or SIGTERM
+shutdown_drain = 5.0        # Seconds allowed to components that still have samples or exports to write
+input_poll_interval = 0.05  # Seconds between key checks while the UI waits for the next frame
+child_processes = set()     # Running ping/traceroute commands, killed on shutdown
+child_processes_lock = threading.Lock()
+
+# Function to run a command and return its output; the process is killed on shutdown, so no
+# thread is left waiting for a traceroute that takes 30 seconds
+def run_command(cmd, timeout=None):
+    if stop_event.is_set():
+        return ''
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               stdin=subprocess.DEVNULL, text=True)
+    with child_processes_lock:
+        child_processes.add(process)
+    if stop_event.is_set():
+        process.kill()  # Shutdown began while it was starting
+    try:
+        output, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        output, _ = process.communicate()
+    finally:
+        with child_processes_lock:
+            child_processes.discard(process)
+    return output
+
+# Function to kill the commands still running
+def kill_child_processes():
+    with child_processes_lock:
+        processes = list(child_processes)
+    for process in processes:
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+# Class to own the workers of a run as named tasks: threads are started through it and components
+# (prober, scheduler, streams, stores...) are registered with it, so shutdown signals all of them at
+# once and waits for them against a single deadline instead of one timeout after another
+class Supervisor:
+    def __init__(self):
+        self.tasks = []  # (name, thread, component, drain)
+        self.lock = threading.Lock()
+        self.shutdown_time = None
+
+    def start(self, name, target, *args):
+        thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+        with self.lock:
+            self.tasks.append((name, thread, None, False))
+        thread.start()
+        return thread
+
+    def own(self, name, component, thread=None, drain=False):
+        # component.close(timeout) stops it and waits for it at most timeout seconds
+        thread = thread or getattr(component, 'thread', None)
+        if thread is not None:
+            thread.name = name
+        with self.lock:
+            self.tasks.append((name, thread, component, drain))
+        return component
+
+    def shutdown(self, deadline=shutdown_deadline, drain=shutdown_drain):
+        # Returns the names of the tasks still running when their deadline passed
+        started = time.monotonic()
+        stop_event.set()
+        kill_child_processes()
+        with self.lock:
+            tasks = self.tasks[::-1]
+            self.tasks = []
+        for name, thread, component, _ in tasks:
+            if component is not None:
+                component.close(0)
+        for name, thread, component, draining in tasks:
+            if thread is not None and thread.is_alive():
+                thread.join(max(0.0, started + (drain if draining else deadline) - time.monotonic()))
+        self.shutdown_time = time.monotonic() - started
+        return [name for name, thread, _, _ in tasks if thread is not None and thread.is_alive()]
+
+supervisor = Supervisor()
+
+# Results and traceroute state are published as immutable snapshots: the writer builds a new
+# object and rebinds the global, readers take the reference once and never lock
+latest_results = ()
+traceroute_snapshot = {"output": "", "stats": [], "paths": {}}  # Best proxy's text and hops, every path
 best_proxy_hostname = None
+best_proxy_since = None  # Elapsed time of the last switch
+
+# Hysteresis of the best proxy: a challenger must beat the current score by switch_margin, and
+# the current best is kept at least switch_dwell seconds (unless it stops answering)
+switch_margin = 0.10
+switch_dwell = 15.0
 
 # Function to colorize metrics
 def colorize_metric(value, thresholds):
@@ -130,8 +1808,9 @@ def colorize_metric(value, thresholds):
 
 # Function to create a proxy metrics table
 def create_proxy_table(result):
+    from rich.table import Table
     table = Table(box=None, expand=True, show_header=False)
-    if "Error" in result or result['AvgPing'] is None:
+    if "Error" in result or (result['AvgPing'] is None and result.get('TcpAvgPing') is None):
         table.add_row(f"[red]Nenhum dado disponível.[/red]")
     else:
         avg_ping = colorize_metric(result['AvgPing'], [50, 100])
@@ -144,48 +1823,109 @@ def create_proxy_table(result):
         else:
             hops_text = f"{hops}"
         table.add_row("Ping Médio:", f"{avg_ping} ms")
-        table.add_row("Ping Mínimo:", f"{result['MinPing']:.2f} ms")
-        table.add_row("Ping Máximo:", f"{result['MaxPing']:.2f} ms")
+        table.add_row("Ping Mínimo:", f"{format_hop_value(result['MinPing'], ' ms')}")
+        table.add_row("Ping Máximo:", f"{format_hop_value(result['MaxPing'], ' ms')}")
         table.add_row("Perda de Pacotes:", f"{packet_loss}%")
         table.add_row("Jitter:", f"{jitter} ms")
         table.add_row("Var. do Jitter:", f"{jitter_var} ms")
+        if result.get('P99') is not None:
+            table.add_row("p50 / p95 / p99:", f"{result['P50']:.2f} / {result['P95']:.2f} / "
+                                              f"{colorize_metric(result['P99'], [100, 150])} ms")
+            table.add_row("p99 5 min / Sessão:", f"{format_hop_value(result['P99Long'], '')} / "
+                                                 f"{format_hop_value(result['P99Session'], '')} ms")
+        if result.get('TcpPacketLoss') is not None:
+            tcp_ping = colorize_metric(result['TcpAvgPing'], [50, 100])
+            tcp_loss = colorize_metric(result['TcpPacketLoss'], [1, 5])
+            table.add_row(f"Conexão TCP :{game_port}:", f"{tcp_ping} ms, {tcp_loss}% perda")
+        if load_generator is not None:
+            added = result.get('AddedLatency')
+            table.add_row("Sob Carga:", f"{format_hop_value(result.get('LoadedPing'), ' ms')} "
+                                        f"(+{colorize_metric(max(0.0, added), [30, 100]) if added is not None else '*'} ms), "
+                                        f"p99 {format_hop_value(result.get('LoadedP99'), ' ms')}")
         table.add_row("Número de Saltos:", hops_text)
+        for index, address in enumerate(result.get('Addresses', ())):
+            table.add_row("Endereços:" if index == 0 else "",
+                          f"{address['Address']}: {format_hop_value(address['AvgPing'], ' ms')}, "
+                          f"{format_hop_value(address['PacketLoss'], '%')}")
     return table
 
 # Function to create a summary table
 def create_summary_table(results):
+    from rich import box
+    from rich.table import Table
     table = Table(box=box.SIMPLE, show_edge=False)
     table.add_column("Proxy", style="bold", width=25)
     table.add_column("Ping Médio (ms)", justify="right")
     table.add_column("Perda de Pacotes (%)", justify="right")
     table.add_column("Jitter (ms)", justify="right")
     table.add_column("Jit.Var. (ms)", justify="right")
+    table.add_column("p99 (ms)", justify="right")
+    if game_port:
+        table.add_column("TCP (ms / %)", justify="right")
+    if load_generator is not None:
+        table.add_column("Sob carga (ms)", justify="right")
+        table.add_column("+Carga (ms)", justify="right")
+        table.add_column("p99 carga (ms)", justify="right")
     table.add_column("Saltos", justify="right")
     table.add_column("Score", justify="right")
 
     for result in results:
-        if "Error" in result or result['AvgPing'] is None:
-            avg_ping = packet_loss = jitter = hops = score = jitter_var = "[red]N/A[/red]"
+        if "Error" in result or (result['AvgPing'] is None and result.get('TcpAvgPing') is None):
+            avg_ping = packet_loss = jitter = hops = score = jitter_var = p99 = tcp = loaded = added = loaded_p99 = "[red]N/A[/red]"
         else:
-            avg_ping = f"{result['AvgPing']:.2f}"
-            packet_loss = f"{result['PacketLoss']:.2f}"
-            jitter = f"{result['Jitter']:.2f}"
-            jitter_var = f"{result['JitterVariation']:.2f}"
+            not_available = lambda value: f"{value:.2f}" if value is not None else "[red]N/A[/red]"
+            avg_ping = not_available(result['AvgPing'])
+            packet_loss = not_available(result['PacketLoss'])
+            jitter = not_available(result['Jitter'])
+            jitter_var = not_available(result['JitterVariation'])
+            p99 = not_available(result.get('P99'))
+            tcp = f"{not_available(result.get('TcpAvgPing'))} / {not_available(result.get('TcpPacketLoss'))}"
+            loaded = not_available(result.get('LoadedPing'))
+            added = not_available(result.get('AddedLatency'))
+            loaded_p99 = not_available(result.get('LoadedP99'))
             hops = str(result['Hops']) if result['Hops'] is not None else "[italic](em exec.)[/italic]"
-            score = f"{result['Score']:.2f}"
-        table.add_row(
-            result['DisplayName'],
-            avg_ping,
-            packet_loss,
-            jitter,
-            jitter_var,
-            hops,
-            score
-        )
+            score = not_available(result['Score'])
+        row = [result['DisplayName'], avg_ping, packet_loss, jitter, jitter_var, p99]
+        if game_port:
+            row.append(tcp)
+        if load_generator is not None:
+            row += [loaded, added, loaded_p99]
+        table.add_row(*row, hops, score)
     return table
 
+# Renderables kept between frames, so update_layout only rebuilds what changed
+ui_cache = {}
+
+# Function to get a cached renderable, calling build only when its key changed; returns (renderable, changed)
+def cached_renderable(name, key, build):
+    entry = ui_cache.get(name)
+    if entry is not None and entry[0] == key:
+        return entry[1], False
+    renderable = build()
+    ui_cache[name] = (key, renderable)
+    return renderable, True
+
+# Function to get the values a result is displayed with, used to detect changes
+def result_display_key(result):
+    if "Error" in result or (result['AvgPing'] is None and result.get('TcpAvgPing') is None):
+        return (result['DisplayName'], None)
+    values = tuple(None if result.get(k) is None else round(result[k], 2)
+                   for k in ('AvgPing', 'MinPing', 'MaxPing', 'PacketLoss', 'Jitter', 'JitterVariation', 'Score',
+                             'P50', 'P95', 'P99', 'P99Long', 'P99Session', 'TcpAvgPing', 'TcpPacketLoss',
+                             'LoadedPing', 'LoadedP99', 'AddedLatency'))
+    addresses = tuple((a['Address'], None if a['AvgPing'] is None else round(a['AvgPing'], 2),
+                       None if a['PacketLoss'] is None else round(a['PacketLoss'], 2))
+                      for a in result.get('Addresses', ()))
+    return (result['DisplayName'], result['Hops']) + values + addresses
+
+# Function to format a hop metric for the traceroute table
+def format_hop_value(value, unit):
+    return f"{value:.2f}{unit}" if value is not None else '*'
+
 # Function to create the main layout
 def create_layout():
+    from rich.layout import Layout
+    ui_cache.clear()  # A new layout needs every region filled again
     layout = Layout()
     layout.split(
         Layout(name="header", size=4),
@@ -208,187 +1948,526 @@ def create_layout():
 
 # Function to update the layout with proxy results
 def update_layout(layout, results, best_proxy_hostname, connection_type, wifi_detected, elapsed_time):
-    header_text = f"[bold magenta]Monitor de Desempenho de Proxies[/bold magenta]\n[cyan]Tipo de Conexão: {connection_type}[/cyan]"
-    if wifi_detected:
-        header_text += "\n[bold red]Conexão via Wi-Fi detectada, por favor, utilize sempre uma conexão via cabo para jogar no RagnaTales[/bold red]"
-    layout["header"].update(Align.center(header_text, vertical="middle"))
-    layout["footer"].update(Align.center(f"Pressione 's' para salvar os resultados | Pressione 'q' para sair", vertical="middle"))
+    from rich import box
+    from rich.align import Align
+    from rich.columns import Columns
+    from rich.panel import Panel
+    from rich.spinner import Spinner
+    from rich.table import Table
+    from rich.text import Text
+
+    recommendation = fleet_recommendation
+    load_status = load_generator.status() if load_generator is not None else None
+
+    def build_header():
+        header_text = f"[bold magenta]Monitor de Desempenho de Proxies[/bold magenta]\n[cyan]Tipo de Conexão: {connection_type}[/cyan]"
+        if recommendation:
+            names = {p['hostname']: p['display_name'] for p in proxies}
+            name = lambda hostname: names.get(hostname, hostname) if hostname else "-"
+            header_text += (f" | [cyan]Recomendação da frota: {name(recommendation.get('fleet'))} "
+                            f"(local: {name(recommendation.get('site'))})[/cyan]")
+        if load_status:
+            header_text += f" | [cyan]Carga: {load_status}[/cyan]"
+        if wifi_detected:
+            header_text += "\n[bold red]Conexão via Wi-Fi detectada, por favor, utilize sempre uma conexão via cabo para jogar no RagnaTales[/bold red]"
+        return Align.center(header_text, vertical="middle")
+
+    header, changed = cached_renderable("header", (connection_type, wifi_detected, str(recommendation), load_status),
+                                        build_header)
+    if changed:
+        layout["header"].update(header)
+    footer, changed = cached_renderable("footer", None, lambda: Align.center(
+        f"Pressione 's' para salvar os resultados | Pressione 'q' para sair", vertical="middle"))
+    if changed:
+        layout["footer"].update(footer)
 
-    # Create a panel for each proxy
+    results_by_host = {r["Proxy"]: r for r in results}
+
+    # Create (or reuse) a panel for each proxy
     proxy_panels = []
     for proxy in proxies:
         hostname = proxy['hostname']
         display_name = proxy['display_name']
         description = proxy['description']
-        result = next((r for r in results if r["Proxy"] == hostname), None)
+        result = results_by_host.get(hostname)
+        border_style = "green" if best_proxy_hostname == hostname else "white"
         if result:
-            proxy_table = create_proxy_table(result)
-            panel_content = proxy_table
-            # Include description in panel content
-            description_text = Text(description, style="italic")
-            panel_content = Table.grid(expand=True)
-            panel_content.add_row(proxy_table)
-            panel_content.add_row(description_text)
+            def build_content():
+                # Include description in panel content
+                panel_content = Table.grid(expand=True)
+                panel_content.add_row(create_proxy_table(result))
+                panel_content.add_row(Text(description, style="italic"))
+                return panel_content
+            key = ("result", result_display_key(result), border_style)
         else:
-            spinner = Spinner("dots", text=" Testando...")
-            panel_content = Align.center(spinner, vertical="middle")
+            def build_content():
+                # The spinner is reused so its animation keeps running
+                spinner, _ = cached_renderable(("spinner", hostname), None, lambda: Spinner("dots", text=" Testando..."))
+                return Align.center(spinner, vertical="middle")
+            key = ("spinner", border_style)
 
-        panel = Panel(
-            panel_content,
+        panel, _ = cached_renderable(("proxy", hostname), key, lambda: Panel(
+            build_content(),
             title=f"[bold]{display_name}[/bold]",
-            border_style="green" if best_proxy_hostname == hostname else "white",
+            border_style=border_style,
             padding=(0, 1),
             expand=True
-        )
+        ))
         proxy_panels.append(panel)
 
     # Display proxies in columns
-    proxies_columns = Columns(proxy_panels, equal=True, expand=True)
-    layout["proxies"].update(proxies_columns)
+    if proxy_panels:
+        columns, _ = cached_renderable("columns", None, lambda: Columns([], equal=True, expand=True))
+        if columns.renderables != proxy_panels:
+            columns.renderables[:] = proxy_panels
+        proxies_region = columns
+    else:
+        proxies_region, _ = cached_renderable("searching", None, lambda: Align.center(
+            Spinner("dots", text=" Procurando proxies..."), vertical="middle"))
+    if ui_cache.get("proxies_region") is not proxies_region:
+        ui_cache["proxies_region"] = proxies_region
+        layout["proxies"].update(proxies_region)
 
     # Update summary panel
-    summary_table = create_summary_table(results)
-    layout["summary"].update(Panel(summary_table, title="[bold]Resumo[/bold]", border_style="cyan", expand=True))
+    summary_key = tuple(result_display_key(r) for r in results)
+    summary, changed = cached_renderable("summary", summary_key, lambda: Panel(
+        create_summary_table(results), title="[bold]Resumo[/bold]", border_style="cyan", expand=True))
+    if changed:
+        layout["summary"].update(summary)
 
     # Update best proxy panel
     if elapsed_time < 30:
         seconds_left = int(30 - elapsed_time)
-        spinner = Spinner("dots", text=f" Testando sua conexão, aguarde {seconds_left} segundos...")
-        best_panel_content = Align.center(spinner, vertical="middle")
-        layout["best_proxy"].update(Panel(
-            best_panel_content,
+        spinner, _ = cached_renderable("countdown_spinner", None, lambda: Spinner("dots"))
+        spinner.update(text=f" Testando sua conexão, aguarde {seconds_left} segundos...")
+        best_panel, changed = cached_renderable("best_proxy", "countdown", lambda: Panel(
+            Align.center(spinner, vertical="middle"),
             title=f"[bold yellow]Analisando Proxies[/bold yellow]",
             border_style="yellow",
             padding=(1, 2),
             expand=True
         ))
-    else:
-        if best_proxy_hostname:
-            result = next(r for r in results if r["Proxy"] == best_proxy_hostname)
-            best_proxy_table = create_proxy_table(result)
-            best_proxy_display_name = result['DisplayName']
-            best_proxy_description = result['Description']
-            # Include description and traceroute output in panel content
-            best_panel_content = Table.grid(expand=True)
-            best_panel_content.add_row(best_proxy_table)
-            best_panel_content.add_row(Text(best_proxy_description, style="italic"))
+    elif best_proxy_hostname and best_proxy_hostname in results_by_host:
+        result = results_by_host[best_proxy_hostname]
+        hop_stats = traceroute_snapshot["stats"]
+        hops_key = tuple((h['Hop'], h['IP'], h['Paths']) + tuple(None if h[k] is None else round(h[k], 2)
+                                                     for k in ('PacketLoss', 'Last', 'AvgPing', 'Best', 'Worst'))
+                         for h in hop_stats)
 
-            # Get traceroute output
-            with traceroute_lock:
-                traceroute_text = traceroute_output.strip()
+        def build_best_panel():
+            # Include description and traceroute statistics in panel content
+            best_panel_content = Table.grid(expand=True)
+            best_panel_content.add_row(create_proxy_table(result))
+            best_panel_content.add_row(Text(result['Description'], style="italic"))
 
-            if traceroute_text:
+            if hop_stats:
                 # Traceroute statistics
                 traceroute_table = Table(box=box.MINIMAL_DOUBLE_HEAD)
                 traceroute_table.add_column("Hop", justify="right")
                 traceroute_table.add_column("IP", justify="left")
-                traceroute_table.add_column("AvgPing (ms)", justify="right")
-                traceroute_table.add_column("Perda (%)", justify="right")
-                for line in traceroute_text.splitlines():
-                    parts = line.split('\t')
-                    if len(parts) == 4:
-                        hop, ip, avg_ping_str, packet_loss_str = parts
-                        traceroute_table.add_row(hop, ip, avg_ping_str.split(': ')[1], packet_loss_str.split(': ')[1])
+                traceroute_table.add_column("Perda", justify="right")
+                traceroute_table.add_column("Último", justify="right")
+                traceroute_table.add_column("Médio", justify="right")
+                traceroute_table.add_column("Melhor", justify="right")
+                traceroute_table.add_column("Pior", justify="right")
+                traceroute_table.add_column("Rotas", justify="right")
+                for hop in hop_stats:
+                    traceroute_table.add_row(
+                        str(hop['Hop']),
+                        hop['IP'],
+                        format_hop_value(hop['PacketLoss'], '%'),
+                        *(format_hop_value(hop[k], ' ms') for k in ('Last', 'AvgPing', 'Best', 'Worst')),
+                        f"{hop['Paths']}/{len(proxies)}"
+                    )
                 traceroute_section = traceroute_table
             else:
-                spinner = Spinner("dots", text=" Traceroute em execução...")
+                spinner, _ = cached_renderable("traceroute_spinner", None, lambda: Spinner("dots", text=" Traceroute em execução..."))
                 traceroute_section = Align.center(spinner, vertical="middle")
 
             best_panel_content.add_row(Text("\nResultado do Traceroute:", style="bold underline"))
             best_panel_content.add_row(traceroute_section)
-
-            layout["best_proxy"].update(Panel(
+            return Panel(
                 best_panel_content,
-                title=f"[bold green]Melhor Proxy: {best_proxy_display_name}[/bold green]",
+                title=f"[bold green]Melhor Proxy: {result['DisplayName']}[/bold green]",
                 border_style="bright_green",
                 padding=(1, 2),
                 expand=True
-            ))
-        else:
-            layout["best_proxy"].update(Panel(
-                "[red]Nenhum dado de proxy válido disponível[/red]",
-                title="[bold red]Melhor Proxy[/bold red]",
-                border_style="red",
-                padding=(1, 2),
-                expand=True
-            ))
+            )
+
+        best_panel, changed = cached_renderable("best_proxy", ("best", result_display_key(result), hops_key), build_best_panel)
+    else:
+        best_panel, changed = cached_renderable("best_proxy", "none", lambda: Panel(
+            "[red]Nenhum dado de proxy válido disponível[/red]",
+            title="[bold red]Melhor Proxy[/bold red]",
+            border_style="red",
+            padding=(1, 2),
+            expand=True
+        ))
+    if changed:
+        layout["best_proxy"].update(best_panel)
 
-    # Update info panel with explanations
-    info_text = Text()
-    info_text.append("Explicação das métricas:\n", style="bold underline")
-    info_text.append("- Ping: Tempo para enviar e receber um pacote. Quanto menor, melhor.\n")
-    info_text.append("- Perda de Pacotes: Indica instabilidade ou perda de conexão.\n")
-    info_text.append("- Jitter: Variação no tempo de resposta. Valores altos podem indicar instabilidade.\n")
-    info_text.append("- Var. do Jitter: Variação do jitter ao longo do tempo. Valores altos indicam instabilidade prolongada.\n")
-    info_text.append("- Número de Saltos: Quantidade de roteadores entre você e o servidor.\n")
-    info_text.append("- Score: Métrica composta que avalia o desempenho geral do proxy. Quanto menor, melhor.\n")
-    info_text.append("- Traceroute: Roteadores pelos quais os pacotes passaram até o destino.\n")
+    # Info panel with explanations, its content never changes
+    def build_info():
+        info_text = Text()
+        info_text.append("Explicação das métricas:\n", style="bold underline")
+        info_text.append("- Ping: Tempo para enviar e receber um pacote. Quanto menor, melhor.\n")
+        info_text.append("- Perda de Pacotes: Indica instabilidade ou perda de conexão.\n")
+        info_text.append("- Jitter: Variação no tempo de resposta. Valores altos podem indicar instabilidade.\n")
+        info_text.append("- Var. do Jitter: Variação do jitter ao longo do tempo. Valores altos indicam instabilidade prolongada.\n")
+        info_text.append("- Número de Saltos: Quantidade de roteadores entre você e o servidor.\n")
+        info_text.append("- Score: Métrica composta que avalia o desempenho geral do proxy. Quanto menor, melhor.\n")
+        info_text.append("- Traceroute: Roteadores pelos quais os pacotes passaram até o destino.\n")
+        info_text.append("- Rotas: Quantos proxies passam pelo salto. Perda num salto comum a todos indica problema na sua rede ou no provedor.\n")
+        return Panel(info_text, title="[bold]Informações[/bold]", border_style="blue", padding=(1, 2), expand=True)
 
-    layout["info"].update(Panel(info_text, title="[bold]Informações[/bold]", border_style="blue", padding=(1, 2), expand=True))
+    info, changed = cached_renderable("info", None, build_info)
+    if changed:
+        layout["info"].update(info)
 
 # Function to save results to a file, including the winner proxy and traceroute
-def save_results(results, best_proxy_hostname, traceroute_output):
-    timestamp = time.strftime("%Y%m%d_%H%M%S")
-    filename = f"resultados_proxies_{timestamp}.txt"
+def save_results(results, best_proxy_hostname, traceroute_output, filename=None):
+    if filename is None:
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        filename = f"resultados_proxies_{timestamp}.txt"
     with open(filename, 'w', encoding='utf-8') as f:
         f.write("===== Resultados dos Proxies =====\n\n")
         for result in results:
             f.write(f"Proxy: {result['DisplayName']}\n")
-            if "Error" in result or result['AvgPing'] is None:
+            # Same check as the UI: a proxy that only answers TCP connects still has results
+            if "Error" in result or (result['AvgPing'] is None and result.get('TcpAvgPing') is None):
                 f.write(f"  Erro: Nenhum dado disponível.\n")
             else:
-                f.write(f"  Ping Médio: {result['AvgPing']:.2f} ms\n")
-                f.write(f"  Ping Mínimo: {result['MinPing']:.2f} ms\n")
-                f.write(f"  Ping Máximo: {result['MaxPing']:.2f} ms\n")
-                f.write(f"  Perda de Pacotes: {result['PacketLoss']:.2f}%\n")
-                f.write(f"  Jitter: {result['Jitter']:.2f} ms\n")
-                f.write(f"  Var. do Jitter: {result['JitterVariation']:.2f} ms\n")
+                f.write(f"  Ping Médio: {format_hop_value(result['AvgPing'], ' ms')}\n")
+                f.write(f"  Ping Mínimo: {format_hop_value(result['MinPing'], ' ms')}\n")
+                f.write(f"  Ping Máximo: {format_hop_value(result['MaxPing'], ' ms')}\n")
+                f.write(f"  Perda de Pacotes: {format_hop_value(result['PacketLoss'], '%')}\n")
+                f.write(f"  Jitter: {format_hop_value(result['Jitter'], ' ms')}\n")
+                f.write(f"  Var. do Jitter: {format_hop_value(result['JitterVariation'], ' ms')}\n")
+                f.write(f"  p50 / p95 / p99: {format_hop_value(result['P50'], '')} / {format_hop_value(result['P95'], '')} / "
+                        f"{format_hop_value(result['P99'], '')} ms (p99 5 min: {format_hop_value(result['P99Long'], '')} ms, "
+                        f"sessão: {format_hop_value(result['P99Session'], '')} ms)\n")
+                if result.get('TcpPacketLoss') is not None:
+                    f.write(f"  Conexão TCP :{game_port}: {format_hop_value(result['TcpAvgPing'], ' ms')}, "
+                            f"{result['TcpPacketLoss']:.2f}% perda\n")
+                if 'LoadedPing' in result:
+                    f.write(f"  Sob Carga: {format_hop_value(result['LoadedPing'], ' ms')} "
+                            f"(+{format_hop_value(result['AddedLatency'], ' ms')}), "
+                            f"p99 {format_hop_value(result['LoadedP99'], ' ms')}\n")
                 f.write(f"  Número de Saltos: {result['Hops']}\n")
-                f.write(f"  Score: {result['Score']:.2f}\n")
+                f.write(f"  Score: {format_hop_value(result['Score'], '')}\n")
+                for address in result.get('Addresses', ()):
+                    f.write(f"  Endereço {address['Address']}: {format_hop_value(address['AvgPing'], ' ms')}, "
+                            f"{format_hop_value(address['PacketLoss'], '%')} perda, "
+                            f"score {format_hop_value(address['Score'], '')}\n")
             f.write("\n")
         if best_proxy_hostname:
             best_result = next(r for r in results if r["Proxy"] == best_proxy_hostname)
             f.write("===== Melhor Proxy =====\n\n")
             f.write(f"Proxy: {best_result['DisplayName']}\n")
             f.write(f"Descrição: {best_result['Description']}\n")
-            f.write(f"Ping Médio: {best_result['AvgPing']:.2f} ms\n")
-            f.write(f"Perda de Pacotes: {best_result['PacketLoss']:.2f}%\n")
-            f.write(f"Jitter: {best_result['Jitter']:.2f} ms\n")
-            f.write(f"Var. do Jitter: {best_result['JitterVariation']:.2f} ms\n")
+            f.write(f"Ping Médio: {format_hop_value(best_result['AvgPing'], ' ms')}\n")
+            f.write(f"Perda de Pacotes: {format_hop_value(best_result['PacketLoss'], '%')}\n")
+            f.write(f"Jitter: {format_hop_value(best_result['Jitter'], ' ms')}\n")
+            f.write(f"Var. do Jitter: {format_hop_value(best_result['JitterVariation'], ' ms')}\n")
+            f.write(f"p99: {format_hop_value(best_result['P99'], ' ms')}\n")
+            if best_result.get('TcpPacketLoss') is not None:
+                f.write(f"Conexão TCP :{game_port}: {format_hop_value(best_result['TcpAvgPing'], ' ms')}, "
+                        f"{best_result['TcpPacketLoss']:.2f}% perda\n")
             f.write(f"Número de Saltos: {best_result['Hops']}\n")
-            f.write(f"Score: {best_result['Score']:.2f}\n\n")
+            f.write(f"Score: {format_hop_value(best_result['Score'], '')}\n\n")
             f.write("===== Traceroute do Melhor Proxy =====\n\n")
             f.write(traceroute_output)
         else:
             f.write("Nenhum melhor proxy determinado.\n")
-    console.print(f"[green]Resultados salvos em {filename}[/green]")
+    get_console().print(f"[green]Resultados salvos em {filename}[/green]")
+
+# Export: results are written by a background thread from an immutable snapshot, as the text
+# summary, JSON Lines, CSV or a compact binary dump (.pxt) that includes the raw samples in memory
+export_formats = ("txt", "jsonl", "csv", "pxt")
+export_magic = b'PXT1'
+
+# Function to take the snapshot an export works from (results and traceroute state are never mutated)
+def export_snapshot():
+    return {"timestamp": time.time(), "results": latest_results, "best_proxy": best_proxy_hostname,
+            "traceroute": traceroute_snapshot}
+
+# Function to iterate over the raw samples kept in memory as (target, hop, timestamps, rtts, lost);
+# each series is copied under its own lock, the ring being overwritten in place by its writer, so a
+# probe waits for one copy of its own series at most
+def iter_raw_samples():
+    for proxy in proxies:
+        hostname = proxy['hostname']
+        metric = metrics.get(hostname)
+        if metric is None:
+            continue
+        with metric['Lock']:
+            series = [('', metric['History'].window())]
+            if metric['Tcp'] is not None:
+                series.append((f"tcp:{game_port}", metric['Tcp']['History'].window()))
+        for hop, (timestamps, values, lost) in series:
+            yield hostname, hop, timestamps, values, lost
+    monitor = path_monitor
+    if monitor is None:
+        return
+    for key in list(monitor.hops):
+        with monitor.lock:
+            hop = monitor.hops.get(key)
+            if hop is None:
+                continue
+            ip, paths = hop['ip'] or '*', sorted(hop['paths'])
+            timestamps, values, lost = hop['metrics']['Window'].samples.window()
+        for hostname in paths:
+            yield hostname, ip, timestamps, values, lost
+
+# Function to write an export as JSON Lines: a meta line, one line per result and hop, then a summary
+# line and one line per sample for every series
+def write_jsonl(path, snapshot):
+    with open(path, 'w', encoding='utf-8') as f:
+        write = lambda record: f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        write({"type": "meta", "timestamp": snapshot["timestamp"], "best_proxy": snapshot["best_proxy"]})
+        for result in snapshot["results"]:
+            write({"type": "result", **result})
+        for hostname, stats in snapshot["traceroute"]["paths"].items():
+            for hop in stats:
+                write({"type": "hop", "proxy": hostname, **hop})
+        for target, hop, timestamps, values, lost in iter_raw_samples():
+            # Summary of the whole history in memory, ahead of its samples
+            write({"type": "series", "target": target, "hop": hop, **sample_stats(values, lost)})
+            for ts, rtt, missing in zip(timestamps, values, lost):
+                write({"type": "sample", "target": target, "hop": hop, "ts": ts, "rtt": None if missing else rtt})
+
+# Function to write an export as CSV: results, hops and samples in three files next to each other
+def write_csv(path, snapshot):
+    import csv
+    base = path[:-len('.csv')]
+    results = snapshot["results"]
+    with open(base + '.csv', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        # Per-address results are nested, only in the JSON Lines and binary exports
+        columns = [column for column in results[0] if column != "Addresses"] if results else ["Proxy"]
+        writer.writerow(columns + ["Best"])
+        for result in results:
+            writer.writerow([result.get(column) for column in columns] + [result["Proxy"] == snapshot["best_proxy"]])
+    with open(base + '_saltos.csv', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        columns = None
+        for hostname, stats in snapshot["traceroute"]["paths"].items():
+            for hop in stats:
+                if columns is None:
+                    columns = list(hop)
+                    writer.writerow(["Proxy"] + columns)
+                writer.writerow([hostname] + [hop.get(column) for column in columns])
+    # Same columns as --replay reads
+    with open(base + '_amostras.csv', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["target", "hop", "ts", "rtt"])
+        for target, hop, timestamps, values, lost in iter_raw_samples():
+            writer.writerows((target, hop, f"{ts:.6f}", '' if missing else f"{rtt:.3f}")
+                             for ts, rtt, missing in zip(timestamps, values, lost))
+
+# Function to write a binary export: magic, then records of a type byte and a little-endian u32 length.
+# 'J' holds the results and hop statistics as JSON; 'S' holds one series: target and hop (u16 length +
+# UTF-8 each), u32 count, count float64 timestamps and count float32 RTTs (NaN for a loss)
+def write_pxt(path, snapshot):
+    with open(path, 'wb') as f:
+        f.write(export_magic)
+        document = json.dumps({"timestamp": snapshot["timestamp"], "best_proxy": snapshot["best_proxy"],
+                               "results": snapshot["results"], "paths": snapshot["traceroute"]["paths"]},
+                              ensure_ascii=False).encode('utf-8')
+        f.write(b'J' + struct.pack('<I', len(document)) + document)
+        for target, hop, timestamps, values, lost in iter_raw_samples():
+            for index, missing in enumerate(lost):
+                if missing:
+                    values[index] = math.nan
+            if sys.byteorder != 'little':
+                timestamps.byteswap()
+                values.byteswap()
+            names = b''.join(struct.pack('<H', len(name)) + name for name in (target.encode('utf-8'), hop.encode('utf-8')))
+            payload = names + struct.pack('<I', len(timestamps)) + timestamps.tobytes() + values.tobytes()
+            f.write(b'S' + struct.pack('<I', len(payload)) + payload)
+
+# Function to read the samples of a binary export (open file) as (ts, target, hop, rtt), one series at a time
+def read_pxt_samples(f, path):
+    if f.read(len(export_magic)) != export_magic:
+        raise ValueError(f"{path} não é uma exportação binária do proxytest")
+    while True:
+        header = f.read(5)
+        if len(header) < 5:
+            return
+        kind, length = header[:1], struct.unpack('<I', header[1:])[0]
+        payload = f.read(length)
+        if kind != b'S':
+            continue
+        offset = 0
+        names = []
+        for _ in range(2):
+            size = struct.unpack_from('<H', payload, offset)[0]
+            names.append(payload[offset + 2:offset + 2 + size].decode('utf-8'))
+            offset += 2 + size
+        count = struct.unpack_from('<I', payload, offset)[0]
+        offset += 4
+        timestamps = array('d', payload[offset:offset + 8 * count])
+        values = array('f', payload[offset + 8 * count:offset + 12 * count])
+        if sys.byteorder != 'little':
+            timestamps.byteswap()
+            values.byteswap()
+        for ts, rtt in zip(timestamps, values):
+            yield ts, names[0], names[1], None if math.isnan(rtt) else rtt
+
+# Class to write exports from a background thread, on request (key 's') and optionally on a timer,
+# so a slow disk or network share never holds up the UI
+class ResultExporter:
+    def __init__(self, formats=("txt",), directory='.', interval=None):
+        self.formats = formats
+        self.directory = directory
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=4)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def request(self):
+        # Called from the UI loop: only takes the snapshot references
+        try:
+            self.queue.put_nowait(export_snapshot())
+            return True
+        except queue.Full:
+            return False
+
+    def run(self):
+        next_export = time.monotonic() + self.interval if self.interval else None
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            timeout = 0.5 if next_export is None else max(0, min(0.5, next_export - time.monotonic()))
+            try:
+                snapshot = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                if next_export is None or time.monotonic() < next_export:
+                    continue
+                next_export += self.interval
+                snapshot = export_snapshot()
+            if snapshot is not None:  # None only wakes the writer up
+                self.write(snapshot)
+
+    def write(self, snapshot):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(snapshot["timestamp"]))
+        base = os.path.join(self.directory, f"resultados_proxies_{stamp}")
+        for export_format in self.formats:
+            path = f"{base}.{export_format}"
+            try:
+                if export_format == "txt":
+                    save_results(snapshot["results"], snapshot["best_proxy"], snapshot["traceroute"]["output"], path)
+                    continue  # save_results reports it
+                {"jsonl": write_jsonl, "csv": write_csv, "pxt": write_pxt}[export_format](path, snapshot)
+                get_console().print(f"[green]Resultados salvos em {path}[/green]")
+            except OSError as e:
+                get_console().print(f"[red]Erro ao salvar {path}: {e}[/red]")
+
+    def close(self, timeout=10.0):
+        self.stop_event.set()
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+exporter = None
 
 # Function to check user input
 def check_user_input():
     if sys.platform == 'win32':
+        import msvcrt  # For key capture on Windows
         if msvcrt.kbhit():
             key = msvcrt.getch().decode('utf-8', errors='ignore').lower()
             if key == 'q':
                 stop_event.set()
             elif key == 's':
-                with lock, traceroute_lock:
-                    current_results = list(latest_results)
-                    current_best_proxy_hostname = best_proxy_hostname
-                    current_traceroute_output = traceroute_output
-                save_results(current_results, current_best_proxy_hostname, current_traceroute_output)
+                # The export runs in the background; a full queue means several are already pending
+                if exporter is not None and not exporter.request():
+                    get_console().print("[yellow]Exportação anterior ainda em andamento.[/yellow]")
     else:
         # Implement for Unix/Linux if necessary
         pass
 
+# Standard initial TTLs used by common operating systems
+initial_ttls = (64, 128, 255)
+max_hops = 30
+hop_trace_interval = 60  # Minimum seconds between full traces of the same proxy
+
+# Function to infer the number of hops from the TTL of an echo reply, None if it can't be trusted
+def infer_hops(reply_ttl):
+    if not reply_ttl or reply_ttl < 0 or reply_ttl > initial_ttls[-1]:
+        return None
+    initial_ttl = next(t for t in initial_ttls if t >= reply_ttl)
+    hops = initial_ttl - reply_ttl + 1
+    return hops if hops <= max_hops else None
+
+# Function to update the hop count of a proxy from the TTL of an echo reply (caller holds its lock)
+def update_hops_estimate(hostname, reply_ttl):
+    metric = get_metric(hostname)
+    inferred = infer_hops(reply_ttl)
+    if inferred is None:
+        # No usable TTL (TCP fallback, unusual initial TTL): rely on periodic full traces
+        metric['TraceRequested'] = True
+        return
+    if metric['InferredHops'] is not None and inferred != metric['InferredHops']:
+        # The route (or the reply path) changed, confirm with a full trace
+        metric['TraceRequested'] = True
+        metric['HopsOffset'] = 0
+    metric['InferredHops'] = inferred
+    metric['Hops'] = inferred + metric['HopsOffset']
+
+# Function to trace a path with TTL-limited probes sent all at once through the shared prober,
+# returns {ttl: (responder_ip, reached_destination)} for the TTLs that got an answer
+def trace_path(destination, timeout=1.0):
+    replies = {}
+    remaining = [max_hops]
+    done = threading.Event()
+    counter_lock = threading.Lock()
+
+    def on_reply(ttl, responder, rtt, reached_destination, reply_ttl):
+        with counter_lock:
+            if responder is not None:
+                replies[ttl] = (responder, reached_destination)
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    for ttl in range(1, max_hops + 1):
+        get_prober().send_probe(destination, ttl, functools.partial(on_reply, ttl), timeout)
+    deadline = time.monotonic() + timeout + 0.5
+    while not done.wait(input_poll_interval) and not stop_event.is_set() and time.monotonic() < deadline:
+        pass
+    with counter_lock:
+        return dict(replies)
+
+# Function to count hops with TTL-limited probes sent all at once through the shared prober
+def trace_hop_count(hostname, timeout=1.0):
+    destination = proxy_address(hostname)
+    if destination is None:
+        # Not a monitored proxy (or not resolved yet): resolve it on the spot
+        try:
+            destination = resolve_host(hostname)[0]
+        except (socket.gaierror, socket.herror, OSError, IndexError):
+            return None
+    reached = [ttl for ttl, (_, reached_destination) in trace_path(destination, timeout).items() if reached_destination]
+    return min(reached) if reached else None
+
 # Function to get number of hops from traceroute
 def get_number_of_hops(hostname):
+    if ping_backend not in system_ping_backends and get_prober().supports_ttl:
+        return trace_hop_count(hostname)
+    # The system traceroute resolves hosts that aren't in the address cache itself
+    destination = proxy_address(hostname) or hostname
     if sys.platform == 'win32':
-        cmd = ['tracert', '-d', '-h', '30', '-w', '1000', hostname]
+        cmd = ['tracert', '-d', '-h', str(max_hops), '-w', '1000', destination]
     else:
-        cmd = ['traceroute', '-n', '-m', '30', '-w', '1', hostname]
+        cmd = ['traceroute', '-n', '-m', str(max_hops), '-w', '1', destination]
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        output = result.stdout
+        output = run_command(cmd, timeout=30)
         hops = 0
         for line in output.splitlines():
             if re.match(r'^\s*\d+', line):
@@ -397,20 +2476,39 @@ def get_number_of_hops(hostname):
     except Exception as e:
         return None
 
-# Function to update hops for a single proxy asynchronously
-def update_hops_for_proxy(proxy):
-    hostname = proxy['hostname']
+# Function to run full traces, from a single thread, only for proxies whose inferred hop count
+# changed or can't be trusted
+def hop_trace_worker():
     while not stop_event.is_set():
-        hops = get_number_of_hops(hostname)
-        with lock:
-            metrics[hostname]['Hops'] = hops
-        time.sleep(60)  # Update every 60 seconds
+        hostname = None
+        now = time.time()
+        for host, metric in list(metrics.items()):
+            with metric['Lock']:
+                if metric['TraceRequested'] and now - metric['LastTrace'] >= hop_trace_interval:
+                    hostname = host
+                    metric['TraceRequested'] = False
+                    metric['LastTrace'] = now
+                    break
+        if hostname is None:
+            stop_event.wait(1)
+            continue
+        traced = get_number_of_hops(hostname)
+        if traced is None:
+            continue
+        metric = get_metric(hostname)
+        with metric['Lock']:
+            # Remember how far off the TTL inference was, so later replies keep the traced value
+            if metric['InferredHops'] is not None:
+                metric['HopsOffset'] = traced - metric['InferredHops']
+            metric['Hops'] = traced
 
-# Function to start hops update threads for each proxy
-def start_hops_update_threads():
-    for proxy in proxies:
-        t = threading.Thread(target=update_hops_for_proxy, args=(proxy,), daemon=True)
-        t.start()
+# Function to start probing (proxy, addresses) pairs through the shared scheduler, or in their
+# workers with --workers
+def start_proxy_threads(entries):
+    if shard_pool is not None:
+        shard_pool.add([(proxy['hostname'], addresses) for proxy, addresses in entries])
+    else:
+        get_scheduler().add(*(proxy['hostname'] for proxy, _ in entries))
 
 # Function to get the connection type
 def get_connection_type():
@@ -455,330 +2553,1939 @@ def get_connection_type():
     except Exception as e:
         return 'Tipo de conexão desconhecido', False
 
-# Function for continuous pinging
-def continuous_ping(proxy):
-    hostname = proxy['hostname']
-    while not stop_event.is_set():
-        try:
-            # Adjust 'ping' command for Windows or Unix-like systems
-            if sys.platform == 'win32':
-                cmd = ['ping', '-n', '1', '-w', '1000', hostname]
+# Function to store the result of one probe to a proxy (ping_time None means lost)
+def record_probe(hostname, timestamp, ping_time, reply_ttl=None, probe_type="icmp"):
+    phase = load_generator.phase(timestamp) if load_generator is not None else 'idle'
+    if phase != 'idle':
+        # Under load (or while queues fill and drain) samples stay out of the idle statistics
+        if phase == 'loaded' and probe_type == "icmp":
+            metric = get_metric(hostname)
+            with metric['Lock']:
+                if metric["Loaded"] is None:
+                    metric["Loaded"] = new_probe_series(load_window, load_probe_interval)
+                series = metric["Loaded"]
+                series["History"].append(timestamp, ping_time)
+                series["Window"].add(timestamp, ping_time)
+                add_to_sketches(series, timestamp, ping_time)
+        return
+    if probe_type == "tcp":
+        record_sample(hostname, f"tcp:{game_port}", timestamp, ping_time)
+    else:
+        record_sample(hostname, '', timestamp, ping_time)
+    metric = get_metric(hostname)
+    with metric['Lock']:
+        if probe_type == "tcp":
+            if metric["Tcp"] is None:
+                metric["Tcp"] = new_probe_series()
+            series = metric["Tcp"]
+        else:
+            series = metric
+        series["History"].append(timestamp, ping_time)
+        series["Window"].add(timestamp, ping_time)
+        add_to_sketches(series, timestamp, ping_time)
+        if ping_time is not None and probe_type == "icmp":
+            update_hops_estimate(hostname, reply_ttl)
+
+# Function to store the result of one probe to an extra address of a proxy (ping_time None means lost)
+def record_address_probe(hostname, address, timestamp, ping_time, probe_type="icmp"):
+    if address not in get_address_cache().get(hostname)[1:]:
+        return  # A late reply from an address the name no longer returns
+    if load_generator is not None and load_generator.phase(timestamp) != 'idle':
+        return
+    metric = get_metric(hostname)
+    with metric['Lock']:
+        by_type = metric['Addresses'].setdefault(address, {})
+        series = by_type.get(probe_type)
+        if series is None:
+            series = by_type[probe_type] = new_probe_series()
+        series["History"].append(timestamp, ping_time)
+        series["Window"].add(timestamp, ping_time)
+        add_to_sketches(series, timestamp, ping_time)
+
+# Function to drop the samples of the extra addresses a proxy no longer resolves to
+def forget_addresses(hostname, extra):
+    metric = get_metric(hostname)
+    with metric['Lock']:
+        for address in [address for address in metric['Addresses'] if address not in extra]:
+            del metric['Addresses'][address]
+
+# Probe scheduling: every proxy is probed on fixed monotonic deadlines, whatever its latency or timeouts,
+# and the cadence adapts to how close the proxy is to the best score
+max_probe_rate = 50.0                   # Global budget in packets per second (proxy probes and traces)
+min_probe_interval = probe_interval / 2 # Contenders near the best score
+losing_probe_interval = probe_interval * 4
+max_probe_interval = 5.0                # Proxies with no replies in the window
+contender_margin = 0.10                 # Within 10% of the best score
+losing_margin = 0.50                    # 50% or more above the best score
+trace_budget_share = 0.75               # Traces never take more than this share of the budget
+
+# Class to fire probes for all proxies from a single thread on fixed deadlines, within a global
+# packets-per-second budget; results are recorded in send order, so a lost probe waiting out its
+# timeout doesn't change how often its proxy is sampled. Probes go to the cached addresses only;
+# every extra address of a name with several A records is probed as its own sub-target
+class ProbeScheduler:
+    def __init__(self, rate=max_probe_rate, timeout=1.0):
+        self.rate = rate
+        self.timeout = timeout
+        self.targets = {}   # (hostname, probe_type[, extra address]) -> {'interval', 'pending'}
+        self.extra_addresses = {}  # hostname -> extra addresses with targets
+        self.heap = []      # (deadline, target key)
+        self.reserved = {}  # owner -> packets per second sent outside the scheduler (traces)
+        self.scale = 1.0    # Every interval is stretched by this factor when over budget
+        self.last_results = None
+        self.lock = TimedLock("scheduler")
+        self.wakeup = threading.Event()
+        # Blocking work only: the system ping command
+        self.executor = ThreadPoolExecutor(max_workers=16)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, *hostnames):
+        # Every proxy gets an ICMP target, plus a TCP handshake target when a game port is set;
+        # they are first due when the name resolves (sync_addresses), so no probe waits a whole interval
+        probe_types = ("icmp", "tcp") if game_port else ("icmp",)
+        with self.lock:
+            for hostname in hostnames:
+                for probe_type in probe_types:
+                    key = (hostname, probe_type)
+                    if key not in self.targets:
+                        self.targets[key] = {'interval': probe_interval, 'pending': deque()}
+            self.rescale()
+        for hostname in hostnames:
+            get_address_cache().add(hostname, listener=self.sync_addresses)
+        self.wakeup.set()
+
+    def sync_addresses(self, hostname, addresses):
+        # Called by the address cache when a name resolves to a different set of addresses
+        extra = set(addresses[1:])
+        with self.lock:
+            # Looked up by key, not by scanning every target, so long target lists register quickly
+            main_keys = [key for key in ((hostname, "icmp"), (hostname, "tcp")) if key in self.targets]
+            if not main_keys:
+                return  # Not a scheduled proxy
+            first = hostname not in self.extra_addresses
+            gone = [main_key + (address,) for main_key in main_keys
+                    for address in self.extra_addresses.get(hostname, set()) - extra]
+            self.extra_addresses[hostname] = extra
+            for key in gone:
+                self.targets.pop(key, None)  # Its heap entry is dropped when it comes due
+            now = time.monotonic()
+            if first:
+                for key in main_keys:
+                    heapq.heappush(self.heap, (now, key))
+            added = [main_key + (address,) for main_key in main_keys for address in extra
+                     if main_key + (address,) not in self.targets]
+            for key in added:
+                self.targets[key] = {'interval': self.targets[key[:2]]['interval'], 'pending': deque()}
+                heapq.heappush(self.heap, (now, key))
+            if gone or added:
+                self.rescale()
+        forget_addresses(hostname, extra)
+        if ping_streams is not None:
+            for key in gone:
+                ping_streams.stop(key)
+        self.wakeup.set()
+
+    def reserve(self, owner, rate):
+        with self.lock:
+            if rate:
+                self.reserved[owner] = rate
             else:
-                cmd = ['ping', '-c', '1', '-W', '1', hostname]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+                self.reserved.pop(owner, None)
+            self.rescale()
 
-            # Extract ping time
-            if sys.platform == 'win32':
-                # Match 'Time=' in English or 'Tempo=' in Portuguese
-                ping_time_match = re.search(r'(?:Tempo|Time)[=<]?\s*([\d\.]+)ms', result.stdout, re.IGNORECASE)
+    def rescale(self):
+        # Caller holds self.lock; stretches all intervals alike so the cadence stays regular
+        demand = sum(1 / target['interval'] for target in self.targets.values())
+        available = max(self.rate - sum(self.reserved.values()), self.rate * (1 - trace_budget_share))
+        self.scale = max(1.0, demand / available)
+
+    def update_intervals(self, results):
+        # Caller holds self.lock; back off on unreachable or clearly losing proxies and probe
+        # contenders more often, once the initial analysis has picked a best proxy
+        scores = [r['Score'] for r in results if r['Score'] is not None]
+        if coordinator_best_score is not None:
+            scores.append(coordinator_best_score)  # A worker of --workers only sees its own shard
+        best = min(scores) if scores and best_proxy_hostname else None
+        intervals = {}
+        for result in results:
+            score = result['Score']
+            if score is None:
+                interval = max_probe_interval
+            elif best is None:
+                interval = probe_interval
+            elif score <= best * (1 + contender_margin):
+                interval = min_probe_interval
+            elif score >= best * (1 + losing_margin):
+                interval = losing_probe_interval
             else:
-                ping_time_match = re.search(r'time=([\d\.]+) ms', result.stdout)
+                interval = probe_interval
+            intervals[result['Proxy']] = interval
+        # Extra addresses follow the cadence of their proxy; pings are more frequent under load
+        loaded = load_generator is not None and load_generator.loaded
+        for key, target in self.targets.items():
+            if key[0] in intervals:
+                target['interval'] = intervals[key[0]]
+                if loaded and key[1] == "icmp" and len(key) == 2:
+                    target['interval'] = min(target['interval'], load_probe_interval)
+        self.rescale()
 
-            timestamp = time.time()
+    def run(self):
+        while not stop_event.is_set():
+            self.wakeup.clear()
+            results = latest_results
+            due = []
+            with self.lock:
+                if results is not self.last_results:
+                    self.last_results = results
+                    self.update_intervals(results)
+                now = time.monotonic()
+                while self.heap and self.heap[0][0] <= now:
+                    deadline, key = heapq.heappop(self.heap)
+                    target = self.targets.get(key)
+                    if target is None:
+                        continue
+                    due.append((key, target))
+                    # The next deadline follows this one, not the reply; slots missed while stalled are skipped
+                    interval = target['interval'] * self.scale
+                    next_deadline = deadline + interval
+                    if next_deadline <= now:
+                        next_deadline = now + interval
+                    heapq.heappush(self.heap, (next_deadline, key))
+                delay = self.heap[0][0] - now if self.heap else 1.0
+            for key, target in due:
+                self.fire(key, target)
+            if not due:
+                self.wakeup.wait(min(delay, 1.0))
 
-            with lock:
-                if ping_time_match:
-                    ping_time = float(ping_time_match.group(1))
-                    metrics[hostname]["PingTimes"].append((timestamp, ping_time))
-                    metrics[hostname]["PingResults"].append((timestamp, True))
-                else:
-                    metrics[hostname]["PingResults"].append((timestamp, False))
+    def fire(self, key, target):
+        probe_type = key[1]
+        address = key[2] if len(key) == 3 else proxy_address(key[0])
+        if address is None:
+            return  # Not resolved yet: no sample rather than a loss
+        if probe_type == "icmp" and ping_backend == "stream":
+            # The ping process sends on its own; this only keeps it running at the current interval
+            # (and restarts it when the proxy's address changes)
+            get_ping_streams().start(key, address, target['interval'] * self.scale,
+                                     functools.partial(self.record_stream, key))
+            return
+        slot = [time.time(), False, None, None]  # timestamp, done, rtt, reply_ttl
+        with self.lock:
+            target['pending'].append(slot)
+        callback = functools.partial(self.complete, key, target, slot)
+        if probe_type == "icmp" and ping_backend in system_ping_backends:
+            self.executor.submit(self.run_blocking, probe_once, (address, self.timeout), callback)
+        else:
+            self.send(address, probe_type, callback)
 
-                # Remove old entries beyond maximum history duration
-                remove_old_entries(metrics[hostname]["PingTimes"], 300)  # 5 minutes for ping times
-                remove_old_entries(metrics[hostname]["PingResults"], 300)  # 5 minutes for results
+    def record_stream(self, key, timestamp, rtt, reply_ttl):
+        # Streamed samples arrive in order from the ping process of this target
+        if key in self.targets:
+            self.record(key, timestamp, rtt, reply_ttl)
+            mark_startup("first_probe")
 
-        except Exception as e:
-            timestamp = time.time()
-            with lock:
-                metrics[hostname]["PingResults"].append((timestamp, False))
-                # Remove old entries
-                remove_old_entries(metrics[hostname]["PingResults"], 300)
-        time.sleep(0.5)  # Adjust the sleep time as needed
-
-def remove_old_entries(deque_obj, max_duration):
-    current_time = time.time()
-    while deque_obj and (current_time - deque_obj[0][0] > max_duration):
-        deque_obj.popleft()
-
-# Class to monitor traceroute continuously like WinMTR
-class TracerouteMonitor:
-    def __init__(self, hostname):
-        self.hostname = hostname
-        self.hops = []  # List of hops, each hop is a dict with 'ip' and 'metrics'
-        self.ping_threads = []
-        self.stop_event = threading.Event()
-        self.lock = threading.Lock()
-        self.run_traceroute()
-        self.start_monitoring()
+    def record(self, key, timestamp, rtt, reply_ttl):
+        if len(key) == 3:
+            record_address_probe(key[0], key[2], timestamp, rtt, key[1])
+        else:
+            record_probe(key[0], timestamp, rtt, reply_ttl, key[1])
+
+    def run_blocking(self, function, args, callback):
+        try:
+            rtt, reply_ttl = function(*args)
+        except Exception:
+            rtt, reply_ttl = None, None
+        callback(rtt, reply_ttl)
+
+    def send(self, address, probe_type, callback):
+        # Both probe types are non-blocking; timeouts are the scheduler's, enforced by the prober
+        try:
+            if probe_type == "tcp":
+                get_prober().connect(address, game_port, lambda rtt: callback(rtt, None), self.timeout)
+            else:
+                get_prober().send_probe(address, None, lambda responder, rtt, reached, reply_ttl: callback(
+                    rtt if reached else None, reply_ttl if reached else None), self.timeout)
+        except Exception:
+            callback(None, None)
+
+    def complete(self, key, target, slot, rtt, reply_ttl):
+        with self.lock:
+            slot[1:] = [True, rtt, reply_ttl]
+            pending = target['pending']
+            while pending and pending[0][1]:
+                timestamp, _, rtt, reply_ttl = pending.popleft()
+                self.record(key, timestamp, rtt, reply_ttl)
+        mark_startup("first_probe")
 
-    def run_traceroute(self):
-        # Run traceroute and parse the output to get the list of hops
+    def close(self, timeout=0.0):
+        self.wakeup.set()
+        self.executor.shutdown(wait=False)
+        if timeout:
+            self.thread.join(timeout)
+
+scheduler = None
+scheduler_lock = threading.Lock()
+
+# Function to get the shared probe scheduler, creating it on first use
+def get_scheduler():
+    global scheduler
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler = supervisor.own("scheduler", ProbeScheduler(max_probe_rate))
+        return scheduler
+
+# Function to trace a path with the system traceroute, returns {ttl: IP} of the hops that answered
+def system_traceroute(hostname):
+    if sys.platform == 'win32':
+        cmd = ['tracert', '-d', '-h', str(max_hops), '-w', '1000', hostname]
+    else:
+        cmd = ['traceroute', '-n', '-m', str(max_hops), '-w', '1', hostname]
+    try:
+        output = run_command(cmd, timeout=30)
+    except Exception as e:
+        return {}
+    hops = {}
+    for line in output.splitlines():
         if sys.platform == 'win32':
-            cmd = ['tracert', '-d', '-h', '30', '-w', '1000', self.hostname]
+            # Windows tracert output parsing
+            # Example line: 1     2 ms     1 ms     1 ms  192.168.0.1
+            match = re.match(r'^\s*(\d+)\s+(?:\d+ ms|\*)\s+(?:\d+ ms|\*)\s+(?:\d+ ms|\*)\s+([\d\.]+)', line)
         else:
-            cmd = ['traceroute', '-n', '-m', '30', '-w', '1', self.hostname]
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            output = result.stdout
-            hops = []
-            for line in output.splitlines():
-                if sys.platform == 'win32':
-                    # Windows tracert output parsing
-                    # Example line: 1     2 ms     1 ms     1 ms  192.168.0.1
-                    match = re.match(r'^\s*(\d+)\s+(?:\d+ ms|\*)\s+(?:\d+ ms|\*)\s+(?:\d+ ms|\*)\s+([\d\.]+)', line)
-                    if match:
-                        ip = match.group(2)
-                        hops.append({'ip': ip, 'metrics': {'PingTimes': deque(), 'PingResults': deque()}})
-                else:
-                    # Unix traceroute output parsing
-                    # Example line: 1  192.168.0.1  1.123 ms  0.987 ms  0.876 ms
-                    match = re.match(r'^\s*(\d+)\s+([\d\.]+)\s+.*', line)
-                    if match:
-                        ip = match.group(2)
-                        hops.append({'ip': ip, 'metrics': {'PingTimes': deque(), 'PingResults': deque()}})
-            self.hops = hops
-        except Exception as e:
-            print(f"Error running traceroute: {e}")
-
-    def start_monitoring(self):
-        for hop in self.hops:
-            t = threading.Thread(target=self.continuous_ping, args=(hop,), daemon=True)
-            t.start()
-            self.ping_threads.append(t)
-
-    def continuous_ping(self, hop):
-        ip = hop['ip']
-        while not self.stop_event.is_set():
-            try:
-                if sys.platform == 'win32':
-                    cmd = ['ping', '-n', '1', '-w', '1000', ip]
-                else:
-                    cmd = ['ping', '-c', '1', '-W', '1', ip]
-                result = subprocess.run(cmd, capture_output=True, text=True)
+            # Unix traceroute output parsing
+            # Example line: 1  192.168.0.1  1.123 ms  0.987 ms  0.876 ms
+            match = re.match(r'^\s*(\d+)\s+([\d\.]+)\s+.*', line)
+        if match:
+            hops[int(match.group(1))] = match.group(2)  # The TTL of the line, so silent hops keep their place
+    return hops
 
-                # Extract ping time
-                if sys.platform == 'win32':
-                    ping_time_match = re.search(r'(?:Tempo|Time)[=<]?\s*([\d\.]+)ms', result.stdout, re.IGNORECASE)
+path_refresh = 300          # Seconds before a proxy's path is traced again
+path_retrace = 30           # Minimum seconds before a path whose route changed is traced again (ECMP)
+path_discoveries = 2        # Paths traced per round at most, so startup doesn't burst max_hops probes per proxy
+
+# Class to monitor the paths of all proxies at once, like WinMTR for every proxy: hops are
+# deduplicated by IP in a shared registry, so a router common to several paths (LAN, ISP, IX)
+# is probed once per round and its statistics are shared by every path that contains it
+class PathMonitor:
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.paths = {}  # hostname -> {'hops': [hop key per TTL], 'traced': time, 'stale': bool}
+        self.hops = {}   # hop key (router IP, or (hostname, ttl) for a silent hop) -> hop state
+        self.tracing = set()
+        self.streamed = set()  # Hop keys with a streaming ping (--ping-backend stream)
+        self.stop_event = threading.Event()
+        self.lock = TimedLock("paths")
+        # Path traces block (DNS, waiting for every TTL, or the system traceroute)
+        self.executor = ThreadPoolExecutor(max_workers=path_discoveries)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def legacy(self):
+        # Without TTL-capable sockets, paths come from the system traceroute and hops are pinged directly
+        return ping_backend in system_ping_backends or not get_prober().supports_ttl
+
+    def new_hop(self, ip):
+        window = RollingWindow(time_window, ring_capacity(time_window, self.interval))
+        return {'ip': ip, 'metrics': {'Window': window, **new_sketches()}, 'Last': None, 'Best': None, 'Worst': None,
+                'paths': set(), 'route': None}
+
+    def add_sample(self, hop, timestamp, rtt):
+        for hostname in hop['paths']:
+            record_sample(hostname, hop['ip'] or '*', timestamp, rtt)
+        hop['metrics']['Window'].add(timestamp, rtt)
+        add_to_sketches(hop['metrics'], timestamp, rtt)
+        if rtt is not None:
+            hop['Last'] = rtt
+            hop['Best'] = rtt if hop['Best'] is None else min(hop['Best'], rtt)
+            hop['Worst'] = rtt if hop['Worst'] is None else max(hop['Worst'], rtt)
+
+    def run(self):
+        next_round = time.monotonic()
+        while not self.stop_event.is_set() and not stop_event.is_set():
+            self.refresh_paths()
+            with self.lock:
+                # One probe per distinct hop: through the path it was first seen on, or directly
+                probes = [(key, hop['route'], hop['ip']) for key, hop in self.hops.items()
+                      if hop['route'] is not None or self.legacy]
+            period = self.reserve_budget(len(probes))
+            if self.legacy and ping_backend == "stream":
+                self.sync_streams(probes, period)
+                probes = []
+            timestamp = time.time()
+            for key, route, ip in probes:
+                callback = functools.partial(self.record, key, timestamp)
+                if self.legacy:
+                    self.executor.submit(self.ping_hop, ip, callback)
                 else:
-                    ping_time_match = re.search(r'time=([\d\.]+) ms', result.stdout)
+                    get_prober().send_probe(route[0], route[1], callback, timeout=self.interval)
+            next_round += period
+            self.stop_event.wait(max(0, next_round - time.monotonic()))
+        get_scheduler().reserve(self, 0)
 
-                timestamp = time.time()
+    def reserve_budget(self, probes):
+        # Share of the global packet budget used by each round; rounds are spaced out when over it
+        budget = get_scheduler().rate * trace_budget_share
+        period = max(self.interval, probes / budget)
+        get_scheduler().reserve(self, probes / period)
+        return period
 
-                with self.lock:
-                    if ping_time_match:
-                        ping_time = float(ping_time_match.group(1))
-                        hop['metrics']['PingTimes'].append((timestamp, ping_time))
-                        hop['metrics']['PingResults'].append((timestamp, True))
-                    else:
-                        hop['metrics']['PingResults'].append((timestamp, False))
+    def refresh_paths(self):
+        # Traces new, stale and old paths a few at a time, and forgets proxies no longer monitored
+        now = time.time()
+        hostnames = {proxy['hostname'] for proxy in proxies}
+        with self.lock:
+            for hostname in [h for h in self.paths if h not in hostnames]:
+                self.set_path(hostname, None, [])
+            due = [h for h in hostnames if h not in self.tracing and (
+                h not in self.paths or now - self.paths[h]['traced'] >= path_refresh
+                or (self.paths[h]['stale'] and now - self.paths[h]['traced'] >= path_retrace))]
+            due = sorted(due, key=lambda h: self.paths[h]['traced'] if h in self.paths else 0)
+            due = due[:max(0, path_discoveries - len(self.tracing))]
+            self.tracing.update(due)
+        for hostname in due:
+            self.executor.submit(self.trace, hostname)
+
+    def trace(self, hostname):
+        try:
+            address = proxy_address(hostname)
+            if address is None:
+                return  # Traced once the name resolves
+            if self.legacy:
+                destination = None
+                replies = system_traceroute(address)
+                responders = {ttl: replies.get(ttl) for ttl in range(1, max(replies, default=0) + 1)}
+            else:
+                destination = address
+                replies = trace_path(destination, self.interval)
+                reached = [ttl for ttl, (_, reached_destination) in replies.items() if reached_destination]
+                # Silent TTLs past the last answer are a destination that ignores echo, not hops
+                limit = min(reached) if reached else max(replies, default=0)
+                responders = {ttl: replies[ttl][0] for ttl in replies if ttl <= limit}
+                responders.update((ttl, None) for ttl in range(1, limit + 1) if ttl not in responders)
+            with self.lock:
+                self.set_path(hostname, destination, [responders[ttl] for ttl in sorted(responders)])
+                if not responders:
+                    # Nothing answered: try again after path_retrace rather than every round
+                    self.paths[hostname] = {'destination': destination, 'hops': [], 'traced': time.time(), 'stale': True}
+        except Exception:
+            pass  # Traced again on the next refresh
+        finally:
+            with self.lock:
+                self.tracing.discard(hostname)
 
-                    # Remove old entries
-                    remove_old_entries(hop['metrics']['PingTimes'], 30)  # 30 seconds for traceroute hops
-                    remove_old_entries(hop['metrics']['PingResults'], 30)
+    def set_path(self, hostname, destination, responders):
+        # Caller holds self.lock; hops no longer on any path are dropped from the registry
+        old = self.paths.pop(hostname, None)
+        old_keys = old['hops'] if old else []
+        keys = [ip or (hostname, ttl) for ttl, ip in enumerate(responders, 1)]
+        for key in old_keys:
+            if key in keys:
+                continue  # Still on the path: the hop keeps its statistics
+            hop = self.hops[key]
+            hop['paths'].discard(hostname)
+            if not hop['paths']:
+                del self.hops[key]
+        for ttl, (ip, key) in enumerate(zip(responders, keys), 1):
+            hop = self.hops.get(key)
+            if hop is None:
+                hop = self.hops[key] = self.new_hop(ip)
+            hop['paths'].add(hostname)
+            if destination is not None and (hop['route'] is None or hop['route'][2] == hostname):
+                hop['route'] = (destination, ttl, hostname)
+        if responders:
+            self.paths[hostname] = {'destination': destination, 'hops': keys, 'traced': time.time(), 'stale': False}
+        # Shared hops that were probed through the old path now go through another path that contains them
+        for key in old_keys:
+            hop = self.hops.get(key)
+            if hop is not None and hop['route'] is not None and hop['route'][2] == hostname and key not in keys:
+                other = next(iter(hop['paths']))
+                path = self.paths[other]
+                hop['route'] = (path['destination'], path['hops'].index(key) + 1, other) if path['destination'] else None
+
+    def sync_streams(self, probes, period):
+        # One long-lived ping per hop router, started and stopped as hops come and go
+        streams = get_ping_streams()
+        keys = set()
+        for key, _, ip in probes:
+            if ip:
+                keys.add(key)
+                streams.start(("hop", key), ip, period, functools.partial(self.record_stream, key, ip))
+        for key in self.streamed - keys:
+            streams.stop(("hop", key))
+        self.streamed = keys
+
+    def record_stream(self, key, ip, timestamp, rtt, reply_ttl):
+        self.record(key, timestamp, ip if rtt is not None else None, rtt, rtt is not None)
+
+    def ping_hop(self, ip, callback):
+        try:
+            rtt = ping_once(ip) if ip else None
+        except Exception:
+            rtt = None
+        callback(ip if rtt is not None else None, rtt, rtt is not None)
 
-            except Exception as e:
-                timestamp = time.time()
-                with self.lock:
-                    hop['metrics']['PingResults'].append((timestamp, False))
-                    remove_old_entries(hop['metrics']['PingResults'], 30)
-            time.sleep(1)  # Adjust the sleep time as needed
+    def record(self, key, timestamp, responder, rtt, reached, reply_ttl=None):
+        with self.lock:
+            hop = self.hops.get(key)
+            if hop is None:
+                return
+            if responder is not None and responder != hop['ip']:
+                # Another router answered at this distance: the route changed, trace its paths again
+                for hostname in hop['paths']:
+                    if hostname in self.paths:
+                        self.paths[hostname]['stale'] = True
+                return
+            self.add_sample(hop, timestamp, rtt)
 
-    def stop(self):
+    def close(self, timeout=0.0):
         self.stop_event.set()
-        for t in self.ping_threads:
-            t.join()
+        self.executor.shutdown(wait=False)
+        if ping_streams is not None:
+            for key in self.streamed:
+                ping_streams.stop(("hop", key))
+        if timeout:
+            self.thread.join(timeout)
 
-    def get_statistics(self):
-        # Returns the current statistics for each hop
+    def get_statistics(self, hostname):
+        # Returns the current statistics for each hop of a proxy's path, like the WinMTR table
         current_time = time.time()
-        time_window = 30  # seconds
         stats = []
         with self.lock:
-            for idx, hop in enumerate(self.hops):
-                ip = hop['ip']
-                ping_times = [(t, pt) for t, pt in hop['metrics']['PingTimes'] if current_time - t <= time_window]
-                ping_results = [(t, success) for t, success in hop['metrics']['PingResults'] if current_time - t <= time_window]
-
-                total_pings = len(ping_results)
-                if total_pings == 0:
+            path = self.paths.get(hostname)
+            for idx, key in enumerate(path['hops'] if path else []):
+                hop = self.hops.get(key)
+                if hop is None:
+                    continue
+                window = hop['metrics']['Window']
+                window.expire(current_time)
+                if window.total == 0:
                     continue  # Skip hops with no data yet
 
-                lost_pings = sum(1 for t, success in ping_results if not success)
-                successful_pings = total_pings - lost_pings
-
-                packet_loss = (lost_pings / total_pings) * 100
-
-                ping_values = [pt for t, pt in ping_times]
-                if successful_pings == 0:
-                    avg_ping = None
-                else:
-                    avg_ping = statistics.mean(ping_values)
-
                 hop_stats = {
                     'Hop': idx + 1,
-                    'IP': ip,
-                    'AvgPing': avg_ping,
-                    'PacketLoss': packet_loss,
+                    'IP': hop['ip'] or '*',
+                    'AvgPing': window.mean,
+                    'PacketLoss': window.packet_loss,
+                    'Last': hop['Last'],
+                    'Best': hop['Best'],
+                    'Worst': hop['Worst'],
+                    **sketch_percentiles(hop['metrics'], current_time),
+                    'Paths': len(hop['paths']),
                 }
                 stats.append(hop_stats)
         return stats
 
-# Function to manage traceroute execution
+path_monitor = None
+
+# Function to format hop statistics as the tab-separated traceroute text
+def format_traceroute(stats):
+    output_lines = []
+    for hop_stats in stats:
+        hop = hop_stats['Hop']
+        ip = hop_stats['IP']
+        packet_loss = f"{hop_stats['PacketLoss']:.2f}%" if hop_stats['PacketLoss'] is not None else '*'
+        last, avg_ping, p95, best, worst = (f"{hop_stats[key]:.2f} ms" if hop_stats[key] is not None else '*'
+                                            for key in ('Last', 'AvgPing', 'P95', 'Best', 'Worst'))
+        output_lines.append(f"{hop}\t{ip}\tPacketLoss: {packet_loss}\tLast: {last}\tAvgPing: {avg_ping}"
+                            f"\tP95: {p95}\tBest: {best}\tWorst: {worst}\tPaths: {hop_stats['Paths']}")
+    return '\n'.join(output_lines)
+
+# Function to manage traceroute execution: every proxy's path is monitored, the best one is shown
 def traceroute_manager():
-    global traceroute_output
-    last_best_proxy_hostname = None
-    traceroute_monitor = None
+    global traceroute_snapshot, path_monitor
+    path_monitor = supervisor.own("paths", PathMonitor())
     while not stop_event.is_set():
-        if best_proxy_hostname != last_best_proxy_hostname:
-            if traceroute_monitor:
-                traceroute_monitor.stop()
-            if best_proxy_hostname:
-                traceroute_monitor = TracerouteMonitor(best_proxy_hostname)
-            last_best_proxy_hostname = best_proxy_hostname
-        else:
-            if traceroute_monitor:
-                stats = traceroute_monitor.get_statistics()
-                # Format the stats into traceroute_output
-                output_lines = []
-                for hop_stats in stats:
-                    hop = hop_stats['Hop']
-                    ip = hop_stats['IP']
-                    avg_ping = f"{hop_stats['AvgPing']:.2f} ms" if hop_stats['AvgPing'] is not None else '*'
-                    packet_loss = f"{hop_stats['PacketLoss']:.2f}%" if hop_stats['PacketLoss'] is not None else '*'
-                    output_lines.append(f"{hop}\t{ip}\tAvgPing: {avg_ping}\tPacketLoss: {packet_loss}")
-                with traceroute_lock:
-                    traceroute_output = '\n'.join(output_lines)
-        time.sleep(1)
-
-# Function to run tests continuously
-def run_tests_continuously():
-    global latest_results
-    global traceroute_output
-    global best_proxy_hostname
-    latest_results = []
-    traceroute_output = ""
+        all_stats = {proxy['hostname']: path_monitor.get_statistics(proxy['hostname']) for proxy in proxies}
+        stats = all_stats.get(best_proxy_hostname, []) if best_proxy_hostname else []
+        traceroute_snapshot = {"output": format_traceroute(stats), "stats": stats, "paths": all_stats}
+        stop_event.wait(1)
+
+# Function to start probing: cached proxies, discovery, hop traces and the traceroute manager
+def start_monitoring():
+    global latest_results, traceroute_snapshot, best_proxy_hostname
+    latest_results = ()
+    traceroute_snapshot = {"output": "", "stats": [], "paths": {}}
     best_proxy_hostname = None
-    layout = create_layout()
-    connection_type, wifi_detected = get_connection_type()
 
-    start_time = time.time()
+    if configured_targets is not None:
+        # The list of --targets replaces discovery and its cache
+        register_proxies([(hostname, None) for hostname in configured_targets])
+    else:
+        # Start probing cached proxies right away, then rediscover in the background
+        register_proxies([(entry['hostname'], entry.get('addresses')) for entry in load_proxy_cache()])
+        supervisor.start("discovery", refresh_proxies)
 
-    # Start continuous ping threads for each proxy
-    threads = []
+    # Start the hop trace thread, used only when TTL inference is not enough
+    supervisor.start("hop-traces", hop_trace_worker)
+
+    # Start traceroute manager thread
+    supervisor.start("traceroute", traceroute_manager)
+
+# Weights of the composite score: ms of ping and jitter, per hop, per percent of loss, per ms
+# of jitter variation, ms of the 30 s p99 and ms added under load (--score-weights, also used by --replay variants)
+score_weights = {"ping": 1.0, "jitter": 1.0, "hops": 5.0, "loss": 500.0, "jitter_variation": 10.0, "p99": 0.0,
+                 "bufferbloat": 0.0}
+
+# Function to compute the composite score from the statistics of one probe type
+def compute_score(avg_ping, jitter, hops, packet_loss, jitter_variation, weights=None, p99=None):
+    weights = weights or score_weights
+    hops_value = hops if hops is not None else 30  # Assume max hops if unknown
+    return (avg_ping * weights["ping"] + jitter * weights["jitter"] + hops_value * weights["hops"]
+            + packet_loss * weights["loss"] + jitter_variation * weights["jitter_variation"]
+            + (p99 if p99 is not None else avg_ping) * weights["p99"])
+
+# Function to compute the windowed statistics and score of one probe type (caller holds the proxy lock)
+def series_results(series, hops, current_time, weights=None):
+    window = series["Window"]
+    window.expire(current_time)
+    if window.total == 0:
+        return None  # No data yet
+
+    packet_loss = window.packet_loss
+
+    percentiles = sketch_percentiles(series, current_time)
+    if window.count == 0:
+        return {"AvgPing": None, "MinPing": None, "MaxPing": None, "PacketLoss": packet_loss,
+                "Jitter": None, "JitterVariation": None, **percentiles, "Score": None}
+
+    avg_ping = window.mean
+    jitter = window.stdev
+
+    # Calculate jitter variation over extended period, sampling jitter once per second
+    # whatever the refresh rate
+    jitter_window = series['JitterWindow']
+    last_jitter_time = jitter_window.last_timestamp
+    if last_jitter_time is None or current_time - last_jitter_time >= 1:
+        jitter_window.add(current_time, jitter)
+    jitter_window.expire(current_time)
+    jitter_variation = jitter_window.stdev
+
+    # Compute the score, including jitter variation
+    score = compute_score(avg_ping, jitter, hops, packet_loss, jitter_variation, weights, percentiles["P99"])
+
+    return {
+        "AvgPing": avg_ping,
+        "MinPing": window.min,
+        "MaxPing": window.max,
+        "PacketLoss": packet_loss,
+        "Jitter": jitter,
+        "JitterVariation": jitter_variation,
+        **percentiles,
+        "Score": score
+    }
+
+# Function to combine the scores of the probe types by their weights; a weighted type without
+# replies makes the proxy unusable, like a proxy that stopped answering ping
+def combined_score(series_by_type):
+    weighted = [(probe_weights.get(probe_type, 0), series) for probe_type, series in series_by_type.items()
+                if series is not None and probe_weights.get(probe_type, 0) > 0]
+    if not weighted or any(series["Score"] is None for _, series in weighted):
+        return None
+    return sum(weight * series["Score"] for weight, series in weighted) / sum(weight for weight, _ in weighted)
+
+# Function to score a result from its windowed statistics, as series_results and combined_score do;
+# used by the coordinator of --workers, whose workers send statistics without scores
+def score_result(result, weights=None):
+    series = {}
+    for probe_type, prefix in (("icmp", ""), ("tcp", "Tcp")):
+        if result.get(prefix + "PacketLoss") is None:
+            continue  # No data of this type
+        avg_ping = result[prefix + "AvgPing"]
+        series[probe_type] = {"Score": None if avg_ping is None else compute_score(
+            avg_ping, result[prefix + "Jitter"], result["Hops"], result[prefix + "PacketLoss"],
+            result[prefix + "JitterVariation"], weights, result[prefix + "P99"])}
+    return combined_score(series)
+
+# Function to summarize one address of a proxy that resolves to several
+def address_result(address, icmp, tcp):
+    return {"Address": address, "AvgPing": (icmp or {}).get("AvgPing"), "PacketLoss": (icmp or {}).get("PacketLoss"),
+            "P99": (icmp or {}).get("P99"), "TcpAvgPing": (tcp or {}).get("AvgPing"),
+            "Score": combined_score({"icmp": icmp, "tcp": tcp})}
+
+# Windowed statistics of each probe type in the results (TCP ones prefixed with "Tcp")
+result_fields = ("AvgPing", "MinPing", "MaxPing", "PacketLoss", "Jitter", "JitterVariation",
+                 "P50", "P95", "P99", "P99Long", "P99Session")
+
+# Function to compute the windowed results and score of every proxy
+def compute_results(current_time):
+    global latest_results
+    if shard_pool is not None:
+        results = shard_pool.results()
+        latest_results = tuple(results)
+        return results
+    results = []
+    empty = dict.fromkeys(result_fields)
     for proxy in proxies:
-        t = threading.Thread(target=continuous_ping, args=(proxy,), daemon=True)
-        t.start()
-        threads.append(t)
+        hostname = proxy['hostname']
+        metric = get_metric(hostname)
+        # Only this proxy's lock: reading also expires the windows and samples the jitter window,
+        # which the probe writer mutates too, so a probe of this proxy can wait for these O(1) reads
+        with metric['Lock']:
+            hops = metric.get('Hops', None)
+            icmp = series_results(metric, hops, current_time)
+            tcp = series_results(metric['Tcp'], hops, current_time) if metric['Tcp'] is not None else None
+            loaded = series_results(metric['Loaded'], hops, current_time) if metric['Loaded'] is not None else None
+            extra = [(address, {probe_type: series_results(series, hops, current_time)
+                                for probe_type, series in by_type.items()})
+                     for address, by_type in sorted(metric['Addresses'].items())]
 
-    # Start hops update threads for each proxy
-    start_hops_update_threads()
+        if icmp is None and tcp is None:
+            continue  # Skip proxies with no data yet
 
-    # Start traceroute manager thread
-    traceroute_thread = threading.Thread(target=traceroute_manager, daemon=True)
-    traceroute_thread.start()
+        result_data = {"Proxy": hostname}
+        result_data.update((key, (icmp or empty)[key]) for key in empty)
+        result_data.update(("Tcp" + key, (tcp or empty)[key]) for key in empty)
+        result_data.update({
+            "DisplayName": proxy['display_name'],
+            "Description": proxy['description'],
+            "Hops": hops,
+            "Score": combined_score({"icmp": icmp, "tcp": tcp})
+        })
+        if load_generator is not None:
+            loaded_ping = (loaded or {}).get("AvgPing")
+            added = loaded_ping - icmp["AvgPing"] if loaded_ping is not None and (icmp or {}).get("AvgPing") is not None else None
+            result_data.update({"LoadedPing": loaded_ping, "LoadedP99": (loaded or {}).get("P99"), "AddedLatency": added})
+            if result_data["Score"] is not None and added is not None:
+                result_data["Score"] += score_weights["bufferbloat"] * max(0.0, added)
+        if extra:
+            # The proxy's own statistics are those of its first address
+            result_data["Addresses"] = [address_result(proxy_address(hostname), icmp, tcp)] + [
+                address_result(address, by_type.get("icmp"), by_type.get("tcp")) for address, by_type in extra]
+        results.append(result_data)
+
+    latest_results = tuple(results)
+    return results
+
+# Function to choose the best proxy with hysteresis; returns the (hostname, since) pair to keep
+def choose_best_proxy(results, current_hostname, current_since, elapsed_time, margin=None, dwell=None):
+    margin = switch_margin if margin is None else margin
+    dwell = switch_dwell if dwell is None else dwell
+    if elapsed_time < 30:
+        return None, current_since
+    valid_results = [r for r in results if r.get('Score') is not None]
+    if valid_results:
+        new_best_proxy = min(valid_results, key=lambda x: x['Score'])
+        new_best_proxy_hostname = new_best_proxy['Proxy']
+    else:
+        new_best_proxy = None
+        new_best_proxy_hostname = None
+
+    if new_best_proxy_hostname != current_hostname:
+        current = next((r for r in valid_results if r['Proxy'] == current_hostname), None)
+        # Near-equal scores would otherwise make the choice (and its traceroute) flap
+        if (current is not None and new_best_proxy is not None
+                and (new_best_proxy['Score'] > current['Score'] * (1 - margin)
+                     or elapsed_time - current_since < dwell)):
+            return current_hostname, current_since
+        return new_best_proxy_hostname, elapsed_time
+    return current_hostname, current_since
+
+# Function to pick the proxy with the lowest score once the initial analysis is over
+def update_best_proxy(results, elapsed_time):
+    global best_proxy_hostname, best_proxy_since
+    best_proxy_hostname, best_proxy_since = choose_best_proxy(results, best_proxy_hostname, best_proxy_since,
+                                                              elapsed_time)
+
+# Function to run tests continuously, redrawing the UI refresh_rate times per second
+def run_tests_continuously(refresh_rate=1.0):
+    layout = create_layout()
+    connection_type, wifi_detected = get_connection_type()
+
+    start_time = time.time()
+    start_monitoring()
 
-    with Live(layout, refresh_per_second=1, screen=True) as live:
+    from rich.live import Live
+    mark_startup("ui_loaded")
+
+    with Live(layout, refresh_per_second=refresh_rate, screen=True) as live:
         while not stop_event.is_set():
-            results = []
             current_time = time.time()
             elapsed_time = current_time - start_time
-            time_window = 30  # seconds
-            jitter_variation_window = 300  # 5 minutes
-            with lock:
-                for proxy in proxies:
-                    hostname = proxy['hostname']
-                    display_name = proxy['display_name']
-                    description = proxy['description']
-                    metric = metrics[hostname]
-                    ping_times = [(t, pt) for t, pt in metric["PingTimes"] if current_time - t <= time_window]
-                    ping_results = [(t, success) for t, success in metric["PingResults"] if current_time - t <= time_window]
-                    hops = metric.get('Hops', None)
-
-                    total_pings = len(ping_results)
-                    if total_pings == 0:
-                        continue  # Skip proxies with no data yet
-
-                    lost_pings = sum(1 for t, success in ping_results if not success)
-                    successful_pings = total_pings - lost_pings
-
-                    packet_loss = (lost_pings / total_pings) * 100
-
-                    ping_values = [pt for t, pt in ping_times]
-                    if successful_pings == 0:
-                        avg_ping = None
-                        min_ping = None
-                        max_ping = None
-                        jitter = None
-                        jitter_variation = None
-                        score = None
-                    else:
-                        avg_ping = statistics.mean(ping_values)
-                        min_ping = min(ping_values)
-                        max_ping = max(ping_values)
-                        jitter = statistics.stdev(ping_values) if len(ping_values) > 1 else 0
-
-                        # Calculate jitter variation over extended period
-                        jitter_values = metric['JitterValues']
-                        # Update jitter_values with current jitter
-                        jitter_values.append((current_time, jitter))
-                        # Remove old entries
-                        remove_old_entries(jitter_values, jitter_variation_window)
-                        jitter_values_list = [j for t, j in jitter_values]
-                        if len(jitter_values_list) > 1:
-                            jitter_variation = statistics.stdev(jitter_values_list)
-                        else:
-                            jitter_variation = 0
-
-                        hops_value = hops if hops is not None else 30  # Assume max hops if unknown
-                        packet_loss_value = packet_loss
-
-                        # Compute the score, including jitter variation
-                        score = avg_ping + jitter + (hops_value * 5) + (packet_loss_value * 500) + (jitter_variation * 10)
-
-                    result_data = {
-                        "Proxy": hostname,
-                        "AvgPing": avg_ping,
-                        "MinPing": min_ping,
-                        "MaxPing": max_ping,
-                        "PacketLoss": packet_loss,
-                        "Jitter": jitter,
-                        "JitterVariation": jitter_variation,
-                        "DisplayName": display_name,
-                        "Description": description,
-                        "Hops": hops,
-                        "Score": score
-                    }
-                    results.append(result_data)
-
-                latest_results = results.copy()
-
-            if elapsed_time >= 30:
-                valid_results = [r for r in results if r.get('Score') is not None]
-                if valid_results:
-                    new_best_proxy = min(valid_results, key=lambda x: x['Score'])
-                    new_best_proxy_hostname = new_best_proxy['Proxy']
+            results = compute_results(current_time)
+            update_best_proxy(results, elapsed_time)
+
+            update_layout(layout, results, best_proxy_hostname, connection_type, wifi_detected, elapsed_time)
+            live.refresh()
+            mark_startup("first_frame")
+
+            # Keys are checked while waiting for the next frame, so 'q' is seen within input_poll_interval
+            next_frame = time.monotonic() + 1 / refresh_rate
+            while not stop_event.is_set():
+                check_user_input()
+                remaining = next_frame - time.monotonic()
+                if remaining <= 0:
+                    break
+                stop_event.wait(min(remaining, input_poll_interval))
+
+    get_console().print("[bold red]Programa terminado pelo usuário.[/bold red]")
+
+# Headless mode (--headless): results served over a local HTTP endpoint instead of the UI
+metrics_address = ('127.0.0.1', 9464)
+metrics_snapshot = {"json": b"{}", "prometheus": b""}  # Replaced once per tick, never mutated
+
+# Result fields exported as Prometheus gauges
+prometheus_fields = [
+    ("AvgPing", "proxytest_ping_avg_ms", "Ping médio na janela de 30 s"),
+    ("MinPing", "proxytest_ping_min_ms", "Ping mínimo na janela de 30 s"),
+    ("MaxPing", "proxytest_ping_max_ms", "Ping máximo na janela de 30 s"),
+    ("PacketLoss", "proxytest_packet_loss_percent", "Perda de pacotes na janela de 30 s"),
+    ("Jitter", "proxytest_jitter_ms", "Jitter na janela de 30 s"),
+    ("JitterVariation", "proxytest_jitter_variation_ms", "Variação do jitter em 5 minutos"),
+    ("P50", "proxytest_ping_p50_ms", "Mediana do ping na janela de 30 s"),
+    ("P95", "proxytest_ping_p95_ms", "Percentil 95 do ping na janela de 30 s"),
+    ("P99", "proxytest_ping_p99_ms", "Percentil 99 do ping na janela de 30 s"),
+    ("P99Long", "proxytest_ping_p99_5m_ms", "Percentil 99 do ping em 5 minutos"),
+    ("P99Session", "proxytest_ping_p99_session_ms", "Percentil 99 do ping desde o início"),
+    ("TcpAvgPing", "proxytest_tcp_connect_avg_ms", "Tempo médio de conexão TCP à porta do jogo na janela de 30 s"),
+    ("TcpPacketLoss", "proxytest_tcp_connect_loss_percent", "Conexões TCP sem resposta na janela de 30 s"),
+    ("TcpJitter", "proxytest_tcp_connect_jitter_ms", "Jitter das conexões TCP na janela de 30 s"),
+    ("LoadedPing", "proxytest_loaded_ping_avg_ms", "Ping médio sob carga (--load-sink) no último minuto"),
+    ("LoadedP99", "proxytest_loaded_ping_p99_ms", "Percentil 99 do ping sob carga no último minuto"),
+    ("AddedLatency", "proxytest_added_latency_ms", "Latência acrescentada pela carga (sob carga menos ocioso)"),
+    ("Hops", "proxytest_hops", "Número de saltos até o proxy"),
+    ("Score", "proxytest_score", "Score composto (menor é melhor)"),
+]
+prometheus_address_fields = [
+    ("AvgPing", "proxytest_address_ping_avg_ms", "Ping médio de cada endereço do proxy na janela de 30 s"),
+    ("PacketLoss", "proxytest_address_packet_loss_percent", "Perda de pacotes de cada endereço do proxy na janela de 30 s"),
+    ("P99", "proxytest_address_ping_p99_ms", "Percentil 99 do ping de cada endereço do proxy na janela de 30 s"),
+    ("Score", "proxytest_address_score", "Score de cada endereço do proxy (menor é melhor)"),
+]
+prometheus_hop_fields = [
+    ("AvgPing", "proxytest_hop_ping_avg_ms", "Ping médio do salto na janela de 30 s"),
+    ("PacketLoss", "proxytest_hop_packet_loss_percent", "Perda de pacotes do salto na janela de 30 s"),
+    ("P95", "proxytest_hop_ping_p95_ms", "Percentil 95 do ping do salto na janela de 30 s"),
+    ("P99", "proxytest_hop_ping_p99_ms", "Percentil 99 do ping do salto na janela de 30 s"),
+    ("Last", "proxytest_hop_ping_last_ms", "Último ping do salto"),
+    ("Best", "proxytest_hop_ping_best_ms", "Melhor ping do salto"),
+    ("Worst", "proxytest_hop_ping_worst_ms", "Pior ping do salto"),
+    ("Paths", "proxytest_hop_paths", "Número de proxies cujo caminho passa pelo salto"),
+]
+
+# Function to escape a Prometheus label value
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Function to format results and the hop stats of every path in the Prometheus text format
+def format_prometheus(results, best_hostname, hop_stats, all_path_stats=None):
+    lines = []
+    for key, name, help_text in prometheus_fields:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for result in results:
+            if result.get(key) is not None:
+                labels = f'proxy="{prometheus_label(result["Proxy"])}",name="{prometheus_label(result["DisplayName"])}"'
+                lines.append(f"{name}{{{labels}}} {result[key]}")
+    lines.append("# HELP proxytest_best_proxy 1 para o melhor proxy atual")
+    lines.append("# TYPE proxytest_best_proxy gauge")
+    for result in results:
+        lines.append(f'proxytest_best_proxy{{proxy="{prometheus_label(result["Proxy"])}"}} '
+                     f'{1 if result["Proxy"] == best_hostname else 0}')
+    # Only proxies whose name resolves to several addresses
+    for key, name, help_text in prometheus_address_fields:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for result in results:
+            for address in result.get("Addresses", ()):
+                if address.get(key) is not None:
+                    labels = f'proxy="{prometheus_label(result["Proxy"])}",address="{prometheus_label(address["Address"])}"'
+                    lines.append(f"{name}{{{labels}}} {address[key]}")
+    if all_path_stats is None:
+        all_path_stats = {best_hostname: hop_stats} if best_hostname else {}
+    for key, name, help_text in prometheus_hop_fields:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for hostname, stats in all_path_stats.items():
+            for hop in stats:
+                if hop.get(key) is not None:
+                    labels = (f'proxy="{prometheus_label(hostname)}",hop="{hop["Hop"]}",'
+                              f'ip="{prometheus_label(hop["IP"])}"')
+                    lines.append(f"{name}{{{labels}}} {hop[key]}")
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+# Function to format the lock wait statistics in the Prometheus text format
+def format_lock_prometheus(statistics):
+    lines = []
+    for key, name, kind, help_text in (
+            ("Acquisitions", "proxytest_lock_acquisitions_total", "counter", "Aquisições do lock"),
+            ("Contended", "proxytest_lock_contended_total", "counter", "Aquisições que tiveram de esperar"),
+            ("WaitTotal", "proxytest_lock_wait_seconds_total", "counter", "Tempo total de espera pelo lock"),
+            ("WaitMax", "proxytest_lock_wait_max_seconds", "gauge", "Maior espera pelo lock")):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for lock_name, entry in statistics.items():
+            lines.append(f'{name}{{lock="{prometheus_label(lock_name)}"}} {entry[key]}')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+# Function to precompute the exported snapshot, so every scrape just returns bytes
+def publish_snapshot(results, best_hostname, hop_stats, all_path_stats=None):
+    global metrics_snapshot
+    lock_statistics = lock_wait_statistics()
+    document = {
+        "timestamp": time.time(),
+        "best_proxy": best_hostname,
+        "proxies": results,
+        "hops": hop_stats,
+        "paths": all_path_stats or {},
+        "recommendation": fleet_recommendation,
+        "locks": lock_statistics,
+        "threads": threading.active_count(),
+    }
+    metrics_snapshot = {
+        "json": json.dumps(document, ensure_ascii=False).encode('utf-8'),
+        "prometheus": format_prometheus(results, best_hostname, hop_stats, all_path_stats)
+                      + format_lock_prometheus(lock_statistics)
+                      + (f"# HELP proxytest_threads Threads em execução\n# TYPE proxytest_threads gauge\n"
+                         f"proxytest_threads {document['threads']}\n").encode('utf-8'),
+    }
+
+# Function to start the local HTTP endpoint: /metrics (Prometheus) and /results (JSON)
+def start_metrics_server(address=metrics_address):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            snapshot = metrics_snapshot
+            path = self.path.split('?', 1)[0]
+            if path == '/metrics':
+                body, content_type = snapshot["prometheus"], 'text/plain; version=0.0.4; charset=utf-8'
+            elif path in ('/', '/results', '/results.json'):
+                body, content_type = snapshot["json"], 'application/json; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes are too frequent to log
+
+    server = ThreadingHTTPServer(address, MetricsHandler)
+    server.daemon_threads = True
+    # Polled often enough for shutdown() to return within the shutdown deadline
+    threading.Thread(target=server.serve_forever, args=(input_poll_interval,), daemon=True).start()
+    return server
+
+# Function to run without the UI, publishing results to the metrics endpoint once per tick
+def run_headless(address=metrics_address):
+    start_time = time.time()
+    start_monitoring()
+    server = start_metrics_server(address)
+    # soft_wrap keeps the address on one line when the output goes to a log
+    get_console().print(f"Servindo métricas em http://{address[0]}:{server.server_address[1]}/metrics e /results",
+                        soft_wrap=True)
+    next_tick = time.monotonic()
+    while not stop_event.is_set():
+        current_time = time.time()
+        results = compute_results(current_time)
+        update_best_proxy(results, current_time - start_time)
+        snapshot = traceroute_snapshot
+        publish_snapshot(results, best_proxy_hostname, snapshot["stats"], snapshot["paths"])
+        mark_startup("first_frame")
+        next_tick += 1
+        stop_event.wait(max(0, next_tick - time.monotonic()))
+    server.shutdown()
+
+# Distributed mode: agents (--agent) stream batched sample rollups to an aggregator (--aggregator),
+# which merges them per site and per proxy and answers with fleet-wide recommendations
+agent_address = ('127.0.0.1', 9465)
+agent_batch_interval = 5.0   # Seconds of samples per batch
+agent_max_batches = 720      # Unsent batches kept while the aggregator is unreachable (1 hour)
+agent_reconnect_max = 60.0   # Seconds between reconnection attempts at most
+aggregate_window = 300       # Seconds of merged samples used for the fleet rankings
+agent_max_line = 1 << 22     # Largest batch the aggregator accepts, in bytes
+
+agent_uplink = None
+fleet_recommendation = None  # Latest {'site': ..., 'fleet': ...} received from the aggregator
+
+# Class to batch local samples into rollups and send them to the aggregator from its own thread;
+# probe threads only update a bucket, so a slow or unreachable aggregator never stalls probing
+class AgentUplink:
+    def __init__(self, address, site, batch_interval=agent_batch_interval, max_batches=agent_max_batches):
+        self.address = address
+        self.site = site
+        self.agent_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_interval = batch_interval
+        self.buckets = {}  # (target, hop) -> RollupBucket of the batch being filled
+        self.batches = deque(maxlen=max_batches)  # Unacknowledged batches, oldest dropped when full
+        self.sequence = 0
+        self.dropped = 0
+        self.connected = False
+        self.lock = TimedLock("agent")
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def add(self, target, hop, timestamp, rtt):
+        # Only the proxies themselves (ICMP and TCP connect); hop statistics stay local
+        if hop and not hop.startswith('tcp:'):
+            return
+        with self.lock:
+            bucket = self.buckets.get((target, hop))
+            if bucket is None:
+                bucket = self.buckets[(target, hop)] = RollupBucket()
+            bucket.add(rtt)
+
+    def cut_batch(self):
+        with self.lock:
+            buckets, self.buckets = self.buckets, {}
+            if not buckets:
+                return
+            self.sequence += 1
+            if len(self.batches) == self.batches.maxlen:
+                self.dropped += 1
+            self.batches.append({
+                "agent": self.agent_id,
+                "site": self.site,
+                "seq": self.sequence,
+                "time": time.time(),
+                "hops": {target: metrics[target]['Hops'] for target, hop in buckets
+                         if not hop and target in metrics},
+                "samples": [[target, hop, *bucket.row()] for (target, hop), bucket in buckets.items()],
+            })
+
+    def run(self):
+        global fleet_recommendation
+        connection = reader = None
+        backoff = 1.0
+        next_connect = 0.0
+        next_batch = time.monotonic() + self.batch_interval
+        while not (self.stop_event.is_set() or stop_event.is_set()):
+            now = time.monotonic()
+            if now >= next_batch:
+                self.cut_batch()
+                next_batch += self.batch_interval
+                if next_batch <= now:
+                    next_batch = now + self.batch_interval  # Skip batches missed while blocked
+            with self.lock:
+                batch = self.batches[0] if self.batches else None
+            if batch is None or (connection is None and now < next_connect):
+                self.stop_event.wait(max(0, min(next_batch, next_connect if batch else next_batch) - time.monotonic()))
+                continue
+            try:
+                if connection is None:
+                    connection = socket.create_connection(self.address, timeout=10)
+                    reader = connection.makefile('rb')
+                    self.connected = True
+                # One batch in flight at a time: the aggregator's pace is the backpressure
+                connection.sendall(json.dumps(batch, separators=(',', ':')).encode('utf-8') + b'\n')
+                reply = reader.readline(agent_max_line)
+                if not reply:
+                    raise ConnectionError("aggregator closed the connection")
+                reply = json.loads(reply)
+            except (OSError, ValueError):
+                if connection is not None:
+                    connection.close()
+                connection = reader = None
+                self.connected = False
+                next_connect = time.monotonic() + backoff
+                backoff = min(backoff * 2, agent_reconnect_max)
+                continue
+            backoff = 1.0
+            with self.lock:
+                if self.batches and self.batches[0] is batch:
+                    self.batches.popleft()
+            fleet_recommendation = reply.get("recommendation")
+        if connection is not None:
+            connection.close()
+
+    def close(self, timeout=5.0):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+# Function to compute the score of merged rollup statistics, like series_results without jitter variation
+def rollup_score(stats, hops):
+    if stats["AvgPing"] is None:
+        return None
+    return compute_score(stats["AvgPing"], stats["Jitter"], hops, stats["PacketLoss"], 0, p99=stats["P99"])
+
+# Class to merge agent batches per site and proxy and rank the proxies per site and fleet-wide
+class Aggregator:
+    def __init__(self, window=aggregate_window):
+        self.window = window
+        self.lock = threading.Lock()
+        self.agents = {}   # agent id -> {'site', 'seq', 'last_seen'}
+        self.buckets = defaultdict(deque)  # (site, target, hop) -> deque of (arrival time, RollupBucket)
+        self.hops = {}     # (site, target) -> hop count last reported
+        self.rankings = {"sites": {}, "fleet": []}  # Replaced by update(), never mutated
+
+    def merge(self, batch):
+        # Arrival time rather than the agent's clock, so skewed clocks can't pin or expire data
+        now = time.time()
+        with self.lock:
+            agent = self.agents.get(batch["agent"])
+            if agent is not None and batch["seq"] <= agent["seq"]:
+                agent["last_seen"] = now
+                return  # Resent after a lost acknowledgement
+            site = batch["site"]
+            self.agents[batch["agent"]] = {"site": site, "seq": batch["seq"], "last_seen": now}
+            for row in batch["samples"]:
+                target, hop = row[0], row[1]
+                self.buckets[(site, target, hop)].append((now, RollupBucket.from_row(row[2:])))
+            for target, hops in batch.get("hops", {}).items():
+                if hops is not None:
+                    self.hops[(site, target)] = hops
+
+    def rank(self, merged, hops):
+        ranking = []
+        for target, by_type in merged.items():
+            series = {}
+            for probe_type, bucket in by_type.items():
+                stats = bucket.statistics()
+                stats["Score"] = rollup_score(stats, hops.get(target))
+                series[probe_type] = stats
+            icmp = series.get("icmp") or {}
+            ranking.append({
+                "Proxy": target,
+                "Samples": icmp.get("Samples"),
+                "AvgPing": icmp.get("AvgPing"),
+                "PacketLoss": icmp.get("PacketLoss"),
+                "Jitter": icmp.get("Jitter"),
+                "P95": icmp.get("P95"),
+                "TcpAvgPing": series["tcp"]["AvgPing"] if "tcp" in series else None,
+                "Hops": hops.get(target),
+                "Score": combined_score(series),
+            })
+        ranking.sort(key=lambda r: (r["Score"] is None, r["Score"] or 0))
+        return ranking
+
+    def update(self):
+        now = time.time()
+        sites = defaultdict(lambda: defaultdict(dict))   # site -> target -> probe type -> RollupBucket
+        fleet = defaultdict(dict)
+        with self.lock:
+            for key in list(self.buckets):
+                entries = self.buckets[key]
+                while entries and entries[0][0] < now - self.window:
+                    entries.popleft()
+                if not entries:
+                    del self.buckets[key]
+                    continue
+                site, target, hop = key
+                probe_type = "tcp" if hop.startswith("tcp:") else "icmp"
+                for _, bucket in entries:
+                    for by_type in (sites[site][target], fleet[target]):
+                        if probe_type not in by_type:
+                            by_type[probe_type] = RollupBucket()
+                        by_type[probe_type].merge(bucket)
+            site_hops = {site: {target: hops for (s, target), hops in self.hops.items() if s == site}
+                         for site in sites}
+            agents = {agent: dict(info) for agent, info in self.agents.items()}
+            # The fleet uses the smallest hop count reported for a proxy, as the best-placed site sees it
+            fleet_hops = {}
+            for (site, target), hops in self.hops.items():
+                fleet_hops[target] = min(hops, fleet_hops.get(target, hops))
+        self.rankings = {
+            "timestamp": now,
+            "agents": agents,
+            "sites": {site: self.rank(merged, site_hops[site]) for site, merged in sites.items()},
+            "fleet": self.rank(fleet, fleet_hops),
+        }
+        return self.rankings
+
+    def recommendation(self, site):
+        rankings = self.rankings
+        best = lambda ranking: ranking[0]["Proxy"] if ranking and ranking[0]["Score"] is not None else None
+        return {"site": best(rankings["sites"].get(site)), "fleet": best(rankings["fleet"])}
+
+# Fleet ranking fields exported as Prometheus gauges by the aggregator
+prometheus_fleet_fields = [
+    ("AvgPing", "proxytest_fleet_ping_avg_ms", "Ping médio em 5 minutos"),
+    ("PacketLoss", "proxytest_fleet_packet_loss_percent", "Perda de pacotes em 5 minutos"),
+    ("Jitter", "proxytest_fleet_jitter_ms", "Jitter em 5 minutos"),
+    ("P95", "proxytest_fleet_ping_p95_ms", "Percentil 95 do ping em 5 minutos"),
+    ("TcpAvgPing", "proxytest_fleet_tcp_connect_avg_ms", "Tempo médio de conexão TCP em 5 minutos"),
+    ("Score", "proxytest_fleet_score", "Score composto (menor é melhor)"),
+]
+
+# Function to format the fleet rankings in the Prometheus text format (site="" is the whole fleet)
+def format_fleet_prometheus(rankings):
+    lines = []
+    rows = [(site, ranking) for site, ranking in rankings["sites"].items()] + [("", rankings["fleet"])]
+    for key, name, help_text in prometheus_fleet_fields:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for site, ranking in rows:
+            for result in ranking:
+                if result.get(key) is not None:
+                    lines.append(f'{name}{{site="{prometheus_label(site)}",proxy="{prometheus_label(result["Proxy"])}"}} {result[key]}')
+    lines.append("# HELP proxytest_fleet_agents Agentes que enviaram dados na janela")
+    lines.append("# TYPE proxytest_fleet_agents gauge")
+    lines.append(f"proxytest_fleet_agents {len(rankings['agents'])}")
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+# Function to run the aggregator: agents connect to agent_listen, rankings are served over HTTP
+def run_aggregator(agent_listen=agent_address, address=metrics_address):
+    import socketserver
+    global metrics_snapshot
+    aggregator = Aggregator()
+
+    class AgentHandler(socketserver.StreamRequestHandler):
+        timeout = aggregate_window  # Idle agents are disconnected; they reconnect on their next batch
+
+        def handle(self):
+            while not stop_event.is_set():
+                try:
+                    line = self.rfile.readline(agent_max_line)
+                except OSError:
+                    return  # Idle past the timeout, or reset by the agent
+                if not line or not line.endswith(b'\n'):
+                    return
+                try:
+                    batch = json.loads(line)
+                    aggregator.merge(batch)
+                except (ValueError, KeyError, TypeError):
+                    return  # Malformed batch: drop the connection, the agent resends
+                reply = {"ack": batch["seq"], "recommendation": aggregator.recommendation(batch["site"])}
+                try:
+                    self.wfile.write(json.dumps(reply, separators=(',', ':')).encode('utf-8') + b'\n')
+                except OSError:
+                    return  # The agent is gone; it resends the unacknowledged batch
+
+    class AgentServer(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    agent_server = AgentServer(agent_listen, AgentHandler)
+    threading.Thread(target=agent_server.serve_forever, args=(input_poll_interval,), daemon=True).start()
+    server = start_metrics_server(address)
+    get_console().print(f"Recebendo agentes em {agent_listen[0]}:{agent_server.server_address[1]}; "
+                        f"ranking em http://{address[0]}:{server.server_address[1]}/metrics e /results", soft_wrap=True)
+    next_tick = time.monotonic()
+    while not stop_event.is_set():
+        rankings = aggregator.update()
+        metrics_snapshot = {
+            "json": json.dumps(rankings, ensure_ascii=False).encode('utf-8'),
+            "prometheus": format_fleet_prometheus(rankings),
+        }
+        next_tick += 1
+        stop_event.wait(max(0, next_tick - time.monotonic()))
+    agent_server.shutdown()
+    server.shutdown()
+
+# Sharded probing (--workers N): the targets are split between worker processes by a hash of their
+# name, so the per-sample work runs on every core. Each worker has its own scheduler, prober and
+# windows and sends the coordinator one snapshot of windowed statistics per second, never raw
+# samples; the coordinator scores them, picks the best proxy, traces the paths and serves the results
+shard_interval = 1.0        # Seconds between the snapshots of a worker
+shard_restart = 5.0         # Seconds before a worker that died is started again
+shard_exit = shutdown_deadline / 2  # Seconds a worker gets to exit; it has nothing to save, so it is then terminated
+# Result fields in a snapshot, in this order; the coordinator adds the names and the score
+shard_fields = result_fields + tuple("Tcp" + key for key in result_fields) + ("Hops",)
+
+shard_pool = None
+coordinator_best_score = None  # In a worker: the best score of every shard, for the probe cadence
+
+# Function to run one shard of --workers in a worker process: probes the targets the coordinator
+# sends ("add" messages) and answers with the windowed statistics of its targets every shard_interval
+def run_shard(connection, settings):
+    global ping_backend, prober, max_probe_rate, game_port, proxy_candidates, proxy_order
+    global best_proxy_hostname, coordinator_best_score
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches every process; the coordinator stops us
+    ping_backend = settings['ping_backend']
+    max_probe_rate = settings['max_probe_rate']
+    game_port = settings['game_port']
+    probe_weights.update(settings['probe_weights'])
+    score_weights.update(settings['score_weights'])
+    proxy_candidates = settings['candidates']
+    proxy_order = {hostname: i for i, hostname in enumerate(proxy_candidates)}
+    if settings['fake_network']:
+        prober = FakeNetwork(default_fake_paths(settings['fake_paths']))
+    supervisor.start("hop-traces", hop_trace_worker)
+    next_snapshot = time.monotonic()
+    try:
+        while not stop_event.is_set():
+            # Messages first, so a long list of targets is taken in before the next snapshot
+            if connection.poll(max(0.0, min(next_snapshot - time.monotonic(), input_poll_interval))):
+                message = connection.recv()
+                if message is None:
+                    break
+                if message[0] == "add":
+                    register_proxies(message[1])
                 else:
-                    new_best_proxy = None
-                    new_best_proxy_hostname = None
+                    _, best_proxy_hostname, coordinator_best_score = message
+                continue
+            if time.monotonic() >= next_snapshot:
+                results = compute_results(time.time())
+                connection.send([(result['Proxy'], tuple(result[key] for key in shard_fields), result.get('Addresses'))
+                                 for result in results])
+                next_snapshot = max(next_snapshot + shard_interval, time.monotonic())
+    except (EOFError, OSError):
+        pass  # The coordinator is gone
+    supervisor.shutdown()
+
+# Class to start the workers of --workers, hand them their targets and collect their snapshots;
+# a worker that dies is started again with the same targets
+class ShardPool:
+    def __init__(self, count, settings):
+        import multiprocessing
+        # Spawned rather than forked: the same on every platform, and safe with our threads running
+        self.context = multiprocessing.get_context('spawn')
+        self.settings = settings
+        self.shards = [{'process': None, 'connection': None, 'lock': threading.Lock(), 'targets': {},
+                        'rows': {}, 'started': 0.0} for _ in range(count)]
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        for shard in self.shards:
+            self.spawn(shard)
+        self.thread.start()
+
+    def spawn(self, shard):
+        connection, child = self.context.Pipe()
+        process = self.context.Process(target=run_shard, args=(child, self.settings), daemon=True)
+        process.start()
+        child.close()
+        with shard['lock']:
+            shard.update(process=process, connection=connection, rows={}, started=time.monotonic())
+            if shard['targets']:
+                self.send(shard, ("add", list(shard['targets'].items())))
+
+    def send(self, shard, message):
+        # Caller holds shard['lock']; a dead worker is noticed and restarted by run
+        try:
+            if shard['connection'] is not None:
+                shard['connection'].send(message)
+        except OSError:
+            pass
+
+    def add(self, entries):
+        # (hostname, addresses) pairs, one message per worker; crc32 is stable across runs (unlike
+        # hash()), so a target stays on the same worker
+        batches = defaultdict(list)
+        for hostname, addresses in entries:
+            batches[zlib.crc32(hostname.encode('utf-8')) % len(self.shards)].append((hostname, addresses))
+        for index, batch in batches.items():
+            shard = self.shards[index]
+            with shard['lock']:
+                shard['targets'].update(batch)
+                self.send(shard, ("add", batch))
+
+    def run(self):
+        from multiprocessing.connection import wait as wait_connections
+        while not (self.stop_event.is_set() or stop_event.is_set()):
+            connections = {shard['connection']: shard for shard in self.shards if shard['connection'] is not None}
+            for connection in wait_connections(list(connections), input_poll_interval):
+                shard = connections[connection]
+                try:
+                    rows = connection.recv()
+                except (EOFError, OSError):
+                    # The worker died: its targets show no data until it is started again
+                    with shard['lock']:
+                        connection.close()
+                        shard.update(connection=None, rows={})
+                    continue
+                rows = {hostname: (values, addresses) for hostname, values, addresses in rows}
+                with shard['lock']:
+                    shard['rows'] = rows
+            for shard in self.shards:
+                if shard['connection'] is None and time.monotonic() - shard['started'] >= shard_restart:
+                    self.spawn(shard)
+        for shard in self.shards:
+            with shard['lock']:
+                self.send(shard, None)
+        # Snapshots are still read while the workers exit, so none stays blocked sending its last one
+        deadline = time.monotonic() + shard_exit
+        connections = [shard['connection'] for shard in self.shards if shard['connection'] is not None]
+        while connections and time.monotonic() < deadline:
+            for connection in wait_connections(connections, min(input_poll_interval, max(0.0, deadline - time.monotonic()))):
+                try:
+                    connection.recv()
+                except (EOFError, OSError):
+                    connections.remove(connection)
+        processes = [shard['process'] for shard in self.shards if shard['process'] is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(max(0.0, deadline + shard_exit - time.monotonic()))
+
+    def results(self):
+        # The latest snapshot of every shard, scored here with the coordinator's weights; the best
+        # score goes back to the workers, which only see their own targets when adapting the cadence
+        rows = {}
+        for shard in self.shards:
+            with shard['lock']:
+                rows.update(shard['rows'])
+        results = []
+        for proxy in proxies:
+            row = rows.get(proxy['hostname'])
+            if row is None:
+                continue  # No data yet
+            values, addresses = row
+            result = {"Proxy": proxy['hostname'], **dict(zip(shard_fields[:-1], values[:-1])),
+                      "DisplayName": proxy['display_name'], "Description": proxy['description'], "Hops": values[-1]}
+            result["Score"] = score_result(result)
+            if addresses:
+                result["Addresses"] = addresses
+            results.append(result)
+        scores = [result['Score'] for result in results if result['Score'] is not None]
+        for shard in self.shards:
+            with shard['lock']:
+                self.send(shard, ("best", best_proxy_hostname, min(scores) if scores else None))
+        return results
+
+    def close(self, timeout=0.0):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+# Latency under load (--load-sink): a rate-limited TCP upload to a sink alternates with idle periods
+# and the proxies are pinged more often while it runs, to measure the queueing delay (bufferbloat)
+# a saturated uplink adds. Samples taken under load are kept apart from the idle statistics
+load_sink_address = ('0.0.0.0', 9466)
+load_rate = 20.0            # Mbit/s uploaded during a loaded period (--load-rate)
+load_on = 10.0              # Seconds of load per cycle
+load_off = 20.0             # Idle seconds between loaded periods
+load_connections = 4        # Parallel uploads, so one TCP flow's congestion control doesn't hide the queue
+load_ramp = 2.0             # Seconds after the load starts before samples count as loaded (queues filling)
+load_drain = 1.0            # Seconds after it stops before samples count as idle again (queues draining)
+load_probe_interval = 0.2   # Seconds between pings to a proxy while loaded
+load_window = 60            # Seconds of loaded samples in the statistics, so they span a whole cycle
+load_chunk = 64 * 1024
+
+# Class to generate the load: one thread, non-blocking sockets and a token bucket, so the upload never
+# exceeds the configured rate even against a loopback sink
+class LoadGenerator:
+    def __init__(self, address, rate=load_rate, on=load_on, off=load_off, connections=load_connections):
+        self.address = address
+        self.rate = rate * 125000   # Bytes per second
+        self.on = on
+        self.off = off
+        self.connections = connections
+        self.period = (None, None)  # Wall times the current or last loaded period started and ended (None while running)
+        self.sent = 0               # Bytes sent in total
+        self.last_rate = None       # Mbit/s achieved in the last loaded period
+        self.error = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    @property
+    def loaded(self):
+        since, until = self.period
+        return since is not None and until is None
+
+    def phase(self, timestamp):
+        # 'idle', 'loaded', or None for the ramp and drain around a loaded period
+        since, until = self.period
+        if since is None or timestamp < since:
+            return 'idle'
+        if timestamp < since + load_ramp:
+            return None
+        if until is None or timestamp < until:
+            return 'loaded'
+        return None if timestamp < until + load_drain else 'idle'
+
+    def run(self):
+        # Idle first, so the idle statistics exist before the first loaded period
+        while not (self.stop_event.wait(self.off) or stop_event.is_set()):
+            self.upload()
+
+    def upload(self):
+        sockets = []
+        try:
+            for _ in range(self.connections):
+                sockets.append(socket.create_connection(self.address, timeout=5))
+                sockets[-1].setblocking(False)
+        except OSError as e:
+            self.error = str(e)
+            for sock in sockets:
+                sock.close()
+            return
+        self.error = None
+        chunk = memoryview(bytes(load_chunk))
+        self.period = (time.time(), None)
+        started = time.monotonic()
+        sent = 0
+        try:
+            while not (self.stop_event.is_set() or stop_event.is_set()):
+                elapsed = time.monotonic() - started
+                if elapsed >= self.on:
+                    break
+                budget = int(self.rate * elapsed) - sent
+                if budget <= 0:
+                    self.stop_event.wait(min(-budget / self.rate + 0.001, input_poll_interval))
+                    continue
+                # Only sockets with room in their send buffer; all full means the uplink is saturated
+                _, writable, _ = select.select([], sockets, [], input_poll_interval)
+                for sock in writable:
+                    if budget <= 0:
+                        break
+                    try:
+                        count = sock.send(chunk[:min(budget, load_chunk)])
+                    except BlockingIOError:
+                        continue
+                    sent += count
+                    budget -= count
+        except OSError as e:
+            self.error = str(e)
+        finally:
+            self.period = (self.period[0], time.time())
+            self.sent += sent
+            self.last_rate = sent * 8 / 1e6 / max(time.monotonic() - started, 1e-3)
+            for sock in sockets:
+                sock.close()
+
+    def status(self):
+        # Short text for the UI header
+        if self.error:
+            return f"erro no sink ({self.error})"
+        if self.loaded:
+            return f"enviando até {self.rate / 125000:g} Mbit/s"
+        rate = f", último {self.last_rate:.1f} Mbit/s" if self.last_rate is not None else ""
+        return f"ociosa{rate}"
+
+    def close(self, timeout=5.0):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+load_generator = None
+
+# Class to run a sink that reads and discards uploads (--serve-load-sink, or 'local' for loopback tests)
+class LoadSink:
+    def __init__(self, address=load_sink_address):
+        import socketserver
+        sink = self
+        self.received = 0   # Bytes read in total
+        self.lock = threading.Lock()
 
-                if new_best_proxy_hostname != best_proxy_hostname:
-                    best_proxy_hostname = new_best_proxy_hostname
+        class SinkHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    while not stop_event.is_set():
+                        data = self.request.recv(load_chunk)
+                        if not data:
+                            break
+                        with sink.lock:
+                            sink.received += len(data)
+                except OSError:
+                    pass
+
+        class SinkServer(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = SinkServer(address, SinkHandler)
+        self.server_address = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(input_poll_interval,), daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def close(self, timeout=None):
+        # shutdown() waits for serve_forever, which polls every input_poll_interval
+        if self.thread.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
+
+# Function to print the recorded statistics of a proxy (or one of its hops) for a time range
+def print_store_query(target, hop='', start_text=None, end_text=None):
+    if '.' not in target:
+        target = f"{target}.ragnatales.com.br"
+    end = time.mktime(time.strptime(end_text, "%Y-%m-%d %H:%M")) if end_text else time.time()
+    start = time.mktime(time.strptime(start_text, "%Y-%m-%d %H:%M")) if start_text else end - 86400
+    result = query_store(target, start, end, hop)
+    console = get_console()
+    console.print(f"[bold]{target}{' / ' + hop if hop else ''}[/bold] "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(start))} - {time.strftime('%Y-%m-%d %H:%M', time.localtime(end))}")
+    if not result["Samples"]:
+        console.print("[red]Nenhum dado gravado neste período.[/red]")
+        return
+    console.print(f"  Amostras: {result['Samples']} (agregados de {result['Resolution']} s)")
+    console.print(f"  Perda de Pacotes: {result['PacketLoss']:.2f}%")
+    if result["AvgPing"] is not None:
+        console.print(f"  Ping Médio: {result['AvgPing']:.2f} ms")
+        console.print(f"  Ping Mínimo: {result['MinPing']:.2f} ms")
+        console.print(f"  Ping Máximo: {result['MaxPing']:.2f} ms")
+        console.print(f"  Jitter: {result['Jitter']:.2f} ms")
+        console.print(f"  p50 / p95 / p99: {result['P50']:.2f} / {result['P95']:.2f} / {result['P99']:.2f} ms")
+
+# Replay (--replay): recorded samples are run again through the live window/score pipeline on a
+# virtual clock, once per scoring variant, to compare weights and windows over long histories
+replay_variant_keys = {"window", "jitter_window", "margin", "dwell"}
+replay_session_gap = 60  # Seconds without samples that start a new session (monitor restarted)
+
+# Function to parse a --variant option: NAME:key=value,... with score_weights keys, windows in
+# seconds and the switch margin (percent) and dwell (seconds)
+def parse_replay_variant(text):
+    name, _, settings = text.partition(':')
+    variant = {"name": name.strip() or text, "weights": dict(score_weights), "window": time_window,
+               "jitter_window": jitter_variation_window, "margin": switch_margin, "dwell": switch_dwell}
+    for item in filter(None, settings.split(',')):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key not in score_weights and key not in replay_variant_keys:
+            raise ValueError(f"parâmetro desconhecido: {key}")
+        value = float(value)
+        if key in score_weights:
+            variant["weights"][key] = value
+        elif key == "margin":
+            variant["margin"] = value / 100
+        else:
+            variant[key] = value
+    return variant
+
+# Function to load recorded proxy samples sorted by time, from the store database or from an
+# exported .jsonl/.csv file (target, hop, ts, rtt); returns (samples, hop count per target)
+def load_recorded_samples(path=store_file, start=None, end=None):
+    start = float('-inf') if start is None else start
+    end = float('inf') if end is None else end
+    samples = []
+    path_hops = defaultdict(set)
+    if path.endswith('.jsonl') or path.endswith('.csv') or path.endswith('.pxt'):
+        binary = path.endswith('.pxt')
+        with open(path, 'rb') if binary else open(path, newline='', encoding='utf-8') as f:
+            if binary:
+                rows = ({"ts": ts, "target": target, "hop": hop, "rtt": rtt}
+                        for ts, target, hop, rtt in read_pxt_samples(f, path))
+            elif path.endswith('.csv'):
+                import csv
+                rows = csv.DictReader(f)
+                if not {"target", "ts"} <= set(rows.fieldnames or ()):
+                    # The results and hop files of a CSV export: the samples are in the file next to them
+                    base = path[:-len('.csv')]
+                    base = base[:-len('_saltos')] if base.endswith('_saltos') else base
+                    raise ValueError(f"{path} não contém amostras; use {base}_amostras.csv")
             else:
-                best_proxy_hostname = None
+                # Exports also hold meta, result and hop lines
+                rows = (row for row in (json.loads(line) for line in f if line.strip())
+                        if row.get("type", "sample") == "sample")
+            for row in rows:
+                ts = float(row["ts"])
+                if not start <= ts < end:
+                    continue
+                hop = row.get("hop") or ''
+                rtt = row.get("rtt")
+                if hop and not hop.startswith('tcp:'):
+                    path_hops[row["target"]].add(hop)
+                else:
+                    samples.append((ts, row["target"], hop, float(rtt) if rtt not in (None, '') else None))
+        samples.sort(key=lambda sample: sample[0])
+    else:
+        conn = open_store(path)
+        try:
+            bounds = (max(start, 0.0), min(end, 1e12))
+            samples = conn.execute("SELECT ts, target, hop, rtt FROM samples WHERE ts >= ? AND ts < ? "
+                                   "AND (hop = '' OR hop LIKE 'tcp:%') ORDER BY ts", bounds).fetchall()
+            for target, hop in conn.execute("SELECT DISTINCT target, hop FROM samples WHERE ts >= ? AND ts < ? "
+                                            "AND hop != '' AND hop NOT LIKE 'tcp:%'", bounds):
+                path_hops[target].add(hop)
+        finally:
+            conn.close()
+    # The hop count is approximated by the distinct hops recorded on the path (silent hops count once)
+    return samples, {target: len(hops) for target, hops in path_hops.items()}
 
-            update_layout(layout, results, best_proxy_hostname, connection_type, wifi_detected, elapsed_time)
-            live.refresh()
+# Function to replay recorded samples with one variant; returns the switch count and time per best proxy
+def replay_variant(samples, hops, variant):
+    window = variant["window"]
+    jitter_window = variant["jitter_window"]
+    series = {}  # (target, probe type) -> windows sized for this variant
+    best = since = session_start = None
+    switches = sessions = 0
+    best_time = defaultdict(int)
+    timeline = []
+    index = 0
+    tick = None
+    while index < len(samples) or (tick is not None and tick <= samples[-1][0] + 1):
+        if tick is None or (index < len(samples) and samples[index][0] - tick > replay_session_gap):
+            # A new session: windows start empty and the initial analysis runs again, like a restart
+            series.clear()
+            tick = math.floor(samples[index][0]) + 1
+            session_start = samples[index][0]
+            best = None
+            sessions += 1
+        # Every sample up to this tick is added in one batch, then the proxies are scored once
+        while index < len(samples) and samples[index][0] < tick:
+            ts, target, hop, rtt = samples[index]
+            key = (target, "tcp" if hop else "icmp")
+            windows = series.get(key)
+            if windows is None:
+                windows = series[key] = {
+                    "Window": RollingWindow(window, ring_capacity(window, min_probe_interval)),
+                    "JitterWindow": RollingWindow(jitter_window, ring_capacity(jitter_window, 1)),
+                    "Sketch": LatencySketch(window),
+                    "LongSketch": LatencySketch(jitter_window),
+                    "SessionSketch": LatencySketch(),
+                }
+            windows["Window"].add(ts, rtt)
+            add_to_sketches(windows, ts, rtt)
+            index += 1
+        by_target = defaultdict(dict)
+        for (target, probe_type), windows in series.items():
+            by_target[target][probe_type] = series_results(windows, hops.get(target), tick, variant["weights"])
+        results = [{"Proxy": target, "Score": combined_score(by_type)} for target, by_type in by_target.items()]
+        previous = best
+        best, since = choose_best_proxy(results, best, since, tick - session_start,
+                                        variant["margin"], variant["dwell"])
+        if previous is not None and best is not None and best != previous:
+            switches += 1
+        if best is not None:
+            best_time[best] += 1
+        timeline.append(best)
+        tick += 1
+    return {"switches": switches, "sessions": sessions, "best_time": dict(best_time), "timeline": timeline,
+            "final": best}
 
-            # Check user input
-            check_user_input()
-            time.sleep(1)
+# Function to replay recorded samples with the current settings and every variant, printing a comparison
+def print_replay(path, variants, start_text=None, end_text=None):
+    start = time.mktime(time.strptime(start_text, "%Y-%m-%d %H:%M")) if start_text else None
+    end = time.mktime(time.strptime(end_text, "%Y-%m-%d %H:%M")) if end_text else None
+    console = get_console()
+    load_started = time.perf_counter()
+    samples, hops = load_recorded_samples(path, start, end)
+    if not samples:
+        console.print("[red]Nenhuma amostra gravada neste período.[/red]")
+        return
+    targets = {sample[1] for sample in samples}
+    hours = (samples[-1][0] - samples[0][0]) / 3600
+    console.print(f"[bold]{len(samples)}[/bold] amostras de {len(targets)} proxies, "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(samples[0][0]))} - "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(samples[-1][0]))} "
+                  f"(carregadas em {time.perf_counter() - load_started:.1f} s)")
 
-    console.print("[bold red]Programa terminado pelo usuário.[/bold red]")
+    from rich.table import Table
+    table = Table(title="Replay dos Scores")
+    for column in ("Variante", "Trocas", "Trocas/h", "Sessões", "Mais Tempo", "Final", "Concord.", "Tempo"):
+        table.add_column(column, justify="left" if column == "Variante" else "right")
+    baseline = None
+    for variant in [parse_replay_variant("atual")] + variants:
+        replay_started = time.perf_counter()
+        replay = replay_variant(samples, hops, variant)
+        elapsed = time.perf_counter() - replay_started
+        if baseline is None:
+            baseline = replay["timeline"]
+        agreement = sum(a == b for a, b in zip(replay["timeline"], baseline)) / len(baseline) * 100
+        scored = sum(replay["best_time"].values())
+        top = max(replay["best_time"].items(), key=lambda item: item[1], default=None)
+        table.add_row(
+            variant["name"],
+            str(replay["switches"]),
+            f"{replay['switches'] / hours:.1f}" if hours else "-",
+            str(replay["sessions"]),
+            f"{top[0].split('.')[0]} ({top[1] / scored * 100:.0f}%)" if top else "-",
+            replay["final"].split('.')[0] if replay["final"] else "-",
+            f"{agreement:.0f}%",
+            f"{elapsed:.1f} s",
+        )
+    console.print(table)
 
-if __name__ == "__main__":
+# Function to parse a HOST:PORT option, taking missing parts from the default address
+def parse_address(text, default):
+    if ':' not in text:
+        return (text, default[1])
+    host, _, port = text.rpartition(':')
+    return (host or default[0], int(port) if port else default[1])
+
+# Function to parse the command line and run the monitor
+def main(argv=None):
+    global ping_backend, prober, sample_store, agent_uplink, exporter, load_generator, shard_pool, max_probe_rate, game_port
+    global switch_margin, switch_dwell
+    parser = argparse.ArgumentParser(description="Monitor de Desempenho de Proxies")
+    parser.add_argument('--ping-backend', choices=['native', 'subprocess', 'stream'], default=ping_backend,
+                        help="native: sonda ICMP/TCP no próprio processo; subprocess: um comando ping do sistema "
+                             "por amostra; stream: um ping do sistema contínuo por proxy")
+    parser.add_argument('--targets', metavar='ARQUIVO',
+                        help="monitora os alvos deste arquivo em vez de descobrir os proxies: JSON (lista de hosts ou de "
+                             "objetos com hostname, display_name e description) ou texto, um 'host [nome]' por linha")
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help="divide os alvos entre N processos de sondagem, para listas grandes (0: um por núcleo; padrão: 1)")
+    parser.add_argument('--fake-network', action='store_true',
+                        help="usa uma rede simulada (teste offline, sem enviar pacotes)")
+    parser.add_argument('--refresh-rate', type=float, default=1.0, metavar='HZ',
+                        help="atualizações da interface por segundo (padrão: 1)")
+    parser.add_argument('--max-pps', type=float, default=max_probe_rate, metavar='PPS',
+                        help=f"limite global de pacotes por segundo das sondas (padrão: {max_probe_rate:g})")
+    parser.add_argument('--game-port', type=int, metavar='PORTA',
+                        help="também mede o tempo de conexão TCP (handshake) a esta porta de cada proxy")
+    parser.add_argument('--probe-weights', metavar='TIPO=PESO,...',
+                        help="peso de cada tipo de sonda no score, ex.: icmp=1,tcp=3 (padrão: pesos iguais)")
+    parser.add_argument('--score-weights', metavar='CHAVE=PESO,...',
+                        help=f"pesos do score, ex.: p99=0.5,jitter=2 (chaves: {', '.join(score_weights)})")
+    parser.add_argument('--switch-margin', type=float, default=switch_margin * 100, metavar='PCT',
+                        help=f"quanto (%%) o score de outro proxy deve ser menor para trocar o melhor (padrão: {switch_margin * 100:g})")
+    parser.add_argument('--switch-dwell', type=float, default=switch_dwell, metavar='S',
+                        help=f"tempo mínimo em segundos antes de trocar o melhor proxy de novo (padrão: {switch_dwell:g})")
+    parser.add_argument('--headless', action='store_true',
+                        help="sem interface: serve os resultados em JSON e no formato Prometheus via HTTP local")
+    parser.add_argument('--listen', default=f"{metrics_address[0]}:{metrics_address[1]}", metavar='HOST:PORTA',
+                        help="endereço do endpoint de métricas no modo --headless")
+    parser.add_argument('--agent', metavar='HOST:PORTA',
+                        help="envia as amostras em lotes a um agregador central e mostra a recomendação da frota")
+    parser.add_argument('--site', default=socket.gethostname(), metavar='NOME',
+                        help="nome do local deste agente no agregador (padrão: nome da máquina)")
+    parser.add_argument('--aggregator', nargs='?', const=f"0.0.0.0:{agent_address[1]}", metavar='HOST:PORTA',
+                        help=f"roda só o agregador, recebendo agentes neste endereço (padrão: 0.0.0.0:{agent_address[1]}) "
+                             "e servindo o ranking em --listen")
+    parser.add_argument('--load-sink', metavar='HOST:PORTA',
+                        help="mede a latência sob carga: envia tráfego a este sink em ciclos e compara o ping ocioso "
+                             "com o ping sob carga ('local' sobe um sink no próprio processo, para testes)")
+    parser.add_argument('--load-rate', type=float, default=load_rate, metavar='MBPS',
+                        help=f"taxa máxima do envio sob carga em Mbit/s (padrão: {load_rate:g})")
+    parser.add_argument('--load-cycle', default=f"{load_on:g}:{load_off:g}", metavar='CARGA:OCIOSO',
+                        help=f"segundos com carga e sem carga em cada ciclo (padrão: {load_on:g}:{load_off:g})")
+    parser.add_argument('--serve-load-sink', nargs='?', const=f"{load_sink_address[0]}:{load_sink_address[1]}",
+                        metavar='HOST:PORTA',
+                        help=f"roda só um sink que descarta o tráfego de --load-sink (padrão: 0.0.0.0:{load_sink_address[1]})")
+    parser.add_argument('--record', action='store_true',
+                        help=f"grava todas as amostras e agregados em {store_file}")
+    parser.add_argument('--export-format', default='txt', metavar='FORMATO,...',
+                        help=f"formatos da exportação (tecla 's' ou --export-interval): {', '.join(export_formats)} (padrão: txt)")
+    parser.add_argument('--export-interval', type=float, metavar='SEGUNDOS',
+                        help="exporta automaticamente a cada SEGUNDOS, também no modo --headless")
+    parser.add_argument('--export-dir', default='.', metavar='DIR', help="pasta das exportações (padrão: a atual)")
+    parser.add_argument('--query', metavar='PROXY',
+                        help="consulta o histórico gravado de um proxy (ex.: proxy2) e sai")
+    parser.add_argument('--replay', nargs='?', const=store_file, metavar='ARQUIVO',
+                        help="reprocessa amostras gravadas (banco do --record ou exportação .jsonl/.csv/.pxt) e compara variantes do score")
+    parser.add_argument('--variant', action='append', default=[], metavar='NOME:CHAVE=VALOR,...',
+                        help="variante para --replay, ex.: perda:loss=1000,window=60,margin=5 "
+                             f"(chaves: {', '.join(list(score_weights) + sorted(replay_variant_keys))})")
+    parser.add_argument('--hop', default='', help="IP do salto para --query (padrão: o próprio proxy)")
+    parser.add_argument('--from', dest='query_from', metavar='"AAAA-MM-DD HH:MM"', help="início da consulta (padrão: 24h atrás)")
+    parser.add_argument('--to', dest='query_to', metavar='"AAAA-MM-DD HH:MM"', help="fim da consulta (padrão: agora)")
+    parser.add_argument('--startup-profile', action='store_true',
+                        help="mostra o tempo até a primeira sonda e o primeiro quadro ao sair")
+    args = parser.parse_args(argv)
+    ping_backend = args.ping_backend
+    max_probe_rate = max(1.0, args.max_pps)
+    game_port = args.game_port
+    switch_margin = max(0.0, args.switch_margin) / 100
+    switch_dwell = max(0.0, args.switch_dwell)
+    if args.probe_weights:
+        for item in args.probe_weights.split(','):
+            probe_type, _, weight = item.partition('=')
+            if probe_type.strip() not in probe_weights:
+                parser.error(f"tipo de sonda desconhecido: {probe_type.strip()}")
+            try:
+                probe_weights[probe_type.strip()] = float(weight)
+            except ValueError:
+                parser.error(f"peso inválido para {probe_type.strip()}: {weight}")
+    if args.score_weights:
+        for item in args.score_weights.split(','):
+            key, _, weight = item.partition('=')
+            if key.strip() not in score_weights:
+                parser.error(f"peso de score desconhecido: {key.strip()}")
+            try:
+                score_weights[key.strip()] = float(weight)
+            except ValueError:
+                parser.error(f"peso inválido para {key.strip()}: {weight}")
+    try:
+        on, _, off = args.load_cycle.partition(':')
+        on, off = float(on), float(off or load_off)
+    except ValueError:
+        parser.error(f"ciclo de carga inválido: {args.load_cycle}")
+    formats = tuple(dict.fromkeys(item.strip() for item in args.export_format.split(',') if item.strip()))
+    for export_format in formats:
+        if export_format not in export_formats:
+            parser.error(f"formato de exportação desconhecido: {export_format}")
+    if args.targets:
+        try:
+            use_targets(load_targets(args.targets))
+        except (OSError, ValueError) as e:
+            parser.error(f"lista de alvos inválida: {e}")
+    workers = args.workers if args.workers > 0 else os.cpu_count() or 1
+    if workers > 1:
+        # Samples stay in the workers, so what needs them in this process is not available
+        for option, value in (("--record", args.record), ("--agent", args.agent), ("--load-sink", args.load_sink)):
+            if value:
+                parser.error(f"{option} não é compatível com --workers")
+    if args.fake_network:
+        ping_backend = "native"
+        prober = FakeNetwork(default_fake_paths(configured_targets))
+    if args.query:
+        print_store_query(args.query, args.hop, args.query_from, args.query_to)
+        return
+    if args.replay:
+        try:
+            variants = [parse_replay_variant(text) for text in args.variant]
+        except ValueError as e:
+            parser.error(f"variante inválida: {e}")
+        try:
+            print_replay(args.replay, variants, args.query_from, args.query_to)
+        except ValueError as e:
+            parser.error(str(e))
+        return
+    if args.startup_profile:
+        enable_startup_profile()
+    if args.aggregator:
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+        try:
+            run_aggregator(parse_address(args.aggregator, agent_address), parse_address(args.listen, metrics_address))
+        except KeyboardInterrupt:
+            stop_event.set()
+        return
+    if args.serve_load_sink:
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+        sink = LoadSink(parse_address(args.serve_load_sink, load_sink_address))
+        sink.start()
+        get_console().print(f"Sink de carga em {sink.server_address[0]}:{sink.server_address[1]}", soft_wrap=True)
+        try:
+            while not stop_event.wait(input_poll_interval):
+                pass
+        except KeyboardInterrupt:
+            stop_event.set()
+        sink.close()
+        return
+    if args.load_sink:
+        if args.load_sink == 'local':
+            sink = supervisor.own("sink", LoadSink(('127.0.0.1', 0)))
+            sink.start()
+            address = sink.server_address
+        else:
+            address = parse_address(args.load_sink, load_sink_address)
+        load_generator = supervisor.own("load", LoadGenerator(address, max(0.1, args.load_rate), max(1.0, on),
+                                                              max(load_ramp + load_drain, off)))
+        load_generator.start()
+    if workers > 1:
+        # The probe budget is split evenly; path traces stay here, within their own share of it
+        shard_pool = supervisor.own("shards", ShardPool(workers, {
+            "ping_backend": ping_backend, "max_probe_rate": max_probe_rate / workers, "game_port": game_port,
+            "probe_weights": probe_weights, "score_weights": score_weights, "candidates": proxy_candidates,
+            "fake_network": args.fake_network, "fake_paths": configured_targets}))
+        shard_pool.start()
+    if args.record:
+        sample_store = supervisor.own("store", SampleStore(), drain=True)
+        sample_store.start()
+    if args.agent:
+        agent_uplink = supervisor.own("agent", AgentUplink(parse_address(args.agent, agent_address), args.site))
+        agent_uplink.start()
+    if args.export_interval or not args.headless:
+        exporter = supervisor.own("export", ResultExporter(formats or ("txt",), args.export_dir,
+                                  max(1.0, args.export_interval) if args.export_interval else None), drain=True)
+        exporter.start()
     try:
-        run_tests_continuously()
+        if args.headless:
+            # Stop cleanly when the service manager terminates us
+            import signal
+            signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+            run_headless(parse_address(args.listen, metrics_address))
+        else:
+            run_tests_continuously(max(0.1, args.refresh_rate))
     except KeyboardInterrupt:
         stop_event.set()
-        console.print("[bold red]Programa terminado pelo usuário.[/bold red]")
+        if not args.headless:
+            get_console().print("[bold red]Programa terminado pelo usuário.[/bold red]")
+    stragglers = supervisor.shutdown()
+    if stragglers:
+        get_console().print(f"[yellow]Ainda em execução ao sair: {', '.join(stragglers)}[/yellow]")
+    report_startup_profile()
+
+if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()  # The workers of --workers start this executable again
+    main()
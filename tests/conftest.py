@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# proxytest is a single script at the root of the repository, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import proxytest
+
+
+# Tests that run the servers stop them through the global stop event; clear it for the next test
+@pytest.fixture(autouse=True)
+def clear_stop_event():
+    yield
+    proxytest.stop_event.clear()
@@ -0,0 +1,135 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import proxytest
+from proxytest import AddressCache, dns_default_ttl, dns_min_ttl, dns_retry
+
+
+# Class to answer lookups from a table that the test changes; a missing name fails like the resolver
+class FakeResolver:
+    def __init__(self):
+        self.answers = {}  # hostname -> (addresses, ttl)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, hostname):
+        with self.lock:
+            self.calls.append(hostname)
+            if hostname not in self.answers:
+                raise socket.gaierror(socket.EAI_AGAIN, "Temporary failure in name resolution")
+            addresses, ttl = self.answers[hostname]
+            return list(addresses), ttl
+
+
+# Class of a monotonic clock that only moves when the test advances it
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+# Function to wait for a condition the cache thread makes true
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def resolver():
+    return FakeResolver()
+
+
+@pytest.fixture
+def cache(resolver, clock):
+    cache = AddressCache(resolver, clock)
+    yield cache
+    proxytest.stop_event.set()
+    cache.close(1.0)
+
+
+# Function to move the clock and wait until the cache thread has made the lookups that were due
+def advance(cache, resolver, clock, seconds, lookups):
+    clock.now += seconds
+    cache.wakeup.set()
+    wait_for(lambda: len(resolver.calls) >= lookups and not any(e['resolving'] for e in cache.entries.values()))
+    time.sleep(0.05)  # Nothing else may be due: a further lookup would show up here
+    assert len(resolver.calls) == lookups
+
+
+def test_answers_are_kept_for_their_ttl(cache, resolver, clock):
+    resolver.answers["proxy1.example"] = (["10.0.0.1"], 120)
+    resolver.answers["proxy2.example"] = (["10.0.0.2"], 5)      # Below dns_min_ttl
+    resolver.answers["proxy3.example"] = (["10.0.0.3"], None)   # No TTL in the answer
+    for hostname in ("proxy1.example", "proxy2.example", "proxy3.example"):
+        cache.add(hostname)
+    advance(cache, resolver, clock, 0, 3)
+    assert cache.get("proxy1.example") == ("10.0.0.1",)
+    expires = {hostname: entry['expires'] - clock.now for hostname, entry in cache.entries.items()}
+    assert expires == {"proxy1.example": 120, "proxy2.example": dns_min_ttl, "proxy3.example": dns_default_ttl}
+    advance(cache, resolver, clock, dns_min_ttl - 1, 3)
+    advance(cache, resolver, clock, 1, 4)
+    assert resolver.calls[-1] == "proxy2.example"
+    advance(cache, resolver, clock, 120 - dns_min_ttl, 6)
+    assert sorted(resolver.calls[-2:]) == ["proxy1.example", "proxy2.example"]
+
+
+def test_last_addresses_are_kept_while_the_name_fails(cache, resolver, clock):
+    resolver.answers["proxy1.example"] = (["10.0.0.1", "10.0.0.2"], 60)
+    cache.add("proxy1.example")
+    advance(cache, resolver, clock, 0, 1)
+    del resolver.answers["proxy1.example"]
+    # Failed lookups are retried after dns_retry seconds, doubling, and the old answer stays in use
+    advance(cache, resolver, clock, 60, 2)
+    assert cache.get("proxy1.example") == ("10.0.0.1", "10.0.0.2")
+    advance(cache, resolver, clock, dns_retry - 1, 2)
+    advance(cache, resolver, clock, 1, 3)
+    advance(cache, resolver, clock, 2 * dns_retry, 4)
+    assert cache.entries["proxy1.example"]['retry'] == 8 * dns_retry
+    assert cache.get("proxy1.example") == ("10.0.0.1", "10.0.0.2")
+    resolver.answers["proxy1.example"] = (["10.0.0.2"], 60)
+    advance(cache, resolver, clock, 4 * dns_retry, 5)
+    assert cache.get("proxy1.example") == ("10.0.0.2",)
+    assert cache.entries["proxy1.example"]['retry'] == dns_retry
+
+
+def test_discovered_addresses_are_used_until_the_first_answer(cache, resolver, clock):
+    cache.add("proxy1.example", ["10.0.0.9", "10.0.0.5", "10.0.0.1"])
+    assert cache.get("proxy1.example") == ("10.0.0.9", "10.0.0.1", "10.0.0.5")
+    assert cache.get("proxy2.example") == ()
+    advance(cache, resolver, clock, 0, 1)  # The check fails: the discovered addresses stay
+    assert cache.get("proxy1.example") == ("10.0.0.9", "10.0.0.1", "10.0.0.5")
+
+
+def test_listeners_hear_of_address_changes_only(cache, resolver, clock):
+    changes = []
+    resolver.answers["proxy1.example"] = (["10.0.0.1", "10.0.0.2"], 60)
+    cache.add("proxy1.example", listener=lambda hostname, addresses: changes.append((hostname, addresses)))
+    assert changes == []  # Nothing known yet
+    advance(cache, resolver, clock, 0, 1)
+    assert changes == [("proxy1.example", ("10.0.0.1", "10.0.0.2"))]
+    # A round-robin answer in another order is no change, and the primary address stays first
+    resolver.answers["proxy1.example"] = (["10.0.0.2", "10.0.0.1"], 60)
+    advance(cache, resolver, clock, 60, 2)
+    assert len(changes) == 1
+    resolver.answers["proxy1.example"] = (["10.0.0.3", "10.0.0.2"], 60)
+    advance(cache, resolver, clock, 60, 3)
+    assert changes[-1] == ("proxy1.example", ("10.0.0.3", "10.0.0.2"))  # The primary is gone: the first answer
+    resolver.answers["proxy1.example"] = (["10.0.0.4"], 60)
+    advance(cache, resolver, clock, 60, 4)
+    assert changes[-1] == ("proxy1.example", ("10.0.0.4",))
+    # A listener added later is told the current addresses right away
+    late = []
+    cache.add("proxy1.example", listener=lambda hostname, addresses: late.append(addresses))
+    assert late == [("10.0.0.4",)] and len(changes) == 3
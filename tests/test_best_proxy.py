@@ -0,0 +1,41 @@
+import proxytest
+from proxytest import choose_best_proxy
+
+
+def results(**scores):
+    return [{"Proxy": hostname, "Score": score} for hostname, score in scores.items()]
+
+
+def test_nothing_is_chosen_during_the_initial_analysis():
+    assert choose_best_proxy(results(a=10.0), None, None, 20, margin=0.1, dwell=15) == (None, None)
+
+
+def test_first_choice_is_the_lowest_score():
+    assert choose_best_proxy(results(a=100.0, b=80.0, c=None), None, None, 30, margin=0.1, dwell=15) == ("b", 30)
+
+
+def test_no_switch_inside_the_margin():
+    # b is 5% better than the current best, less than the 10% margin
+    assert choose_best_proxy(results(a=100.0, b=95.0), "a", 30, 100, margin=0.1, dwell=15) == ("a", 30)
+
+
+def test_switch_after_the_dwell_time():
+    # b is clearly better, but a was only chosen 10 s ago
+    assert choose_best_proxy(results(a=100.0, b=50.0), "a", 40, 50, margin=0.1, dwell=15) == ("a", 40)
+    assert choose_best_proxy(results(a=100.0, b=50.0), "a", 40, 55, margin=0.1, dwell=15) == ("b", 55)
+
+
+def test_immediate_switch_when_the_current_best_disappears():
+    # Within the dwell time and with a worse score, the replacement is still taken at once
+    assert choose_best_proxy(results(b=120.0), "a", 40, 41, margin=0.1, dwell=15) == ("b", 41)
+    assert choose_best_proxy(results(a=None, b=120.0), "a", 40, 41, margin=0.1, dwell=15) == ("b", 41)
+
+
+def test_no_choice_without_scores():
+    assert choose_best_proxy(results(a=None), "a", 40, 41, margin=0.1, dwell=15) == (None, 41)
+
+
+def test_defaults_come_from_the_module_settings(monkeypatch):
+    monkeypatch.setattr(proxytest, 'switch_margin', 0.0)
+    monkeypatch.setattr(proxytest, 'switch_dwell', 0.0)
+    assert choose_best_proxy(results(a=100.0, b=99.0), "a", 30, 31) == ("b", 31)
@@ -0,0 +1,55 @@
+import json
+import socket
+import threading
+import time
+import urllib.request
+
+import pytest
+
+import proxytest
+from proxytest import AgentUplink
+
+
+# Function to get a port nothing listens on, for servers that only print the port they bound
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def aggregator():
+    agent_address, metrics_address = ('127.0.0.1', free_port()), ('127.0.0.1', free_port())
+    thread = threading.Thread(target=proxytest.run_aggregator, args=(agent_address, metrics_address), daemon=True)
+    thread.start()
+    yield agent_address, metrics_address
+    proxytest.stop_event.set()
+    thread.join(5)
+
+
+def test_agent_batch_is_acked_and_ranked(aggregator, monkeypatch):
+    agent_address, metrics_address = aggregator
+    monkeypatch.setattr(proxytest, 'fleet_recommendation', None)
+    uplink = AgentUplink(agent_address, "site-a", batch_interval=0.1)
+    uplink.start()
+    try:
+        # The aggregator ranks once per second, so samples keep coming until a reply recommends a proxy
+        deadline = time.monotonic() + 10
+        while proxytest.fleet_recommendation is None or proxytest.fleet_recommendation["site"] is None:
+            assert time.monotonic() < deadline
+            now = time.time()
+            for rtt in (20.0, 21.0, 22.0):
+                uplink.add("fast.example", "", now, rtt)
+            for rtt in (80.0, 85.0, None, 90.0):
+                uplink.add("slow.example", "", now, rtt)
+            time.sleep(0.2)
+        assert uplink.sequence >= 1 and uplink.connected
+        assert proxytest.fleet_recommendation == {"site": "fast.example", "fleet": "fast.example"}
+    finally:
+        uplink.close()
+    with urllib.request.urlopen(f"http://{metrics_address[0]}:{metrics_address[1]}/results", timeout=5) as reply:
+        rankings = json.load(reply)
+    assert [result["Proxy"] for result in rankings["sites"]["site-a"]] == ["fast.example", "slow.example"]
+    assert [result["Proxy"] for result in rankings["fleet"]] == ["fast.example", "slow.example"]
+    assert rankings["fleet"][0]["PacketLoss"] == 0 and rankings["fleet"][1]["PacketLoss"] > 0
+    assert uplink.agent_id in rankings["agents"]
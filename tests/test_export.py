@@ -0,0 +1,101 @@
+import json
+import time
+from array import array
+
+import pytest
+
+import proxytest
+from proxytest import ResultExporter, load_recorded_samples, read_pxt_samples, write_pxt
+
+# Raw series as iter_raw_samples yields them: (target, hop, timestamps, rtts, lost)
+series = [
+    ("proxy1.example", "", [100.0, 101.0, 102.0], [20.5, 0.0, 21.25], [0, 1, 0]),
+    ("proxy1.example", "tcp:5121", [100.5, 101.5], [30.0, 31.5], [0, 0]),
+    ("proxy1.example", "10.0.0.1", [100.0, 101.0], [1.0, 1.5], [0, 0]),
+    ("proxy1.example", "10.0.0.2", [100.0], [0.0], [1]),
+    ("proxy2.example", "", [100.25, 101.25], [40.0, 0.0], [0, 1]),
+]
+
+expected_samples = [
+    (100.0, "proxy1.example", "", 20.5),
+    (100.25, "proxy2.example", "", 40.0),
+    (100.5, "proxy1.example", "tcp:5121", 30.0),
+    (101.0, "proxy1.example", "", None),
+    (101.25, "proxy2.example", "", None),
+    (101.5, "proxy1.example", "tcp:5121", 31.5),
+    (102.0, "proxy1.example", "", 21.25),
+]
+
+
+# Function to yield fresh copies of the series, as the exporters may modify the arrays they get
+def raw_samples():
+    for target, hop, timestamps, values, lost in series:
+        yield target, hop, array('d', timestamps), array('f', values), bytearray(lost)
+
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    monkeypatch.setattr(proxytest, 'iter_raw_samples', raw_samples)
+    return {
+        "timestamp": 1760000000.0,
+        "results": [{"Proxy": "proxy1.example", "AvgPing": 20.875, "PacketLoss": 33.3},
+                    {"Proxy": "proxy2.example", "AvgPing": 40.0, "PacketLoss": 50.0}],
+        "best_proxy": "proxy1.example",
+        "traceroute": {"output": "", "paths": {"proxy1.example": [{"Hop": 1, "IP": "10.0.0.1", "AvgPing": 1.25}]}},
+    }
+
+
+# Function to export the snapshot in the given formats, returns the path of the files without extension
+def export(snapshot, directory, formats):
+    ResultExporter(formats=formats, directory=str(directory)).write(snapshot)
+    stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(snapshot["timestamp"]))
+    return str(directory / f"resultados_proxies_{stamp}")
+
+
+@pytest.mark.parametrize("suffix", [".jsonl", "_amostras.csv", ".pxt"])
+def test_replay_reads_every_export_format(snapshot, tmp_path, suffix):
+    samples, hops = load_recorded_samples(export(snapshot, tmp_path, ("jsonl", "csv", "pxt")) + suffix)
+    assert [tuple(sample) for sample in samples] == expected_samples
+    assert hops == {"proxy1.example": 2}
+
+
+@pytest.mark.parametrize("suffix", [".csv", "_saltos.csv"])
+def test_replay_rejects_the_csv_files_without_samples(snapshot, tmp_path, suffix):
+    path = export(snapshot, tmp_path, ("csv",)) + suffix
+    with pytest.raises(ValueError, match="_amostras.csv"):
+        load_recorded_samples(path)
+
+
+def test_replay_command_names_the_samples_file(snapshot, tmp_path, capsys):
+    base = export(snapshot, tmp_path, ("csv",))
+    with pytest.raises(SystemExit) as error:
+        proxytest.main(["--replay", base + ".csv"])
+    assert error.value.code == 2
+    assert base + "_amostras.csv" in capsys.readouterr().err
+
+
+def test_pxt_round_trip(snapshot, tmp_path):
+    path = str(tmp_path / "dump.pxt")
+    write_pxt(path, snapshot)
+    with open(path, 'rb') as f:
+        samples = list(read_pxt_samples(f, path))
+    assert samples == [(ts, target, hop, None if missing else rtt)
+                       for target, hop, timestamps, values, lost in series
+                       for ts, rtt, missing in zip(timestamps, values, lost)]
+    with open(path, 'rb') as f:
+        f.read(1)
+        with pytest.raises(ValueError):
+            list(read_pxt_samples(f, path))
+
+
+def test_jsonl_summarizes_every_series(snapshot, tmp_path):
+    with open(export(snapshot, tmp_path, ("jsonl",)) + ".jsonl", encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    summaries = {(record["target"], record["hop"]): record for record in records if record["type"] == "series"}
+    assert list(summaries) == [(target, hop) for target, hop, *_ in series]
+    icmp = summaries[("proxy1.example", "")]
+    assert (icmp["Total"], icmp["AvgPing"], icmp["MinPing"], icmp["MaxPing"]) == (3, 20.875, 20.5, 21.25)
+    assert icmp["PacketLoss"] == pytest.approx(100 / 3)
+    assert icmp["Jitter"] == pytest.approx(0.5303300858899106)
+    silent = summaries[("proxy1.example", "10.0.0.2")]
+    assert (silent["PacketLoss"], silent["AvgPing"], silent["Jitter"]) == (100.0, None, None)
@@ -0,0 +1,72 @@
+import pytest
+
+import proxytest
+from proxytest import FakeNetwork
+
+paths = {
+    "proxy1.example": [("192.168.0.1", 1.0, 0.0), ("100.64.0.1", 4.0, 0.0), ("10.0.0.1", 10.0, 0.0),
+                       ("172.16.0.10", 14.0, 0.0)],
+    "proxy1.example#2": [("192.168.0.1", 1.0, 0.0), ("10.1.1.1", 13.0, 0.0), ("172.16.1.20", 24.0, 0.0)],
+}
+
+
+@pytest.fixture
+def network(monkeypatch):
+    network = FakeNetwork(paths)
+    monkeypatch.setattr(proxytest, 'prober', network)
+    return network
+
+
+def probe(network, ip, ttl=None):
+    replies = []
+    network.send_probe(ip, ttl, lambda *reply: replies.append(reply), 1.0)
+    assert len(replies) == 1
+    return replies[0]
+
+
+def test_resolve(network):
+    assert network.resolve("proxy1.example") == ["172.16.0.10", "172.16.1.20"]
+    assert network.resolve("10.0.0.1") == ["10.0.0.1"]
+    with pytest.raises(OSError):
+        network.resolve("unknown.example")
+
+
+def test_probe_reaches_the_destination(network):
+    responder, rtt, reached, reply_ttl = probe(network, "172.16.0.10")
+    assert (responder, reached, reply_ttl) == ("172.16.0.10", True, 61)
+    assert 0 < rtt < 1000
+
+
+def test_probe_expires_on_the_way(network):
+    responder, rtt, reached, reply_ttl = probe(network, "172.16.0.10", ttl=2)
+    assert (responder, reached, reply_ttl) == ("100.64.0.1", False, 63)
+    assert probe(network, "203.0.113.1") == (None, None, False, None)
+
+
+def test_lossy_hop_drops_every_probe():
+    network = FakeNetwork({"lost.example": [("192.168.0.1", 1.0, 0.0), ("10.9.9.9", 5.0, 1.0)]})
+    assert probe(network, "10.9.9.9") == (None, None, False, None)
+    assert probe(network, "10.9.9.9", ttl=1)[0] == "192.168.0.1"
+
+
+def test_trace_path(network):
+    assert proxytest.trace_path("172.16.0.10", 0.5) == {
+        1: ("192.168.0.1", False),
+        2: ("100.64.0.1", False),
+        3: ("10.0.0.1", False),
+        **{ttl: ("172.16.0.10", True) for ttl in range(4, proxytest.max_hops + 1)},
+    }
+
+
+def test_hop_count(network, monkeypatch):
+    cache = proxytest.AddressCache()
+    monkeypatch.setattr(proxytest, 'address_cache', cache)
+    cache.add("proxy1.example", ["172.16.0.10"])
+    assert proxytest.get_number_of_hops("proxy1.example") == 4
+    assert proxytest.get_number_of_hops("unknown.example") is None
+
+
+def test_hop_count_of_a_host_missing_from_the_address_cache(network):
+    assert proxytest.proxy_address("proxy1.example") is None
+    assert proxytest.get_number_of_hops("proxy1.example") == 4
+    assert proxytest.get_number_of_hops("unknown.example") is None
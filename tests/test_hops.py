@@ -0,0 +1,22 @@
+import pytest
+
+from proxytest import infer_hops
+
+
+@pytest.mark.parametrize("reply_ttl, hops", [
+    (64, 1), (57, 8), (35, 30),        # Linux, macOS and most routers
+    (128, 1), (121, 8), (99, 30),      # Windows
+    (255, 1), (248, 8), (226, 30),     # Network equipment, Solaris
+])
+def test_hops_from_the_standard_initial_ttls(reply_ttl, hops):
+    assert infer_hops(reply_ttl) == hops
+
+
+@pytest.mark.parametrize("reply_ttl", [
+    None, 0, -1,            # No reply TTL (TCP fallback) or a bogus one
+    34, 98, 225,            # More than max_hops from the initial TTL
+    65, 200,                # Between two initial TTLs, far from the upper one
+    256, 1000,              # Beyond any IPv4 TTL
+])
+def test_untrusted_ttls_give_no_estimate(reply_ttl):
+    assert infer_hops(reply_ttl) is None
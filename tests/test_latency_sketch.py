@@ -0,0 +1,64 @@
+import math
+import random
+
+import pytest
+
+from proxytest import LatencySketch
+
+quantiles = (0.5, 0.9, 0.95, 0.99)
+
+
+# Function to get a percentile by nearest rank, the definition the sketch approximates
+def reference_percentile(values, q):
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def check(sketch, values):
+    assert sketch.count == len(values)
+    for q in quantiles:
+        # The histogram buckets are 5% wide, so the estimate is within 5% of the true value
+        assert sketch.percentile(q) == pytest.approx(reference_percentile(values, q), rel=0.05), q
+
+
+def test_session_percentiles_match_a_sorted_reference():
+    rng = random.Random(4)
+    sketch = LatencySketch()
+    values = []
+    for i in range(5000):
+        rtt = rng.lognormvariate(3.5, 0.6)
+        sketch.add(float(i), rtt)
+        values.append(rtt)
+    sketch.add(5000.0, None)  # Losses are not latencies
+    check(sketch, values)
+
+
+def test_sliding_percentiles_match_a_sorted_reference():
+    rng = random.Random(5)
+    sketch = LatencySketch(10, slices=10)
+    samples = []
+    now = 0.0
+    for _ in range(3000):
+        now += rng.uniform(0.01, 0.1)
+        rtt = rng.uniform(5, 60) if rng.random() < 0.9 else rng.uniform(100, 400)
+        sketch.add(now, rtt)
+        samples.append((now, rtt))
+        if len(samples) % 100 == 0:
+            sketch.expire(now)
+            # Whole slices leave the window: those that ended more than 10 s ago
+            check(sketch, [rtt for ts, rtt in samples if ts - ts % 1 + 1 > now - 10])
+
+
+def test_expired_slices_drop_out():
+    sketch = LatencySketch(10, slices=10)
+    for i in range(50):
+        sketch.add(i * 0.1, 500.0)       # A spike during the first 5 s
+    for i in range(100):
+        sketch.add(20 + i * 0.1, 20.0)   # Then 10 s of steady latency
+    sketch.expire(30.0)
+    assert sketch.count == 100
+    assert sketch.percentile(0.99) == pytest.approx(20.0, rel=0.05)
+    assert len(sketch.slices) == 10
+    sketch.expire(60.0)
+    assert (sketch.count, sketch.histogram, len(sketch.slices)) == (0, {}, 0)
+    assert sketch.percentile(0.5) is None
@@ -0,0 +1,37 @@
+import socket
+import time
+
+import pytest
+
+from proxytest import LoadGenerator, LoadSink
+
+
+@pytest.fixture
+def sink():
+    sink = LoadSink(('127.0.0.1', 0))
+    sink.start()
+    yield sink
+    sink.close()
+
+
+def wait_received(sink, count):
+    deadline = time.monotonic() + 5
+    while sink.received < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return sink.received
+
+
+def test_sink_counts_the_bytes_it_discards(sink):
+    with socket.create_connection(sink.server_address, timeout=5) as client:
+        client.sendall(b'x' * 300000)
+    assert wait_received(sink, 300000) == 300000
+
+
+def test_generator_upload_reaches_the_sink(sink):
+    generator = LoadGenerator(sink.server_address, rate=8.0, on=0.5, off=0, connections=2)
+    generator.upload()
+    assert generator.error is None
+    assert generator.period[1] is not None and not generator.loaded
+    # 8 Mbit/s for half a second: about 500 kB, paced by the token bucket
+    assert 200000 <= generator.sent <= 600000
+    assert wait_received(sink, generator.sent) == generator.sent
@@ -0,0 +1,152 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import proxytest
+from benchmark import FAKE_PING
+from proxytest import PingStream, PingStreams
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="the stream backend reads sequence numbers on Unix")
+
+# Fake ping that answers three times and exits, like a ping killed by a network change
+SHORT_PING = '''#!{python}
+import sys, time
+host = sys.argv[-1]
+for seq in range(1, 4):
+    print(f"64 bytes from {{host}}: icmp_seq={{seq}} ttl=58 time=10.000 ms", flush=True)
+    time.sleep(0.02)
+'''
+
+
+@pytest.fixture
+def streams():
+    # Stopped right away: the tests drive the parser and the sweep themselves
+    streams = PingStreams(timeout=0.2)
+    streams.close()
+    return streams
+
+
+def new_stream(interval=0.05):
+    samples = []
+    stream = PingStream("10.0.0.1", interval, lambda timestamp, rtt, reply_ttl: samples.append((timestamp, rtt, reply_ttl)))
+    stream.process = object()  # Only checked for None by handle_line
+    stream.started = time.time()
+    return stream, samples
+
+
+def reply(sequence, rtt=10.0):
+    return f"64 bytes from 10.0.0.1: icmp_seq={sequence} ttl=58 time={rtt:.3f} ms".encode()
+
+
+def test_sequence_gap_is_counted_as_loss_after_the_timeout(streams):
+    stream, samples = new_stream()
+    # Replies come in when ping prints them, one interval apart
+    for sequence in (1, 2, 4):
+        time.sleep(max(0, stream.started + (sequence - 1) * 0.05 + 0.01 - time.time()))
+        streams.handle_line(stream, reply(sequence, 10.0))
+    # 4 waits for 3, which may still arrive until its timeout passes
+    assert [rtt for _, rtt, _ in samples] == [10.0, 10.0]
+    time.sleep(0.2 + 0.05 + 0.05)
+    streams.sweep(stream)
+    # Sequence numbers after 4 were never answered either
+    assert [rtt for _, rtt, _ in samples[:4]] == [10.0, 10.0, None, 10.0]
+    assert [reply_ttl for _, _, reply_ttl in samples[:4]] == [58, 58, None, 58]
+    assert all(rtt is None for _, rtt, _ in samples[4:])
+    timestamps = [timestamp for timestamp, _, _ in samples]
+    # Send times follow the interval, re-anchored on each reply by a few milliseconds at most
+    assert all(b - a == pytest.approx(0.05, abs=0.01) for a, b in zip(timestamps, timestamps[1:]))
+    # A reply for a sequence number already counted as lost is ignored
+    count = len(samples)
+    streams.handle_line(stream, reply(3))
+    assert len(samples) == count
+
+
+def test_stalled_ping_is_swept_as_losses(streams):
+    stream, samples = new_stream()
+    streams.handle_line(stream, reply(1))
+    time.sleep(0.5)
+    streams.sweep(stream)
+    # Sequence numbers sent more than timeout + interval ago: about (0.5 - 0.25) / 0.05 of them
+    assert samples[0][1] == 10.0
+    assert 3 <= len(samples) - 1 <= 6
+    assert all(rtt is None for _, rtt, _ in samples[1:])
+    assert stream.next_sequence == len(samples) + 1
+
+
+def test_exit_settles_pending_replies_and_backs_off(streams):
+    stream, samples = new_stream()
+    streams.handle_line(stream, reply(1))
+    streams.handle_line(stream, reply(3))
+    stream.process = None
+    streams.exited(stream)
+    # 3 was waiting for 2, which will never come now
+    assert [rtt for _, rtt, _ in samples] == [10.0, None, 10.0]
+    backoffs = []
+    for _ in range(8):
+        restart_in = stream.restart_at - time.monotonic()
+        backoffs.append(round(restart_in))
+        streams.exited(stream)
+    assert backoffs == [1, 2, 4, 8, 16, 32, 60, 60]
+
+
+def test_backoff_resets_after_a_long_run(streams):
+    stream, samples = new_stream()
+    stream.backoff = 32.0
+    stream.process = subprocess.Popen([sys.executable, '-c', ''], stdout=subprocess.PIPE)
+    streams.selector.register(stream.process.stdout, proxytest.selectors.EVENT_READ, stream)
+    stream.spawned = time.monotonic() - proxytest.stream_restart_max - 1
+    streams.exited(stream)
+    assert stream.process is None
+    assert stream.restart_at - time.monotonic() == pytest.approx(1.0, abs=0.1)
+    assert stream.backoff == 2.0
+
+
+# Function to write a fake ping executable to a directory put first on PATH
+@pytest.fixture
+def fake_ping(tmp_path, monkeypatch):
+    def install(script):
+        path = tmp_path / "ping"
+        path.write_text(script.format(python=sys.executable))
+        path.chmod(0o755)
+    monkeypatch.setenv('PATH', str(tmp_path) + os.pathsep + os.environ.get('PATH', ''))
+    return install
+
+
+def collect(key, interval, seconds):
+    samples = []
+    lock = threading.Lock()
+
+    def callback(timestamp, rtt, reply_ttl):
+        with lock:
+            samples.append((timestamp, rtt, reply_ttl))
+
+    streams = PingStreams(timeout=0.2)
+    try:
+        streams.start(key, "10.0.0.1", interval, callback)
+        time.sleep(seconds)
+        stream = streams.streams[key]
+    finally:
+        streams.close()
+    return stream, samples
+
+
+def test_benchmark_fake_ping_streams_in_order(fake_ping):
+    fake_ping(FAKE_PING)
+    stream, samples = collect("proxy", 0.02, 1.5)
+    # Every sequence number is delivered once, in order, replies or losses (about 1% skipped)
+    assert len(samples) >= 30
+    assert [timestamp for timestamp, _, _ in samples] == sorted(timestamp for timestamp, _, _ in samples)
+    assert sum(1 for _, rtt, _ in samples if rtt is not None) >= 0.9 * len(samples)
+    assert all(reply_ttl == 58 for _, rtt, reply_ttl in samples if rtt is not None)
+
+
+def test_exited_ping_is_restarted_with_backoff(fake_ping):
+    fake_ping(SHORT_PING)
+    stream, samples = collect("proxy", 0.02, 1.6)
+    # Started, exited after three replies, restarted one second later, exited again
+    assert [rtt for _, rtt, _ in samples] == [10.0] * 6
+    assert stream.backoff == 4.0
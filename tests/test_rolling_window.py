@@ -0,0 +1,74 @@
+import random
+import statistics
+from array import array
+
+import pytest
+
+from proxytest import RollingWindow
+
+
+# Function to round a value to the float32 the window stores
+def stored(value):
+    return array('f', [value])[0]
+
+
+# Function to compute the expected statistics of the samples still in the window
+def reference(samples):
+    rtts = [value for _, value in samples if value is not None]
+    return {
+        "total": len(samples),
+        "count": len(rtts),
+        "lost": len(samples) - len(rtts),
+        "mean": statistics.fmean(rtts) if rtts else None,
+        "stdev": statistics.stdev(rtts) if len(rtts) > 1 else 0,
+        "min": min(rtts) if rtts else None,
+        "max": max(rtts) if rtts else None,
+        "packet_loss": (len(samples) - len(rtts)) / len(samples) * 100 if samples else None,
+    }
+
+
+def check(window, samples):
+    expected = reference(samples)
+    for name in ("total", "count", "lost", "min", "max"):
+        assert getattr(window, name) == expected[name], name
+    for name in ("mean", "stdev", "packet_loss"):
+        if expected[name] is None:
+            assert getattr(window, name) is None, name
+        else:
+            assert getattr(window, name) == pytest.approx(expected[name], rel=1e-6, abs=1e-9), name
+
+
+def test_capacity_eviction_matches_reference():
+    rng = random.Random(1)
+    window = RollingWindow(3600, capacity=50)
+    samples = []
+    for i in range(2000):
+        value = None if rng.random() < 0.1 else stored(rng.lognormvariate(3, 0.5))
+        window.add(float(i), value)
+        samples = (samples + [(float(i), value)])[-50:]
+        check(window, samples)
+
+
+def test_time_expiry_matches_reference():
+    rng = random.Random(2)
+    window = RollingWindow(10, capacity=1000)
+    samples = []
+    now = 0.0
+    for _ in range(1500):
+        now += rng.uniform(0.01, 0.5)
+        value = None if rng.random() < 0.05 else stored(rng.uniform(5, 200))
+        window.add(now, value)
+        samples.append((now, value))
+        window.expire(now)
+        samples = [(ts, v) for ts, v in samples if now - ts <= 10]
+        check(window, samples)
+
+
+def test_window_emptied_by_expiry():
+    window = RollingWindow(5, capacity=10)
+    for i in range(10):
+        window.add(float(i), stored(10.0 + i))
+    window.expire(100.0)
+    check(window, [])
+    window.add(101.0, stored(42.0))
+    check(window, [(101.0, stored(42.0))])
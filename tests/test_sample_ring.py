@@ -0,0 +1,48 @@
+import random
+from array import array
+
+import pytest
+
+from proxytest import SampleRing, sample_stats
+
+
+# Function to round a value to the float32 the ring stores
+def stored(value):
+    return array('f', [value])[0]
+
+
+def test_ring_keeps_the_newest_samples():
+    ring = SampleRing(16)
+    for i in range(40):
+        ring.append(float(i), None if i % 7 == 0 else stored(i * 1.5))
+    assert len(ring) == 16
+    assert ring.full()
+    assert [ring.timestamp_at(seq) for seq in range(ring.start, ring.end)] == [float(i) for i in range(24, 40)]
+    assert [ring.value_at(seq) for seq in range(ring.start, ring.end)] == \
+        [None if i % 7 == 0 else stored(i * 1.5) for i in range(24, 40)]
+
+
+def test_window_stats_match_reference():
+    rng = random.Random(3)
+    ring = SampleRing(64)
+    samples = []
+    for i in range(500):
+        value = None if rng.random() < 0.1 else stored(rng.uniform(1, 100))
+        ring.append(float(i), value)
+        samples = (samples + [(float(i), value)])[-64:]
+        since = float(i - rng.randrange(80))
+        selected = [v for ts, v in samples if ts >= since]
+        rtts = [v for v in selected if v is not None]
+        _, values, lost = ring.window(since)
+        stats = sample_stats(values, lost)
+        assert stats["Total"] == len(selected)
+        assert stats["PacketLoss"] == pytest.approx((len(selected) - len(rtts)) / len(selected) * 100)
+        if not rtts:
+            assert stats["AvgPing"] is None and stats["Jitter"] is None
+            continue
+        mean = sum(rtts) / len(rtts)
+        assert stats["AvgPing"] == pytest.approx(mean)
+        assert stats["MinPing"] == min(rtts)
+        assert stats["MaxPing"] == max(rtts)
+        stdev = (sum((v - mean) ** 2 for v in rtts) / (len(rtts) - 1)) ** 0.5 if len(rtts) > 1 else 0
+        assert stats["Jitter"] == pytest.approx(stdev)
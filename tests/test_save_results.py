@@ -0,0 +1,31 @@
+import proxytest
+from proxytest import save_results
+
+
+# Function to build a result as compute_results does for a proxy that only answers TCP connects
+def tcp_only_result(hostname):
+    result = dict.fromkeys(("AvgPing", "MinPing", "MaxPing", "Jitter", "JitterVariation", "P50", "P95", "P99",
+                            "P99Long", "P99Session", "Hops"))
+    result.update({"Proxy": hostname, "DisplayName": hostname.split('.')[0], "Description": "Proxy de teste",
+                   "PacketLoss": 100.0, "TcpAvgPing": 25.5, "TcpPacketLoss": 0.0, "Score": 40.5})
+    return result
+
+
+def test_tcp_only_proxy_is_saved_with_its_tcp_numbers(tmp_path, monkeypatch):
+    monkeypatch.setattr(proxytest, 'game_port', 5121)
+    path = tmp_path / "resultados.txt"
+    save_results([tcp_only_result("proxy1.example")], "proxy1.example", "traceroute\n", str(path))
+    text = path.read_text(encoding='utf-8')
+    assert "Nenhum dado disponível" not in text
+    assert "  Ping Médio: *\n" in text
+    assert "  Perda de Pacotes: 100.00%\n" in text
+    assert text.count("Conexão TCP :5121: 25.50 ms, 0.00% perda") == 2
+    assert "Score: 40.50\n" in text
+
+
+def test_proxy_without_any_data_is_reported_as_such(tmp_path):
+    result = tcp_only_result("proxy2.example")
+    result.update(TcpAvgPing=None, TcpPacketLoss=None, Score=None)
+    path = tmp_path / "resultados.txt"
+    save_results([result], None, "", str(path))
+    assert "  Erro: Nenhum dado disponível.\n" in path.read_text(encoding='utf-8')
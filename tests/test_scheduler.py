@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import defaultdict
+
+import pytest
+
+import proxytest
+from proxytest import FakeNetwork, ProbeScheduler, default_fake_paths
+
+hostnames = [f"proxy{i}.example" for i in range(10)]
+
+
+@pytest.fixture
+def network(monkeypatch):
+    # One address per proxy, so every proxy is a single probe target
+    paths = {name: path for name, path in default_fake_paths(hostnames).items() if '#' not in name}
+    network = FakeNetwork(paths)
+    monkeypatch.setattr(proxytest, 'prober', network)
+    monkeypatch.setattr(proxytest, 'address_cache', proxytest.AddressCache())
+    monkeypatch.setattr(proxytest, 'latest_results', ())
+    return network
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    # Send times of the probes recorded per proxy
+    probes = defaultdict(list)
+    lock = threading.Lock()
+
+    def record_probe(hostname, timestamp, ping_time, reply_ttl=None, probe_type="icmp"):
+        with lock:
+            probes[hostname].append(timestamp)
+    monkeypatch.setattr(proxytest, 'record_probe', record_probe)
+    return probes
+
+
+@pytest.fixture
+def scheduler_for(network):
+    schedulers = []
+
+    def start(rate):
+        schedulers.append(ProbeScheduler(rate, timeout=0.5))
+        return schedulers[-1]
+    yield start
+    # The scheduler thread runs until the global stop event
+    proxytest.stop_event.set()
+    for scheduler in schedulers:
+        scheduler.close(1.0)
+
+
+def intervals(timestamps):
+    return [b - a for a, b in zip(timestamps, timestamps[1:])]
+
+
+def test_probes_follow_fixed_deadlines(scheduler_for, probes):
+    scheduler = scheduler_for(50.0)
+    scheduler.add(*hostnames[:2])
+    time.sleep(2.2)
+    assert scheduler.scale == 1.0
+    for hostname in hostnames[:2]:
+        # First probe at resolution, then one every probe_interval (0.5 s)
+        assert len(probes[hostname]) in (4, 5)
+        assert all(gap == pytest.approx(proxytest.probe_interval, abs=0.05) for gap in intervals(probes[hostname]))
+
+
+def test_intervals_stretch_over_the_packet_budget(scheduler_for, probes):
+    # 10 proxies every 0.5 s want 20 packets per second, twice the budget
+    scheduler = scheduler_for(10.0)
+    scheduler.add(*hostnames)
+    assert scheduler.scale == pytest.approx(2.0)
+    time.sleep(2.2)
+    for hostname in hostnames:
+        assert len(probes[hostname]) in (2, 3)
+        assert all(gap == pytest.approx(2 * proxytest.probe_interval, abs=0.05) for gap in intervals(probes[hostname]))
+    sent = sum(len(timestamps) for timestamps in probes.values())
+    assert sent <= 10.0 * 2.2 + len(hostnames)
+
+
+def test_traces_reserve_part_of_the_budget(scheduler_for, probes):
+    scheduler = scheduler_for(10.0)
+    scheduler.add(*hostnames[:4])   # 8 packets per second
+    assert scheduler.scale == 1.0
+    scheduler.reserve("trace", 4.0)
+    assert scheduler.scale == pytest.approx(8 / 6)
+    # Traces never take more than 75% of the budget
+    scheduler.reserve("trace", 9.0)
+    assert scheduler.scale == pytest.approx(8 / 2.5)
+    scheduler.reserve("trace", 0)
+    assert scheduler.scale == 1.0
@@ -0,0 +1,32 @@
+import time
+
+import proxytest
+from proxytest import ShardPool, make_proxy
+
+hostnames = [f"proxy{i}.example" for i in range(6)]
+
+
+def test_two_workers_report_every_target(monkeypatch):
+    monkeypatch.setattr(proxytest, 'proxies', [make_proxy(hostname) for hostname in hostnames])
+    pool = ShardPool(2, {
+        "ping_backend": "native", "max_probe_rate": 25.0, "game_port": None,
+        "probe_weights": proxytest.probe_weights, "score_weights": proxytest.score_weights,
+        "candidates": hostnames, "fake_network": True, "fake_paths": hostnames})
+    pool.start()
+    try:
+        pool.add([(hostname, None) for hostname in hostnames])
+        # Both workers got targets, and the coordinator sees the snapshots of both
+        assert all(shard['targets'] for shard in pool.shards)
+        deadline = time.monotonic() + 30
+        while True:
+            results = pool.results()
+            if len(results) == len(hostnames) and all(result['AvgPing'] is not None for result in results):
+                break
+            assert time.monotonic() < deadline
+            time.sleep(0.2)
+    finally:
+        pool.close(proxytest.shard_exit * 2 + 1)
+    assert [result['Proxy'] for result in results] == hostnames
+    assert all(result['Score'] is not None and result['Hops'] == 7 for result in results)
+    assert not pool.thread.is_alive()
+    assert not any(shard['process'].is_alive() for shard in pool.shards)
@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+from proxytest import RollupBucket, SampleStore, open_store, query_store, rollup_grace
+
+start = 1700002800.0  # On an hour boundary, so every resolution's buckets start here
+
+
+@pytest.fixture
+def conn():
+    conn = open_store(":memory:")
+    yield conn
+    conn.close()
+
+
+# Function to read a rollup of the store back as a bucket
+def rollup(conn, resolution, bucket_start, target="proxy1.example", hop=''):
+    row = conn.execute("SELECT count, lost, total, total_squares, min, max, histogram FROM rollups "
+                       "WHERE resolution = ? AND target = ? AND hop = ? AND bucket_start = ?",
+                       (resolution, target, hop, bucket_start)).fetchone()
+    return RollupBucket.from_row(row) if row is not None else None
+
+
+# Function to build the bucket of a list of samples in one go
+def reference(samples):
+    bucket = RollupBucket()
+    for _, _, _, rtt in samples:
+        bucket.add(rtt)
+    return bucket
+
+
+def assert_same_statistics(bucket, expected):
+    assert bucket.statistics() == pytest.approx(expected.statistics())
+    assert bucket.histogram == expected.histogram
+
+
+def test_late_samples_merge_into_flushed_buckets(conn):
+    rng = random.Random(1)
+    early = [("proxy1.example", '', start + 0.1 * i, rng.uniform(10, 40)) for i in range(5)] + \
+            [("proxy1.example", '', start + 0.6, None)]
+    late = [("proxy1.example", '', start + 0.8, 55.0), ("proxy1.example", '', start + 0.9, None)]
+    store = SampleStore(":memory:")
+    # The 1 s bucket closes rollup_grace after its end; the 60 s one is still open
+    store.write(conn, early, start + 1 + rollup_grace)
+    assert_same_statistics(rollup(conn, 1, start), reference(early))
+    assert rollup(conn, 60, start) is None
+    # Late samples reopen the 1 s bucket and are merged with the row already written
+    store.write(conn, late, start + 30)
+    assert_same_statistics(rollup(conn, 1, start), reference(early + late))
+    assert not any(key[0] == 1 for key in store.open_buckets)
+    store.write(conn, [], start + 60 + rollup_grace)
+    assert_same_statistics(rollup(conn, 60, start), reference(early + late))
+    store.write(conn, [], start + 90, force=True)
+    assert_same_statistics(rollup(conn, 3600, start), reference(early + late))
+    assert not store.open_buckets
+    assert conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0] == len(early + late)
+
+
+def test_buckets_flushed_by_several_runs_are_merged(conn):
+    first = [("proxy1.example", '', start + 5, 20.0), ("proxy1.example", '', start + 65, 22.0)]
+    second = [("proxy1.example", '', start + 10, 30.0), ("proxy1.example", '', start + 70, None)]
+    # Each shutdown forces its open buckets out; the next run adds to the same minute and hour
+    SampleStore(":memory:").write(conn, first, start + 80, force=True)
+    SampleStore(":memory:").write(conn, second, start + 90, force=True)
+    assert_same_statistics(rollup(conn, 60, start), reference(first[:1] + second[:1]))
+    assert_same_statistics(rollup(conn, 60, start + 60), reference(first[1:] + second[1:]))
+    hour = rollup(conn, 3600, start)
+    assert_same_statistics(hour, reference(first + second))
+    assert (hour.count, hour.lost, hour.min, hour.max) == (3, 1, 20.0, 30.0)
+
+
+def test_query_reads_the_resolution_of_the_span(conn):
+    # One sample every 10 s for seven hours, every tenth one lost
+    samples = [("proxy1.example", '', start + 10 * i, None if i % 10 == 9 else 20.0 + i % 7) for i in range(7 * 360)]
+    samples.append(("proxy1.example", '192.168.0.1', start, 1.0))
+    SampleStore(":memory:").write(conn, samples, start + 7 * 3600, force=True)
+    for span, resolution in ((60, 1), (599, 1), (600, 60), (6 * 3600 - 1, 60), (6 * 3600, 3600), (7 * 3600, 3600)):
+        result = query_store("proxy1.example", start, start + span, conn=conn)
+        # Whole buckets are read, so the count is the samples of every bucket the span touches
+        read = min(-(-span // resolution) * resolution, 7 * 3600)
+        assert result["Resolution"] == resolution
+        assert result["Samples"] == -(-read // 10)
+        assert result["PacketLoss"] == pytest.approx(100 * (result["Samples"] // 10) / result["Samples"])
+    hop = query_store("proxy1.example", start, start + 60, hop='192.168.0.1', conn=conn)
+    assert (hop["Samples"], hop["AvgPing"]) == (1, 1.0)
+    assert query_store("proxy2.example", start, start + 60, conn=conn)["Samples"] == 0
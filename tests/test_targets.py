@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from proxytest import load_targets
+
+
+def test_text_list_skips_comments_and_duplicates(tmp_path):
+    path = tmp_path / "alvos.txt"
+    path.write_text("# Proxies de teste\n"
+                    "proxy1.example Proxy Um  # o primeiro\n"
+                    "\n"
+                    "   # indentado\n"
+                    "proxy2.example\n"
+                    "proxy1.example Repetido\n", encoding='utf-8')
+    assert load_targets(str(path)) == [{"hostname": "proxy1.example", "display_name": "Proxy Um"},
+                                       {"hostname": "proxy2.example", "display_name": None}]
+
+
+def test_json_list_of_hostnames_and_objects(tmp_path):
+    path = tmp_path / "alvos.JSON"
+    path.write_text(json.dumps(["proxy1.example",
+                                {"hostname": " proxy2.example ", "display_name": "Dois", "description": "Segundo"},
+                                {"hostname": "proxy1.example", "display_name": "Repetido"}]), encoding='utf-8')
+    assert load_targets(str(path)) == [
+        {"hostname": "proxy1.example"},
+        {"hostname": " proxy2.example ", "display_name": "Dois", "description": "Segundo"}]
+
+
+@pytest.mark.parametrize("items", [[{"display_name": "Sem nome"}], [{"hostname": "  "}], [42]])
+def test_json_target_without_hostname_is_rejected(tmp_path, items):
+    path = tmp_path / "alvos.json"
+    path.write_text(json.dumps(["proxy1.example"] + items), encoding='utf-8')
+    with pytest.raises(ValueError, match="alvo sem hostname"):
+        load_targets(str(path))
+
+
+@pytest.mark.parametrize("name, text, message", [
+    ("alvos.json", '{"hostname": "proxy1.example"}', "lista de alvos"),
+    ("alvos.json", "[]", "nenhum alvo"),
+    ("alvos.txt", "# só comentários\n\n", "nenhum alvo"),
+])
+def test_empty_or_malformed_list_is_rejected(tmp_path, name, text, message):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    with pytest.raises(ValueError, match=message):
+        load_targets(str(path))
@@ -0,0 +1,45 @@
+import socket
+import threading
+
+import pytest
+
+from proxytest import TcpConnector
+
+
+@pytest.fixture
+def connector():
+    connector = TcpConnector()
+    yield connector
+    connector.close()
+    connector.thread.join(1)
+
+
+def connect(connector, port):
+    done = threading.Event()
+    results = []
+
+    def callback(rtt):
+        results.append(rtt)
+        done.set()
+
+    connector.connect('127.0.0.1', port, callback, timeout=2.0)
+    assert done.wait(5)
+    return results[0]
+
+
+def test_connect_to_a_listener(connector):
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        rtt = connect(connector, listener.getsockname()[1])
+    assert rtt is not None and 0 <= rtt < 2000
+
+
+def test_refused_connection_counts_as_an_answer(connector):
+    # A closed port answers with a reset, which still measures the round trip
+    with socket.socket() as closed:
+        closed.bind(('127.0.0.1', 0))
+        port = closed.getsockname()[1]
+    rtt = connect(connector, port)
+    assert rtt is not None and 0 <= rtt < 2000
+    assert not connector.pending